@@ -35,6 +35,7 @@ class Plugin(BasePlugin):
                 short='Cancel a /tell message',
                 completion=self.completion_untell)
         self.api.add_event_handler('muc_join', self.on_join)
+        self.api.add_event_handler('muc_join_batch', self.on_join_batch)
         # {tab -> {nick -> [messages]}
         self.tabs = {}
 
@@ -48,6 +49,11 @@ class Plugin(BasePlugin):
             tab.command_say("%s: %s" % (nick, i))
         del self.tabs[tab][nick]
 
+    def on_join_batch(self, presences, tab):
+        """The users already in the room when we join it"""
+        for presence in presences:
+            self.on_join(presence, tab)
+
     def command_tell(self, args):
         """/tell <nick> <message>"""
         arg = common.shell_split(args)
@@ -384,6 +384,30 @@ def parse_str_to_secs(duration=''):
         result += int(tmp)
     return result
 
+def parse_date(text):
+    """
+    Parse a date given by the user: either a date with an optional time,
+    or a duration before now (see :py:func:`parse_str_to_secs`).
+
+    :param str text: The date (2015-01-02, 2015-01-02 10:30, 3h, 2d…).
+    :return: The local time, or None if the date is invalid.
+    :rtype: :py:class:`datetime.datetime`
+
+    >>> parse_date("2015-01-02 10:30")
+    datetime.datetime(2015, 1, 2, 10, 30)
+    """
+    text = text.strip()
+    for date_format in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M',
+                        '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    secs = parse_str_to_secs(text)
+    if secs:
+        return datetime.now() - timedelta(seconds=secs)
+    return None
+
 def parse_secs_to_str(duration=0):
     """
     Do the reverse operation of :py:func:`parse_str_to_secs`.
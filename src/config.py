@@ -17,8 +17,10 @@ import os
 import sys
 from gettext import gettext as _
 
+from collections import OrderedDict
 from configparser import RawConfigParser, NoOptionError, NoSectionError
-from os import environ, makedirs, path, remove
+from functools import lru_cache
+from os import environ, makedirs, path
 from shutil import copy2
 from args import parse_args
 
@@ -35,6 +37,7 @@ DEFAULT_CONFIG = {
         'ca_cert_path': '',
         'certificate': '',
         'ciphers': 'HIGH+kEDH:HIGH+kEECDH:HIGH:!PSK:!SRP:!3DES:!aNULL',
+        'config_save_delay': 1.0,
         'connection_check_interval': 60,
         'connection_timeout_delay': 10,
         'create_gaps': False,
@@ -65,17 +68,24 @@ DEFAULT_CONFIG = {
         'highlight_on': '',
         'ignore_certificate': False,
         'ignore_private': False,
+        'individual_join_events': False,
         'information_buffer_popup_on': 'error roster warning help info',
         'jid': '',
         'lang': 'en',
         'lazy_resize': True,
+        'lazy_text_build': False,
         'load_log': 10,
         'log_dir': '',
         'logfile': 'logs',
         'log_errors': True,
+        'log_flush': 'interval',
+        'log_flush_interval': 5.0,
+        'max_fps': 30,
         'max_lines_in_memory': 2048,
         'max_messages_in_memory': 2048,
         'max_nick_length': 25,
+        'max_open_log_files': 64,
+        'max_scrollback_pages': 10,
         'muc_history_length': 50,
         'notify_messages': True,
         'open_all_bookmarks': False,
@@ -93,6 +103,7 @@ DEFAULT_CONFIG = {
         'roster_show_offline': False,
         'roster_sort': 'jid:show',
         'save_status': True,
+        'scrollback_page_size': 200,
         'send_chat_states': True,
         'send_initial_presence': True,
         'send_os_info': True,
@@ -123,6 +134,7 @@ DEFAULT_CONFIG = {
         'vertical_tab_list_size': 20,
         'vertical_tab_list_sort': 'desc',
         'whitespace_interval': 300,
+        'wrap_cache_size': 100000,
         'words': ''
     },
     'bindings': {
@@ -139,6 +151,14 @@ class Config(RawConfigParser):
     load/save the config to a file
     """
     def __init__(self, file_name, default=None):
+        # the converted values returned by get() and get_by_tabname(), by
+        # option
+        self.values_cache = {}
+        self.tabname_cache = {}
+        # the changes not written in the file yet, by (section, option)
+        # (None for a removed option), and the handle of the next write
+        self.pending_writes = OrderedDict()
+        self.flush_handle = None
         RawConfigParser.__init__(self, None)
         # make the options case sensitive
         self.optionxform = str
@@ -147,6 +167,8 @@ class Config(RawConfigParser):
         self.default = default
 
     def read_file(self):
+        # do not read again the values we did not write yet
+        self.flush()
         try:
             RawConfigParser.read(self, self.file_name, encoding='utf-8')
         except TypeError: # python < 3.2 sucks
@@ -155,6 +177,33 @@ class Config(RawConfigParser):
         for section in ('bindings', 'var'):
             if not self.has_section(section):
                 self.add_section(section)
+        self.invalidate()
+
+    def invalidate(self, option=None):
+        """
+        Forget the cached values of an option (of all the options if
+        None), after it was changed
+        """
+        if option is None:
+            self.values_cache.clear()
+            self.tabname_cache.clear()
+        else:
+            self.values_cache.pop(option, None)
+            self.tabname_cache.pop(option, None)
+
+    def add_section(self, section):
+        RawConfigParser.add_section(self, section)
+        self.invalidate()
+
+    def remove_section(self, section):
+        res = RawConfigParser.remove_section(self, section)
+        self.invalidate()
+        return res
+
+    def remove_option(self, section, option):
+        res = RawConfigParser.remove_option(self, section, option)
+        self.invalidate(option)
+        return res
 
     def get(self, option, default=None, section=DEFSECTION):
         """
@@ -163,6 +212,21 @@ class Config(RawConfigParser):
         The type of default defines the type
         returned
         """
+        key = (section, type(default), default)
+        try:
+            return self.values_cache[option][key]
+        except KeyError:
+            pass
+        except TypeError: # unhashable default
+            return self.read_value(option, default, section)
+        res = self.read_value(option, default, section)
+        self.values_cache.setdefault(option, {})[key] = res
+        return res
+
+    def read_value(self, option, default=None, section=DEFSECTION):
+        """
+        Read and convert the value of an option, without the cache
+        """
         if default is None:
             if self.default:
                 default = self.default.get(section, {}).get(option)
@@ -193,12 +257,29 @@ class Config(RawConfigParser):
         in the section, we search for the global option if fallback is
         True. And we return `default` as a fallback as a last resort.
         """
+        key = (tabname, fallback, fallback_server, type(default), default)
+        try:
+            return self.tabname_cache[option][key]
+        except KeyError:
+            pass
+        except TypeError: # unhashable default
+            return self.read_by_tabname(option, tabname, fallback,
+                                        fallback_server, default)
+        res = self.read_by_tabname(option, tabname, fallback,
+                                   fallback_server, default)
+        self.tabname_cache.setdefault(option, {})[key] = res
+        return res
+
+    def read_by_tabname(self, option, tabname,
+                        fallback=True, fallback_server=True, default=''):
+        """
+        get_by_tabname, without the cache
+        """
         if self.default and (not default) and fallback:
             default = self.default.get(DEFSECTION, {}).get(option, '')
-        if tabname in self.sections():
-            if option in self.options(tabname):
-                # We go the tab-specific option
-                return self.get(option, default, tabname)
+        if self.has_option(tabname, option):
+            # We go the tab-specific option
+            return self.get(option, default, tabname)
         if fallback_server:
             return self.get_by_servname(tabname, option, default, fallback)
         if fallback:
@@ -210,11 +291,9 @@ class Config(RawConfigParser):
         """
         Try to get the value of an option for a server
         """
-        server = safeJID(jid).server
-        if server:
-            server = '@' + server
-            if server in self.sections() and option in self.options(server):
-                return self.get(option, default, server)
+        server = server_section(jid)
+        if server and self.has_option(server, option):
+            return self.get(option, default, server)
         if fallback:
             return self.get(option, default)
         return default
@@ -256,18 +335,89 @@ class Config(RawConfigParser):
         """
         return RawConfigParser.getboolean(self, section, option)
 
-    def write_in_file(self, section, option, value):
+    def write_in_file(self, section, option, value, now=False):
         """
         Our own way to save write the value in the file
         Just find the right section, and then find the
         right option, and edit it.
+
+        Unless now is True, the change is only written with the other
+        pending changes, a short time later (see schedule_flush).
+        """
+        self.pending_writes[(section, option)] = value
+        if now:
+            return self.flush()
+        return self.schedule_flush()
+
+    def remove_in_file(self, section, option, now=False):
+        """
+        Our own way to remove an option from the file.
+        """
+        self.pending_writes[(section, option)] = None
+        if now:
+            return self.flush()
+        return self.schedule_flush()
+
+    def schedule_flush(self):
+        """
+        Write the pending changes in config_save_delay seconds, or now if
+        the delay is 0 or if the event loop is not running. Returns False
+        if the changes were written now and that failed; a failure of the
+        delayed write is reported to on_flush_failure.
+        """
+        if self.default:
+            delay = self.get('config_save_delay')
+        else:
+            # the plugin configs, without default values, are written now
+            delay = 0
+        if delay > 0:
+            import asyncio
+            loop = asyncio.get_event_loop()
+            if loop.is_running():
+                if self.flush_handle is None:
+                    self.flush_handle = loop.call_later(delay,
+                                                        self.delayed_flush)
+                if not any(other is self for other in dirty_configs):
+                    dirty_configs.append(self)
+                return True
+        return self.flush()
+
+    def flush(self):
         """
+        Write all the pending changes in the file at once. Returns False
+        if the file could not be read or written.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending_writes:
+            return True
+        pending, self.pending_writes = self.pending_writes, OrderedDict()
         result = self._parse_file()
         if not result:
             return False
         else:
             sections, result_lines = result
 
+        for (section, option), value in pending.items():
+            if value is None:
+                self._remove_line(result_lines, section, option)
+            else:
+                self._write_line(result_lines, section, option, value)
+
+        return self._write_file(result_lines)
+
+    def delayed_flush(self):
+        """
+        Write the changes scheduled by schedule_flush, and report a failure
+        to on_flush_failure, since the callers could not know about it
+        """
+        if not self.flush() and on_flush_failure is not None:
+            on_flush_failure(self.file_name)
+
+    def _write_line(self, result_lines, section, option, value):
+        "Set the option in the lines of the file"
+        sections = parse_sections(result_lines)
         if not section in sections:
             result_lines.append('[%s]' % section)
             result_lines.append('%s = %s' % (option, value))
@@ -275,59 +425,49 @@ class Config(RawConfigParser):
             begin, end = sections[section]
             pos = find_line(result_lines, begin, end, option)
 
-            if pos is -1:
+            if pos == -1:
                 result_lines.insert(end, '%s = %s' % (option, value))
             else:
                 result_lines[pos] = '%s = %s' % (option, value)
 
-        return self._write_file(result_lines)
-
-    def remove_in_file(self, section, option):
-        """
-        Our own way to remove an option from the file.
-        """
-        result = self._parse_file()
-        if not result:
-            return False
-        else:
-            sections, result_lines = result
-
+    def _remove_line(self, result_lines, section, option):
+        "Remove the option from the lines of the file"
+        sections = parse_sections(result_lines)
         if not section in sections:
             log.error('Tried to remove the option %s from a non-'
                       'existing section (%s)', option, section)
-            return True
         else:
             begin, end = sections[section]
             pos = find_line(result_lines, begin, end, option)
 
-            if pos is -1:
+            if pos == -1:
                 log.error('Tried to remove a non-existing option %s'
                           ' from section %s', option, section)
-                return True
             else:
                 del result_lines[pos]
 
-        return self._write_file(result_lines)
-
     def _write_file(self, lines):
         """
-        Write the config file, write to a temporary file
-        before copying it to the final destination
+        Write the config file atomically: write a temporary file
+        next to it, then rename it to the final destination
         """
         try:
-            prefix, file = path.split(self.file_name)
+            # write through the symbolic links
+            file_name = path.realpath(self.file_name)
+            prefix, file = path.split(file_name)
             filename = path.join(prefix, '.%s.tmp' % file)
             fd = os.fdopen(
                     os.open(
                         filename,
-                        os.O_WRONLY | os.O_CREAT,
+                        os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
                         0o600),
-                    'w')
-            for line in lines:
-                fd.write('%s\n' % line)
-            fd.close()
-            copy2(filename, self.file_name)
-            remove(filename)
+                    'w', encoding='utf-8')
+            with fd:
+                for line in lines:
+                    fd.write('%s\n' % line)
+                fd.flush()
+                os.fsync(fd.fileno())
+            os.replace(filename, file_name)
         except:
             success = False
             log.error('Unable to save the config file.', exc_info=True)
@@ -356,36 +496,13 @@ class Config(RawConfigParser):
         else:
             lines_before = []
 
-        sections = {}
-        duplicate_section = False
-        current_section = ''
-        current_line = 0
-
-        for line in lines_before:
-            if line.startswith('['):
-                if not duplicate_section and current_section:
-                    sections[current_section][1] = current_line
+        return (parse_sections(lines_before), lines_before)
 
-                duplicate_section = False
-                current_section = line[1:-1]
-
-                if current_section in sections:
-                    log.error('Error while reading the configuration file,'
-                              ' skipping until next section')
-                    duplicate_section = True
-                else:
-                    sections[current_section] = [current_line, current_line]
-
-            current_line += 1
-        if not duplicate_section and current_section:
-            sections[current_section][1] = current_line
-
-        return (sections, lines_before)
-
-    def set_and_save(self, option, value, section=DEFSECTION):
+    def set_and_save(self, option, value, section=DEFSECTION, now=False):
         """
         set the value in the configuration then save it
-        to the file
+        to the file (right now if now is True, so that a failure
+        can be reported to the user)
         """
         # Special case for a 'toggle' value. We take the current value
         # and set the opposite. Warning if the no current value exists
@@ -409,17 +526,18 @@ class Config(RawConfigParser):
         else:
             self.add_section(section)
             RawConfigParser.set(self, section, option, value)
-        if not self.write_in_file(section, option, value):
+        self.invalidate(option)
+        if not self.write_in_file(section, option, value, now):
             return (_('Unable to write in the config file'), 'Error')
         return ("%s=%s" % (option, value), 'Info')
 
-    def remove_and_save(self, option, section=DEFSECTION):
+    def remove_and_save(self, option, section=DEFSECTION, now=False):
         """
         Remove an option and then save it the config file
         """
         if self.has_section(section):
-            RawConfigParser.remove_option(self, section, option)
-        if not self.remove_in_file(section, option):
+            self.remove_option(section, option)
+        if not self.remove_in_file(section, option, now):
             return (_('Unable to save the config file'), 'Error')
         return (_('Option %s deleted') % option, 'Info')
 
@@ -432,6 +550,7 @@ class Config(RawConfigParser):
         else:
             self.add_section(section)
             RawConfigParser.set(self, section, option, value)
+        self.invalidate(option)
         return self.write_in_file(section, option, value)
 
     def set(self, option, value, section=DEFSECTION):
@@ -442,6 +561,8 @@ class Config(RawConfigParser):
             RawConfigParser.set(self, section, option, value)
         except NoSectionError:
             pass
+        else:
+            self.invalidate(option)
 
     def to_dict(self):
         """
@@ -455,6 +576,50 @@ class Config(RawConfigParser):
         return res
 
 
+@lru_cache(maxsize=1024)
+def server_section(jid):
+    """
+    The name of the section of the server of a JID (@server), or an empty
+    string
+    """
+    server = safeJID(jid).server
+    if server:
+        return '@' + server
+    return ''
+
+def parse_sections(lines):
+    """
+    Return the start and end positions of the sections in the lines of
+    the config file, by name.
+
+    Duplicate sections are preserved but ignored for the parsing.
+    """
+    sections = {}
+    duplicate_section = False
+    current_section = ''
+    current_line = 0
+
+    for line in lines:
+        if line.startswith('['):
+            if not duplicate_section and current_section:
+                sections[current_section][1] = current_line
+
+            duplicate_section = False
+            current_section = line[1:-1]
+
+            if current_section in sections:
+                log.error('Error while reading the configuration file,'
+                          ' skipping until next section')
+                duplicate_section = True
+            else:
+                sections[current_section] = [current_line, current_line]
+
+        current_line += 1
+    if not duplicate_section and current_section:
+        sections[current_section][1] = current_line
+
+    return sections
+
 def find_line(lines, start, end, option):
     """
     Get the number of the line containing the option in the
@@ -470,6 +635,13 @@ def find_line(lines, start, end, option):
         current += 1
     return -1
 
+def flush_all():
+    """
+    Write the pending changes of all the config objects, before exiting
+    """
+    while dirty_configs:
+        dirty_configs.pop().flush()
+
 def file_ok(filepath):
     """
     Returns True if the file exists and is readable and writeable,
@@ -621,6 +793,14 @@ firstrun = False
 # Global config object. Is setup in poezio.py
 config = None
 
+# The config objects (including the plugin ones) with changes waiting to
+# be written in their file
+dirty_configs = []
+
+# Called with the name of the file when the delayed write of a config
+# object fails. Is setup in poezio.py
+on_flush_failure = None
+
 # The logger object for this module
 log = None
 
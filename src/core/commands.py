@@ -20,10 +20,13 @@ from slixmpp.xmlstream.matcher import StanzaPath
 import bookmark
 import common
 import fixes
+import log_search
 import pep
 import tabs
+import windows
 from common import safeJID
 from config import config, options as config_opts
+from logger import logger
 import multiuserchat as muc
 from plugin import PluginConfig
 from roster import roster
@@ -280,6 +283,29 @@ def command_list(self, args):
     self.xmpp.plugin['xep_0030'].get_items(jid=server,
                                            callback=cb)
 
+@command_args_parser.quoted(1, 2)
+def command_grep(self, args):
+    """
+    /grep <text> [jid] [since]
+    Opens a LogSearchTab listing the messages of the logs containing the text
+    """
+    if args is None:
+        return self.command_help('grep')
+    text = args[0]
+    if not log_search.words(text):
+        return self.information(_('The text must contain at least one word.'),
+                                'Error')
+    jids = since = None
+    for arg in args[1:]:
+        date = common.parse_date(arg)
+        if date is not None and '@' not in arg:
+            since = date
+        else:
+            jids = [safeJID(arg).full]
+    search_tab = tabs.LogSearchTab(text)
+    self.add_tab(search_tab, True)
+    search_tab.search = logger.search(text, search_tab.on_results, jids, since)
+
 @command_args_parser.quoted(1)
 def command_version(self, args):
     """
@@ -625,7 +651,7 @@ def command_set(self, args):
             else:
                 option = args[0]
                 value = args[1]
-                info = config.set_and_save(option, value)
+                info = config.set_and_save(option, value, now=True)
                 self.trigger_configuration_change(option, value)
     elif len(args) == 3:
         if '|' in args[0]:
@@ -640,12 +666,13 @@ def command_set(self, args):
                 plugin_config = PluginConfig(file_name, plugin_name)
             else:
                 plugin_config = self.plugin_manager.plugins[plugin_name].config
-            info = plugin_config.set_and_save(option, value, section)
+            info = plugin_config.set_and_save(option, value, section,
+                                              now=True)
         else:
             section = args[0]
             option = args[1]
             value = args[2]
-            info = config.set_and_save(option, value, section)
+            info = config.set_and_save(option, value, section, now=True)
             self.trigger_configuration_change(option, value)
     else:
         self.command_help('set')
@@ -1010,5 +1037,16 @@ def command_self(self):
             config_opts.version))
     self.information(info, 'Info')
 
+@command_args_parser.ignored
+def command_stats(self):
+    """
+    /stats
+    """
+    info = ('Line wrap cache: %s\nFrame scheduler: %s\nLogs writer: %s' % (
+            windows.text_win.wrap_cache.stats(),
+            self.frames.stats(),
+            logger.writer.stats()))
+    self.information(info, 'Info')
+
 def dumb_callback(*args, **kwargs):
     "mock callback"
@@ -39,6 +39,7 @@ from config import config, firstrun
 from contact import Contact, Resource
 from daemon import Executor
 from fifo import Fifo
+from frame_scheduler import FrameScheduler
 from logger import logger
 from plugin_manager import PluginManager
 from roster import roster
@@ -75,6 +76,7 @@ class Core(object):
         self.keyboard = keyboard.Keyboard()
         roster.set_node(self.xmpp.client_roster)
         decorators.refresh_wrapper.core = self
+        self.frames = FrameScheduler(self)
         self.paused = False
         self.event = Event()
         self.debug = False
@@ -443,6 +445,9 @@ class Core(object):
                 }
 
         log.error("%s received. Exiting…", signals[sig])
+        # not from the signal handler itself, it could have interrupted
+        # the logger
+        asyncio.get_event_loop().call_soon_threadsafe(logger.flush)
         if config.get('enable_user_mood'):
             self.xmpp.plugin['xep_0107'].stop()
         if config.get('enable_user_activity'):
@@ -486,6 +491,12 @@ class Core(object):
                 ' ask for help or tell us how great it is.'),
                 _('Help'))
         self.refresh_window()
+        loop = asyncio.get_event_loop()
+        logger.writer.report_failures(
+                lambda filename: loop.call_soon_threadsafe(
+                    self.information,
+                    _('Unable to write in the log file (%s)') % filename,
+                    'Error'))
         self.xmpp.plugin['xep_0012'].begin_idle(jid=self.xmpp.boundjid)
 
     def exit(self, event=None):
@@ -1184,6 +1195,23 @@ class Core(object):
         self.refresh_window()
         return new_tab
 
+    def show_log_position(self, log_name, offset):
+        """
+        Show the message at offset in the log file log_name, in the tab
+        of its conversation (opened if it is a contact)
+        """
+        for tab in self.get_tabs(tabs.ChatTab):
+            if tab.log_name() == log_name:
+                self.command_win('%s' % tab.nb)
+                break
+        else:
+            jid = log_name.replace('\\', '/')
+            if jid not in roster:
+                return self.information(_('Open the tab of %s to see this '
+                                          'message.') % jid, 'Info')
+            tab = self.open_conversation_window(jid)
+        tab.show_logs_around(offset)
+
     def open_private_window(self, room_name, user_nick, focus=True):
         """
         Open a Private conversation in a MUC and focus if needed.
@@ -1307,10 +1335,8 @@ class Core(object):
                 self.tabs[nb] = tabs.GapTab()
         else:
             self.tabs.remove(tab)
-        if tab and tab.name in logger.fds:
-            logger.fds[tab.name].close()
-            log.debug("Log file for %s closed.", tab.name)
-            del logger.fds[tab.name]
+        if tab:
+            logger.close(tab.name)
         if self.current_tab_nb >= len(self.tabs):
             self.current_tab_nb = len(self.tabs) - 1
         while not self.tabs[self.current_tab_nb]:
@@ -1400,6 +1426,12 @@ class Core(object):
         return self.information_buffer
 
     def refresh_window(self):
+        """
+        Refresh everything, during the next frame
+        """
+        self.frames.refresh_all()
+
+    def refresh_window_now(self):
         """
         Refresh everything
         """
@@ -1644,6 +1676,9 @@ class Core(object):
                 tab.resize()
         if self.tabs:
             self.full_screen_redraw()
+        log.debug('Line wrap cache: %s', windows.text_win.wrap_cache.stats())
+        log.debug('Frame scheduler: %s', self.frames.stats())
+        log.debug('Logs writer: %s', logger.writer.stats())
 
     def read_keyboard(self):
         """
@@ -1784,6 +1819,14 @@ class Core(object):
                     "_name is provided, set that theme before reloading it."),
                 shortdesc=_('Load a theme'),
                 completion=self.completion_theme)
+        self.register_command('grep', self.command_grep,
+                usage=_('<text> [jid] [since]'),
+                desc=_("Search the messages containing the text in the "
+                    "logs (only in the logs of the jid if given, and only "
+                    "the messages logged since a date or duration, see "
+                    "/history, if given). The results are listed in a new "
+                    "tab."),
+                shortdesc=_('Search in the logs.'))
         self.register_command('list', self.command_list,
                 usage=_('[server]'),
                 desc=_("Get the list of public chatrooms"
@@ -1857,6 +1900,9 @@ class Core(object):
                 completion=self.completion_runkey)
         self.register_command('self', self.command_self,
                 shortdesc=_('Remind you of who you are.'))
+        self.register_command('stats', self.command_stats,
+                shortdesc=_('Show the statistics of the caches and of the '
+                            'logs writer.'))
         self.register_command('last_activity', self.command_last_activity,
                 usage='<jid>',
                 desc=_('Informs you of the last activity of a JID.'),
@@ -1959,6 +2005,7 @@ class Core(object):
     command_win = commands.command_win
     command_move_tab = commands.command_move_tab
     command_list = commands.command_list
+    command_grep = commands.command_grep
     command_version = commands.command_version
     command_join = commands.command_join
     command_bookmark_local = commands.command_bookmark_local
@@ -1986,6 +2033,7 @@ class Core(object):
     command_xml_tab = commands.command_xml_tab
     command_adhoc = commands.command_adhoc
     command_self = commands.command_self
+    command_stats = commands.command_stats
     completion_help = completions.completion_help
     completion_status = completions.completion_status
     completion_presence = completions.completion_presence
@@ -263,7 +263,9 @@ def on_normal_message(self, message):
                 history=delayed,
                 identifier=message['id'],
                 jid=jid,
-                typ=1)
+                typ=1,
+                highlight=(not own and
+                           conversation.highlight_matcher().search(body)))
 
     if conversation.remote_wants_chatstates is None and not delayed:
         if message['chat_state']:
@@ -480,6 +482,12 @@ def on_groupchat_message(self, message):
             replaced = True
         except CorrectionError:
             log.debug('Unable to correct a message', exc_info=True)
+    if not replaced and delayed and tab.receiving_history:
+        # the history is added all at once when the join is complete
+        tab.add_history_message(body, date, nick_from, history=delayed,
+                                identifier=message['id'],
+                                jid=message['from'], typ=1)
+        return
     if not replaced and tab.add_message(body, date, nick_from, history=delayed, identifier=message['id'], jid=message['from'], typ=1):
         self.events.trigger('highlight', message, tab)
 
@@ -487,16 +495,12 @@ def on_groupchat_message(self, message):
         tab.last_sent_message = message
 
     if tab is self.current_tab():
-        tab.text_win.refresh()
-        tab.info_header.refresh(tab, tab.text_win)
-        tab.input.refresh()
-        self.doupdate()
+        self.frames.refresh(tab.text_win.refresh, tab=tab)
+        self.frames.refresh(tab.info_header.refresh, tab, tab.text_win,
+                            tab=tab)
+        self.frames.refresh(tab.input.refresh, tab=tab)
     elif tab.state != old_state:
-        self.refresh_tab_win()
-        current = self.current_tab()
-        if hasattr(current, 'input') and current.input:
-            current.input.refresh()
-        self.doupdate()
+        self.frames.refresh(self.refresh_tab_win)
 
     if 'message' in config.get('beep_on').split():
         if (not config.get_by_tabname('disable_beep', room_from)
@@ -558,7 +562,8 @@ def on_groupchat_private_message(self, message):
                         forced_user=user,
                         identifier=message['id'],
                         jid=message['from'],
-                        typ=1)
+                        typ=1,
+                        highlight=tab.highlight_matcher().search(body))
 
     if tab.remote_wants_chatstates is None:
         if message['chat_state']:
@@ -781,8 +786,7 @@ def on_got_offline(self, presence):
     if presence.match('presence/muc') or presence.xml.find('{http://jabber.org/protocol/muc#user}x'):
         return
     jid = presence['from']
-    if not logger.log_roster_change(jid.bare, 'got offline'):
-        self.information(_('Unable to write in the log file'), 'Error')
+    logger.log_roster_change(jid.bare, 'got offline')
     # If a resource got offline, display the message in the conversation with this
     # precise resource.
     if jid.resource:
@@ -805,8 +809,7 @@ def on_got_online(self, presence):
         # Todo, handle presence coming from contacts not in roster
         return
     roster.modified()
-    if not logger.log_roster_change(jid.bare, 'got online'):
-        self.information(_('Unable to write in the log file'), 'Error')
+    logger.log_roster_change(jid.bare, 'got online')
     resource = Resource(jid.full, {
         'priority': presence.get_priority() or 0,
         'status': presence['status'],
@@ -1020,6 +1023,8 @@ def on_groupchat_subject(self, message):
     subject = message['subject']
     if subject is None or not tab:
         return
+    # The subject is sent after the history, when joining a room
+    tab.end_of_history()
     if subject != tab.topic:
         # Do not display the message if the subject did not change or if we
         # receive an empty topic when joining the room.
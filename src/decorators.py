@@ -38,7 +38,7 @@ class RefreshWrapper(object):
         def wrap(*args, **kwargs):
             ret = func(*args, **kwargs)
             if self.core:
-                self.core.doupdate()
+                self.core.frames.update()
             return ret
         return wrap
 
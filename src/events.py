@@ -38,6 +38,7 @@ class EventHandler(object):
             'normal_presence': [],
             'muc_presence': [],
             'muc_join': [],
+            'muc_join_batch': [],
             'joining_muc': [],
             'changing_nick': [],
             'muc_kick': [],
@@ -0,0 +1,98 @@
+"""
+The frame scheduler coalesces the refreshes of the screen.
+
+Instead of refreshing the windows as soon as something changes, the code
+marks them as dirty with :py:func:`FrameScheduler.refresh` (or asks for a
+refresh of the whole current tab with
+:py:func:`FrameScheduler.refresh_all`), and all of them are refreshed at
+once, followed by a single curses update, from the asyncio loop. There are
+at most max_fps frames per second, so a burst of messages or presences
+only triggers a few redraws.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import config
+
+class FrameScheduler(object):
+    def __init__(self, core=None):
+        self.core = core
+        # the functions to call during the next frame (with the tab they
+        # are restricted to) and their arguments
+        self.dirty = OrderedDict()
+        # Whether the whole current tab has to be refreshed
+        self.full = False
+        # Whether curses.doupdate() has to be called
+        self.update_needed = False
+        # The asyncio handle of the next frame
+        self.handle = None
+        self.last_frame = 0
+        self.frames = 0
+        self.requests = 0
+
+    def refresh(self, func, *args, tab=None):
+        """
+        Call func(*args) during the next frame. If a tab is given, it is
+        only called if that tab is still the current one. If the same
+        function is given several times, it is only called once, with the
+        last arguments, and at the position of the last request (so that
+        the input, refreshed last, keeps the cursor).
+        """
+        self.requests += 1
+        self.dirty.pop((func, tab), None)
+        self.dirty[(func, tab)] = args
+        self.schedule()
+
+    def refresh_all(self):
+        "Refresh the whole current tab during the next frame"
+        self.requests += 1
+        self.full = True
+        self.schedule()
+
+    def update(self):
+        "Only update the screen during the next frame"
+        self.requests += 1
+        self.update_needed = True
+        self.schedule()
+
+    def schedule(self):
+        "Make sure the next frame is scheduled"
+        if self.handle is not None:
+            return
+        max_fps = config.get('max_fps')
+        if max_fps <= 0:
+            return self.flush()
+        delay = self.last_frame + 1 / max_fps - time.monotonic()
+        loop = asyncio.get_event_loop()
+        if delay <= 0:
+            self.handle = loop.call_soon(self.flush)
+        else:
+            self.handle = loop.call_later(delay, self.flush)
+
+    def flush(self):
+        "Draw the frame now"
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if not self.full and not self.dirty and not self.update_needed:
+            return
+        dirty, self.dirty = self.dirty, OrderedDict()
+        full, self.full = self.full, False
+        self.update_needed = False
+        self.last_frame = time.monotonic()
+        self.frames += 1
+        if full:
+            self.core.refresh_window_now()
+            return
+        current = self.core.current_tab()
+        for (func, tab), args in dirty.items():
+            if tab is None or tab is current:
+                func(*args)
+        self.core.doupdate()
+
+    def stats(self):
+        "Return a short description of the work of the scheduler"
+        return '%s refresh requests in %s frames' % (self.requests,
+                                                     self.frames)
@@ -0,0 +1,80 @@
+"""
+Find the highlights in the messages.
+
+A message highlights us if it contains our nick (as a whole word), or one of
+the words of the highlight_on option. Both are compiled into a single
+regular expression, and the matchers are shared by all the tabs using the
+same nick and words (see :py:func:`get_matcher`).
+"""
+
+import re
+from functools import lru_cache
+
+# Above that number of highlight words, they are merged into a trie, so
+# that the regular expression does not try each of them at each position
+TRIE_THRESHOLD = 10
+
+def trie_pattern(words):
+    """
+    Build a regular expression matching any of the words, in which the
+    common prefixes are only written once
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _node_pattern(trie)
+
+def _node_pattern(node):
+    alternatives = [re.escape(char) + _node_pattern(child)
+                    for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1:
+        pattern = alternatives[0]
+        if '' in node:
+            pattern = '(?:%s)?' % pattern
+        return pattern
+    pattern = '(?:%s)' % '|'.join(alternatives)
+    if '' in node:
+        pattern += '?'
+    return pattern
+
+class Matcher(object):
+    """
+    Search our nick and the highlight words in a text, without taking
+    the case into account
+    """
+    def __init__(self, nick, words):
+        self.nick = nick
+        self.words = [word for word in words.split(':') if word]
+        patterns = []
+        if nick:
+            # like \b, but also for the nicks starting or ending with
+            # something else than a letter
+            patterns.append(r'(?<!\w)%s(?!\w)' % re.escape(nick))
+        if len(self.words) > TRIE_THRESHOLD:
+            patterns.append(trie_pattern(self.words))
+        else:
+            patterns.extend(re.escape(word) for word in self.words)
+        if patterns:
+            self.regex = re.compile('|'.join(patterns), re.IGNORECASE)
+        else:
+            self.regex = None
+
+    def search(self, txt):
+        "Whether the text highlights us"
+        return self.regex is not None and self.regex.search(txt) is not None
+
+    def __repr__(self):
+        return '<Matcher %r %r>' % (self.nick, self.words)
+
+@lru_cache(maxsize=64)
+def get_matcher(nick, words):
+    """
+    Get the matcher for this nick and these highlight words (the value
+    of the highlight_on option)
+    """
+    return Matcher(nick, words)
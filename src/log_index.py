@@ -0,0 +1,238 @@
+"""
+The offset indexes of the log files.
+
+For each log file, a file of the same name in the .index directory of
+log_dir keeps one fixed-size record per message of the log: the offset of
+the message in the log file, and its date (a UTC timestamp). They are
+appended by the logs writer after each write (see logger.LogWriter), and
+allow to find the nth message of a log, or the first message after a
+date, without reading the log.
+
+The indexes of existing logs are built (or updated) when poezio opens
+them, or by running this module:
+
+    python3 src/log_index.py [--rebuild] logfile [logfile ...]
+"""
+
+import calendar
+import mmap
+import os
+import re
+import struct
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+# offset, timestamp
+RECORD = struct.Struct('<QQ')
+
+INDEX_DIR = '.index'
+
+# The first line of a message of a log file:
+# 'MR 20150102T03:04:05Z 002 <nick> \xa0text' for a message, and
+# 'MI 20150102T03:04:05Z 002 text' for an information message, where 002
+# is the number of lines of the message after the first one.
+message_line_re = re.compile(r'M(?:(R)|I) '
+                             r'(\d{8})T(\d{2}):(\d{2}):(\d{2})Z '
+                             r'(\d+) (?(1)<([^\xa0]+)> \xa0)(.*)')
+
+# The parsed first line of a message: its date (a UTC timestamp), its
+# number of lines after the first one, its nickname (None for an
+# information message) and its first line
+LogLine = namedtuple('LogLine', 'time nb_lines nickname text')
+
+def parse_message_line(line):
+    """
+    Parse the first line of a message of a log file, and return its
+    LogLine, or None if it is not valid
+    """
+    match = message_line_re.match(line)
+    if match is None:
+        return None
+    _, day, hours, minutes, seconds, nb_lines, nickname, text = \
+            match.groups()
+    return LogLine(day_time(day) + int(hours) * 3600 + int(minutes) * 60 +
+                   int(seconds), int(nb_lines), nickname, text)
+
+def log_files(log_dir):
+    "The names of the log files of the conversations in log_dir"
+    try:
+        return sorted(filename for filename in os.listdir(log_dir)
+                      if not filename.startswith('.') and
+                      filename != 'roster.log' and
+                      os.path.isfile(os.path.join(log_dir, filename)))
+    except OSError:
+        return []
+
+def index_path(log_dir, filename):
+    "The path of the index of a log file"
+    return os.path.join(log_dir, INDEX_DIR, filename)
+
+@lru_cache(maxsize=1024)
+def day_time(day):
+    "The UTC timestamp of the start of a day (b'20150102' or '20150102')"
+    return calendar.timegm((int(day[0:4]), int(day[4:6]), int(day[6:8]),
+                            0, 0, 0, 0, 0, 0))
+
+def header_time(data, offset=0):
+    """
+    The UTC timestamp of the message header at offset in data
+    (b'MR 20150102T03:04:05Z …'), or None if it is not a valid header
+    """
+    header = data[offset+3:offset+20]
+    try:
+        return (day_time(header[:8]) + int(header[9:11]) * 3600 +
+                int(header[12:14]) * 60 + int(header[15:17]))
+    except ValueError:
+        return None
+
+def scan(data, start=0, end=None):
+    """
+    Yield the offsets of the messages of the log data, from the one at
+    start (which must be the start of a message) to end
+    """
+    if end is None:
+        end = len(data)
+    if start == 0 and end > 0 and data[:1] == b'M':
+        yield 0
+    pos = data.find(b'\nM', start, end)
+    while pos != -1:
+        yield pos + 1
+        pos = data.find(b'\nM', pos + 1, end)
+
+class LogIndex(object):
+    """
+    Read the index of a log file. The records are read from a mmap of the
+    file, so opening an index is cheap whatever its size.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.length = 0
+        try:
+            with open(path, 'rb') as fd:
+                size = os.fstat(fd.fileno()).st_size
+                self.length = size // RECORD.size
+                if self.length:
+                    self.map = mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def entry(self, n):
+        "The (offset, timestamp) of the nth message"
+        return RECORD.unpack_from(self.map, n * RECORD.size)
+
+    def offset(self, n):
+        "The offset of the nth message"
+        return self.entry(n)[0]
+
+    def count_before(self, offset):
+        "The number of messages starting before offset"
+        lo, hi = 0, self.length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find_time(self, timestamp):
+        "The number of the first message dated timestamp or later"
+        lo, hi = 0, self.length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[1] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def covers(self, data, end):
+        """
+        Whether the index is consistent with the log data, and lists all
+        its messages before end
+        """
+        if not self.length:
+            return next(scan(data, 0, end), None) is None
+        last = self.offset(self.length - 1)
+        if last >= len(data) or data[last:last+1] != b'M':
+            return False
+        return last >= end or data.find(b'\nM', last, end) == -1
+
+def update_index(log_path, path, rebuild=False):
+    """
+    Add the messages missing from the index of a log file (all of them if
+    rebuild is True, or if the index does not match the log). Return the
+    number of messages added.
+    """
+    try:
+        with open(log_path, 'rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            data = mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) if size else b''
+    except FileNotFoundError:
+        return 0
+    try:
+        start = 0
+        with LogIndex(path) as index:
+            if not rebuild and len(index):
+                last, _ = index.entry(len(index) - 1)
+                if last < size and data[last:last+1] == b'M':
+                    start = last
+                else:
+                    rebuild = True
+            elif not len(index):
+                rebuild = True
+            length = len(index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        records = []
+        for offset in scan(data, start):
+            if offset == start and not rebuild:
+                continue
+            records.append(RECORD.pack(offset, header_time(data, offset) or 0))
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as fd:
+            if rebuild:
+                fd.truncate(0)
+            else:
+                # drop a partially written record
+                fd.truncate(length * RECORD.size)
+            fd.seek(0, os.SEEK_END)
+            fd.write(b''.join(records))
+        return len(records)
+    finally:
+        if size:
+            data.close()
+
+def main():
+    "Build the indexes of the log files given on the command line"
+    args = sys.argv[1:]
+    rebuild = '--rebuild' in args
+    if rebuild:
+        args.remove('--rebuild')
+    if not args:
+        print('usage: %s [--rebuild] logfile [logfile ...]' % sys.argv[0])
+        return 1
+    for log_path in args:
+        log_path = os.path.abspath(log_path)
+        log_dir, filename = os.path.split(log_path)
+        added = update_index(log_path, index_path(log_dir, filename), rebuild)
+        print('%s: %s messages indexed' % (filename, added))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+The full-text search indexes of the log files.
+
+For each log file, a file of the same name in the .search directory of
+log_dir lists, for each word of each message, the hash of the word and the
+offset of the message in the log, packed in a 64 bits integer (a record).
+It is made of runs, each of them sorted, so that the messages containing a
+word are found with a binary search in each run. A run is appended after
+each write in the log (see logger.LogWriter), and the last runs are merged
+as long as they have about the same size, so that there are only O(log n)
+of them.
+
+Each run starts with the number of its records, and the offset up to
+which the log was indexed, so that indexing existing logs (see
+:py:func:`build`) can be interrupted and resumed at any time.
+"""
+
+import mmap
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+
+import log_index
+
+# number of records, end of the indexed part of the log
+HEADER = struct.Struct('<QQ')
+# word hash (24 bits), message offset (40 bits)
+RECORD = struct.Struct('<Q')
+OFFSET_BITS = 40
+
+SEARCH_DIR = '.search'
+
+# the length of the header of the messages in the log files
+# ('MR 20150102T03:04:05Z 000 '), which is not indexed
+MESSAGE_HEADER_LENGTH = 26
+
+WORD_RE = re.compile(r'\w+')
+
+# the number of messages indexed at once when building an index
+BUILD_CHUNK = 10000
+
+Run = namedtuple('Run', 'start count end')
+
+def search_path(log_dir, filename):
+    "The path of the search index of a log file"
+    return os.path.join(log_dir, SEARCH_DIR, filename)
+
+def words(text):
+    "The set of the (lowercase) words of a text"
+    return set(WORD_RE.findall(text.lower()))
+
+def word_hash(word):
+    return zlib.crc32(word.encode('utf-8')) >> 8
+
+def record(word, offset):
+    "The record of a word hash in the message at offset"
+    return word << OFFSET_BITS | offset
+
+def record_offset(record):
+    return record & ((1 << OFFSET_BITS) - 1)
+
+def message_records(text, offset):
+    "The records of a message of the log (with its header)"
+    return [record(word_hash(word), offset)
+            for word in words(text[MESSAGE_HEADER_LENGTH:])]
+
+def read_runs(fd):
+    """
+    Read the headers of the runs of an open search index. A run which is
+    not complete (because poezio was interrupted while writing it) is
+    ignored.
+    """
+    size = os.fstat(fd.fileno()).st_size
+    runs = []
+    pos = 0
+    while pos + HEADER.size <= size:
+        fd.seek(pos)
+        count, end = HEADER.unpack(fd.read(HEADER.size))
+        next_pos = pos + HEADER.size + count * RECORD.size
+        if next_pos > size:
+            break
+        runs.append(Run(pos, count, end))
+        pos = next_pos
+    return runs
+
+def indexed_end(path):
+    "The offset up to which the log of a search index is indexed"
+    try:
+        with open(path, 'rb') as fd:
+            runs = read_runs(fd)
+    except OSError:
+        return 0
+    return runs[-1].end if runs else 0
+
+def read_records(fd, run):
+    fd.seek(run.start + HEADER.size)
+    records = array('Q', fd.read(run.count * RECORD.size))
+    if sys.byteorder != 'little':
+        records.byteswap()
+    return records.tolist()
+
+def pack_records(records):
+    records = array('Q', records)
+    if sys.byteorder != 'little':
+        records.byteswap()
+    return records.tobytes()
+
+def append_run(path, records, end):
+    """
+    Add the records of the messages of the log up to end to a search
+    index, merging the last runs if needed
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as fd:
+        runs = read_runs(fd)
+        records = sorted(records)
+        while runs and runs[-1].count <= 2 * len(records):
+            run = runs.pop()
+            records = sorted(read_records(fd, run) + records)
+        pos = runs[-1].start + HEADER.size + runs[-1].count * RECORD.size \
+                if runs else 0
+        fd.seek(pos)
+        fd.write(HEADER.pack(len(records), end) + pack_records(records))
+        fd.truncate()
+
+def build(log_path, path, nb=BUILD_CHUNK):
+    """
+    Index (at most nb of) the messages of a log file which are not in its
+    search index yet. Return True if the whole log is indexed.
+    """
+    end = indexed_end(path)
+    try:
+        with open(log_path, 'rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if end > size:
+                # not the same log anymore
+                os.remove(path)
+                end = 0
+            if end == size:
+                return True
+            with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+                offsets = []
+                if data[end:end+1] == b'M':
+                    offsets.append(end)
+                for offset in log_index.scan(data, end):
+                    if offset != end:
+                        offsets.append(offset)
+                    if len(offsets) > nb:
+                        break
+                if len(offsets) > nb:
+                    new_end = offsets.pop()
+                else:
+                    new_end = size
+                records = []
+                for offset, next_offset in zip(offsets, offsets[1:] + [new_end]):
+                    text = data[offset:next_offset].decode(errors='replace')
+                    records.extend(message_records(text, offset))
+    except FileNotFoundError:
+        return True
+    append_run(path, records, new_end)
+    return new_end == size
+
+def search(path, hashes, since=0):
+    """
+    Return the sorted offsets of the messages (from the offset since)
+    containing all the words of the given hashes
+    """
+    try:
+        fd = open(path, 'rb')
+    except OSError:
+        return []
+    with fd:
+        runs = read_runs(fd)
+        if not runs or not hashes:
+            return []
+        with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+            found = None
+            for word in hashes:
+                offsets = set()
+                for run in runs:
+                    offsets.update(search_run(data, run, word))
+                found = offsets if found is None else found & offsets
+                if not found:
+                    return []
+    return sorted(offset for offset in found if offset >= since)
+
+def search_run(data, run, word):
+    "Return the offsets of the messages with that word in a run"
+    start = run.start + HEADER.size
+    first = bisect_run(data, start, run.count, record(word, 0))
+    last = bisect_run(data, start, run.count, record(word + 1, 0))
+    records = array('Q', data[start + first * RECORD.size:
+                              start + last * RECORD.size])
+    if sys.byteorder != 'little':
+        records.byteswap()
+    return [record_offset(record) for record in records]
+
+def bisect_run(data, start, count, key):
+    "The position of the first record of a run not lower than key"
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if RECORD.unpack_from(data, start + mid * RECORD.size)[0] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+This file is a standalone program that builds the offset and search
+indexes of all the log files (see log_index and log_search), and computes
+statistics on the conversations, using all the processors of the machine.
+
+Usage: ./log_stats.py [-j JOBS] [-o STATS_FILE] [--rebuild] [log_dir]
+
+The log files are processed in parallel, one by worker process, and read
+through mmap, so that even the largest logs are never loaded in memory.
+The statistics of each log file (number of messages and of status
+messages, messages by nick and by hour of the day (UTC), date of the
+first and last messages) are written as JSON, on the standard output by
+default.
+
+Poezio should not be running while the indexes are built, since it
+updates them too.
+"""
+
+import json
+import mmap
+import os
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import log_index
+import log_search
+
+def empty_stats():
+    return {'size': 0,
+            'messages': 0,
+            'infos': 0,
+            'nicks': {},
+            'hours': [0] * 24,
+            'first': None,
+            'last': None}
+
+def log_stats(data):
+    "The statistics of the log data (a bytes-like object)"
+    stats = empty_stats()
+    stats['size'] = len(data)
+    nicks = Counter()
+    hours = stats['hours']
+    for offset in log_index.scan(data):
+        end = data.find(b'\n', offset)
+        if end == -1:
+            end = len(data)
+        parsed = log_index.parse_message_line(
+            data[offset:end].decode('utf-8', errors='replace'))
+        if parsed is None:
+            continue
+        if parsed.nickname is None:
+            stats['infos'] += 1
+        else:
+            stats['messages'] += 1
+            nicks[parsed.nickname] += 1
+            hours[parsed.time // 3600 % 24] += 1
+        if stats['first'] is None:
+            stats['first'] = parsed.time
+        stats['last'] = parsed.time
+    stats['nicks'] = dict(nicks)
+    return stats
+
+def process_file(log_dir, filename, index=True, rebuild=False):
+    """
+    Build the indexes of a log file (if index is True), and return its
+    statistics
+    """
+    log_path = os.path.join(log_dir, filename)
+    if index:
+        log_index.update_index(log_path,
+                               log_index.index_path(log_dir, filename),
+                               rebuild)
+        search_path = log_search.search_path(log_dir, filename)
+        if rebuild and os.path.exists(search_path):
+            os.remove(search_path)
+        while not log_search.build(log_path, search_path):
+            pass
+    with open(log_path, 'rb') as fd:
+        if not os.fstat(fd.fileno()).st_size:
+            return empty_stats()
+        with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+            return log_stats(data)
+
+def process_all(log_dir, jobs=None, index=True, rebuild=False,
+                progress=None):
+    """
+    Process all the log files of log_dir with a pool of jobs processes,
+    and return their statistics, by file name. progress is called with the
+    name of each file, once it has been processed.
+    """
+    filenames = log_index.log_files(log_dir)
+    # start with the largest files, so that a large file at the end does
+    # not keep a single worker busy while the others are idle
+    filenames.sort(key=lambda filename: -os.path.getsize(
+        os.path.join(log_dir, filename)))
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(process_file, log_dir, filename,
+                                   index, rebuild): filename
+                   for filename in filenames}
+        for future in as_completed(futures):
+            filename = futures[future]
+            results[filename] = future.result()
+            if progress is not None:
+                progress(filename)
+    return results
+
+def default_log_dir(config_file=None):
+    "The log directory set in the poezio configuration"
+    import config
+    config_path = config.check_create_config_dir()
+    config.config = config.Config(
+        config_file or os.path.join(config_path, 'poezio.cfg'),
+        config.DEFAULT_CONFIG)
+    config.check_create_log_dir()
+    return os.path.join(config.LOG_DIR, 'logs')
+
+def main():
+    parser = ArgumentParser(description='Index the poezio logs, and compute '
+                                        'statistics on the conversations')
+    parser.add_argument('log_dir', nargs='?',
+                        help='The directory of the logs (by default, the '
+                             'one of the poezio configuration)')
+    parser.add_argument('-f', '--file', dest='config_file',
+                        help='The config file of poezio',
+                        metavar='CONFIG_FILE')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='The number of processes (by default, the '
+                             'number of processors)')
+    parser.add_argument('-o', '--output',
+                        help='The file where the statistics are written '
+                             '(by default, the standard output)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Build the indexes again from scratch')
+    parser.add_argument('--no-index', dest='index', action='store_false',
+                        help='Only compute the statistics')
+    args = parser.parse_args()
+    log_dir = args.log_dir or default_log_dir(args.config_file)
+    if not os.path.isdir(log_dir):
+        sys.stderr.write('%s: no such directory\n' % log_dir)
+        return 1
+
+    done = []
+    nb_files = len(log_index.log_files(log_dir))
+    def progress(filename):
+        done.append(filename)
+        sys.stderr.write('[%s/%s] %s\n' % (len(done), nb_files, filename))
+    results = process_all(log_dir, args.jobs, args.index, args.rebuild,
+                          progress)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fd:
+            json.dump(results, fd, sort_keys=True, separators=(',', ':'))
+    else:
+        json.dump(results, sys.stdout, sort_keys=True, separators=(',', ':'))
+        sys.stdout.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
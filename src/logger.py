@@ -10,14 +10,22 @@ The logger module that handles logging of the poezio
 conversations and roster changes
 """
 
+import calendar
 import mmap
 import os
-import re
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from os import makedirs
 from datetime import datetime
 
 import common
+import log_index
+import log_search
 from config import config
+from log_index import parse_message_line
 from xhtml import clean_text
 from theming import dump_tuple, get_theme
 
@@ -29,51 +37,601 @@ from config import LOG_DIR
 
 log_dir = os.path.join(LOG_DIR, 'logs')
 
-message_log_re = re.compile(r'MR (\d{4})(\d{2})(\d{2})T'
-                            r'(\d{2}):(\d{2}):(\d{2})Z '
-                            r'(\d+) <([^ ]+)>  (.*)')
-info_log_re = re.compile(r'MI (\d{4})(\d{2})(\d{2})T'
-                         r'(\d{2}):(\d{2}):(\d{2})Z '
-                         r'(\d+) (.*)')
+def parse_log_messages(chunks, color=''):
+    """
+    Convert the (offset, text) of messages read in a log file into dicts
+    of the arguments of TextBuffer.add_message, with their offset
+    """
+    messages = []
+    for offset, text in chunks:
+        lines = text.split('\n')
+        parsed = parse_message_line(lines[0])
+        if parsed is None:
+            log.debug('format? %r', lines[0])
+            continue
+        timestamp, nb_lines, nickname, first_line = parsed
+        message = {'history': True,
+                   'offset': offset,
+                   'time': datetime.fromtimestamp(timestamp)}
+        if nickname is not None:
+            message['nickname'] = nickname
+        if nb_lines:
+            message['txt'] = '\n'.join([color + first_line] +
+                                       [line[1:] for line in
+                                        lines[1:nb_lines+1]])
+        else:
+            message['txt'] = color + first_line
+        messages.append(message)
+    return messages
+
+# Above that size (in characters), the buffer of a file is written even if
+# it is not the time yet
+MAX_BUFFER_SIZE = 65536
+
+# The maximum number of results of a search, in each file
+MAX_SEARCH_RESULTS = 1000
+
+def format_message(date, nick, msg, typ):
+    """
+    Format a message the way it is written in the log files (the date is
+    the UTC time)
+    """
+    msg = clean_text(msg)
+    str_time = date.strftime('%Y%m%dT%H:%M:%SZ')
+    if typ == 1:
+        prefix = 'MR'
+    else:
+        prefix = 'MI'
+    lines = msg.split('\n')
+    first_line = lines.pop(0)
+    nb_lines = str(len(lines)).zfill(3)
+    if nick:
+        nick = '<' + nick + '>'
+        text = ' '.join((prefix, str_time, nb_lines, nick, ' '+first_line, '\n'))
+    else:
+        text = ' '.join((prefix, str_time, nb_lines, first_line, '\n'))
+    return text + ''.join(' %s\n' % line for line in lines)
+
+def format_roster_change(date, jid, message):
+    "Format a roster change the way it is written in roster.log"
+    str_time = date.strftime('%Y%m%dT%H:%M:%SZ')
+    message = clean_text(message)
+    lines = message.split('\n')
+    first_line = lines.pop(0)
+    nb_lines = str(len(lines)).zfill(3)
+    text = 'MI %s %s %s %s\n' % (str_time, nb_lines, jid, first_line)
+    return text + ''.join(' %s\n' % line for line in lines)
+
+class LogSearch(object):
+    """
+    A search of a text in log files, run file by file by the LogWriter.
+    The messages containing all the words of the text are found with the
+    search indexes, and those actually containing the text are sent to
+    callback (a list of message dicts, see parse_log_messages, with the
+    'jid' of their log file), newest first, for each file. None is sent
+    at the end of the search.
+    """
+    def __init__(self, text, filenames, since, callback):
+        self.text = text.lower()
+        self.hashes = [log_search.word_hash(word)
+                       for word in log_search.words(text)]
+        # None for all the log files
+        self.filenames = filenames
+        # the UTC timestamp of the oldest messages to find, or None
+        self.since = since
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def match(self, filename, log_path, offsets):
+        "The messages at these offsets of a log file containing the text"
+        if not offsets:
+            return []
+        with open(log_path, 'rb') as fd:
+            with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as data:
+                chunks = []
+                for offset in offsets[-MAX_SEARCH_RESULTS:]:
+                    end = data.find(b'\nM', offset)
+                    end = len(data) if end == -1 else end + 1
+                    chunks.append((offset, data[offset:end].decode(errors='replace')))
+        messages = [message for message in parse_log_messages(chunks)
+                    if self.text in message['txt'].lower()]
+        for message in messages:
+            message['jid'] = filename
+        messages.reverse()
+        return messages
+
+class LogFile(object):
+    """
+    An open log file, its index (None if it can not be written), and the
+    offset up to which its search index is up to date
+    """
+    __slots__ = ('fd', 'index', 'search_end')
+
+    def __init__(self, fd, index, search_end):
+        self.fd = fd
+        self.index = index
+        self.search_end = search_end
+
+    def close(self):
+        try:
+            if self.index is not None:
+                self.index.close()
+        finally:
+            self.fd.close()
+
+class LogWriter(threading.Thread):
+    """
+    The thread formatting and writing the logs.
+
+    The records are sent to it through a queue, and kept in a buffer per
+    file until they are written, depending on the mode:
+    always: after each record
+    interval: when the oldest buffered record is older than interval
+    exit: only when the writer is stopped
+    In every mode, a file is also written when its buffer is larger than
+    MAX_BUFFER_SIZE, and all of them when flush() is called.
+
+    After each write in a log file, the offsets and dates of the new
+    messages are appended to its index (see log_index), and their words
+    to its search index (see log_search), if it is up to date. The search
+    indexes of the other files are built by the searches.
+
+    Everything but the public methods runs in the thread, which is the
+    only one using the file objects.
+
+    When a record cannot be formatted or written, the callback given to
+    report_failures() is called with the filename, from the thread; only
+    once for the consecutive failures of a file. The failures happening
+    before it is given are reported then.
+    """
+    def __init__(self, mode='interval', interval=5.0, max_open=64):
+        threading.Thread.__init__(self, name='poezio logs writer')
+        self.daemon = True
+        self.mode = mode
+        self.interval = interval
+        # the maximum number of open files (no limit if <= 0)
+        self.max_open = max_open
+        self.queue = queue.Queue()
+        # a dict of filename: LogFile (opened), the least recently
+        # written first
+        self.fds = OrderedDict()
+        # the files closed to stay under max_open, to count the reopenings
+        self.evicted = set()
+        # the (encoded text, UTC timestamp) of the records not written
+        # yet, by filename, and their size
+        self.buffers = OrderedDict()
+        self.buffered = {}
+        # when the buffers have to be written, in the interval mode
+        self.deadline = None
+        # called with the filename when a file cannot be written
+        self.on_failure = None
+        # the files the last write of which failed
+        self.failing = set()
+        # the failures that happened while on_failure was None
+        self.unreported = []
+        self.records = 0
+        self.flushes = 0
+        self.reopens = 0
+        self.evictions = 0
+
+    def call(self, func, *args, wait=False):
+        """
+        Call func(*args) in the thread, after the records already sent.
+        If wait is True, block until it is done.
+        """
+        if not self.is_alive():
+            func(*args)
+            return
+        done = threading.Event() if wait else None
+        self.queue.put((func, args, done))
+        if wait:
+            done.wait()
+
+    def write(self, filename, date, formatter, *args):
+        """
+        Send a record, the text of which is formatter(utc_date, *args), to
+        be written in filename (date is the local time)
+        """
+        self.call(self.append, filename, date, formatter, args)
+
+    def flush(self, filename=None, wait=False):
+        "Write the buffers of a file, or of all of them"
+        self.call(self.write_buffers, filename, wait=wait)
+
+    def update_index(self, filename):
+        "Make sure the index of a file lists all its messages"
+        self.call(self.check_index, filename, wait=True)
+
+    def file_size(self, filename):
+        """
+        Return a concurrent.futures.Future of the size of a file, once the
+        records already sent are written
+        """
+        future = Future()
+        def size():
+            self.write_buffers(filename)
+            try:
+                future.set_result(os.path.getsize(
+                    os.path.join(log_dir, filename)))
+            except OSError:
+                future.set_result(0)
+        self.call(size)
+        return future
+
+    def reopen(self):
+        """
+        Write the buffers, and reopen the files currently open (the others
+        are opened again by path when needed anyway)
+        """
+        self.call(self.reopen_files, wait=True)
+
+    def close(self, filename):
+        "Write the buffer of a file, and close it"
+        self.call(self.close_files, filename)
+
+    def report_failures(self, callback):
+        """
+        Call callback(filename) from the thread when a file cannot be
+        written, starting with the failures not reported yet
+        """
+        self.call(self.set_on_failure, callback)
 
-def parse_message_line(msg):
-    if re.match(message_log_re, msg):
-        return [i for i in re.split(message_log_re, msg) if i]
-    elif re.match(info_log_re, msg):
-        return [i for i in re.split(info_log_re, msg) if i]
-    return False
+    def stop(self):
+        "Write everything, close the files and stop the thread"
+        if self.is_alive():
+            self.queue.put((None, (), None))
+            self.join()
+        else:
+            self.close_files()
+
+    def run(self):
+        while True:
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(0, self.deadline - time.monotonic())
+            try:
+                func, args, done = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self.write_buffers()
+                continue
+            if func is None:
+                self.close_files()
+                return
+            try:
+                func(*args)
+            except:
+                log.error('Error in the logs writer', exc_info=True)
+            if done is not None:
+                done.set()
+
+    def append(self, filename, date, formatter, args):
+        "Add a record to the buffer of its file"
+        try:
+            date = common.get_utc_time(date)
+            text = formatter(date, *args)
+            words = [log_search.word_hash(word) for word in
+                     log_search.words(text[log_search.MESSAGE_HEADER_LENGTH:])]
+            text = text.encode('utf-8')
+        except:
+            log.error('Unable to format the log record for %s', filename,
+                      exc_info=True)
+            self.failed(filename)
+            return
+        self.records += 1
+        self.buffers.setdefault(filename, []).append(
+            (text, calendar.timegm(date.timetuple()), words))
+        size = self.buffered.get(filename, 0) + len(text)
+        self.buffered[filename] = size
+        if (self.mode == 'always' or size > MAX_BUFFER_SIZE or
+                not self.is_alive()):
+            self.write_buffers(filename)
+        elif self.mode == 'interval' and self.deadline is None:
+            self.deadline = time.monotonic() + self.interval
+
+    def write_buffers(self, filename=None):
+        "Write the buffer of a file, or of all of them"
+        if filename is None:
+            filenames = list(self.buffers)
+            self.deadline = None
+        elif filename in self.buffers:
+            filenames = [filename]
+        else:
+            return
+        for filename in filenames:
+            records = self.buffers.pop(filename)
+            del self.buffered[filename]
+            self.flushes += 1
+            log_file = self.get_fd(filename)
+            if log_file is None:
+                self.failed(filename)
+                continue
+            try:
+                offset = log_file.fd.seek(0, os.SEEK_END)
+                log_file.fd.write(b''.join(record[0] for record in records))
+                log_file.fd.flush()
+            except:
+                log.error('Unable to write in the log file (%s)',
+                          os.path.join(log_dir, filename),
+                          exc_info=True)
+                self.failed(filename)
+                continue
+            self.failing.discard(filename)
+            if log_file.index is not None:
+                self.write_index(filename, log_file, offset, records)
+            if log_file.search_end == offset:
+                self.write_search(filename, log_file, offset, records)
+        if not self.buffers:
+            self.deadline = None
+
+    def failed(self, filename):
+        "Report that a file could not be written, if it could before"
+        if filename in self.failing:
+            return
+        self.failing.add(filename)
+        if self.on_failure is None:
+            self.unreported.append(filename)
+            return
+        try:
+            self.on_failure(filename)
+        except:
+            log.error('Unable to report the failure of the log file %s',
+                      filename, exc_info=True)
+
+    def set_on_failure(self, callback):
+        "Set the failure callback, and report the previous failures to it"
+        self.on_failure = callback
+        unreported, self.unreported = self.unreported, []
+        for filename in unreported:
+            self.failing.discard(filename)
+            self.failed(filename)
 
+    def write_index(self, filename, log_file, offset, records):
+        """
+        Add the records written at offset in a log file to its index. If
+        that fails, the index is not written anymore until the file is
+        reopened (and the index updated from the log).
+        """
+        entries = []
+        for text, timestamp, _ in records:
+            entries.append(log_index.RECORD.pack(offset, timestamp))
+            offset += len(text)
+        try:
+            log_file.index.write(b''.join(entries))
+            log_file.index.flush()
+        except:
+            log.error('Unable to write the index of the log file (%s)',
+                      os.path.join(log_dir, filename),
+                      exc_info=True)
+            try:
+                log_file.index.close()
+            except:
+                pass
+            log_file.index = None
+
+    def write_search(self, filename, log_file, offset, records):
+        "Add the words of the records written at offset to the search index"
+        entries = []
+        for text, _, words in records:
+            entries.extend(log_search.record(word, offset) for word in words)
+            offset += len(text)
+        try:
+            log_search.append_run(log_search.search_path(log_dir, filename),
+                                  entries, offset)
+        except:
+            log.error('Unable to write the search index of the log file (%s)',
+                      os.path.join(log_dir, filename),
+                      exc_info=True)
+            return
+        log_file.search_end = offset
+
+    def search_step(self, search):
+        """
+        Search the next file of a search, after having indexed it if
+        needed, and send the results to its callback. The files are indexed
+        by chunks, and one file is handled at a time, so that the records
+        sent meanwhile are not delayed too much.
+        """
+        if search.cancelled:
+            return
+        if search.filenames is None:
+            self.write_buffers()
+            search.filenames = self.log_files()
+        if not search.filenames:
+            search.callback(None)
+            return
+        filename = search.filenames[0]
+        self.write_buffers(filename)
+        path = log_search.search_path(log_dir, filename)
+        log_path = os.path.join(log_dir, filename)
+        if not log_search.build(log_path, path, log_search.BUILD_CHUNK):
+            self.refresh_search_end(filename)
+            self.queue.put((self.search_step, (search,), None))
+            return
+        self.refresh_search_end(filename)
+        search.filenames.pop(0)
+        since = 0
+        if search.since is not None:
+            self.check_index(filename)
+            with log_index.LogIndex(log_index.index_path(log_dir, filename)) as index:
+                first = index.find_time(search.since)
+                since = index.offset(first) if first < len(index) else None
+        if since is not None:
+            offsets = log_search.search(path, search.hashes, since)
+            results = search.match(filename, log_path, offsets)
+            if results:
+                search.callback(results)
+        self.queue.put((self.search_step, (search,), None))
+
+    def log_files(self):
+        "The names of the log files of the conversations"
+        return log_index.log_files(log_dir)
+
+    def refresh_search_end(self, filename):
+        "Read the end of the search index of an open file again"
+        log_file = self.fds.get(filename)
+        if log_file is not None:
+            log_file.search_end = log_search.indexed_end(
+                log_search.search_path(log_dir, filename))
+
+    def check_index(self, filename):
+        "Update the index of a file which is not open"
+        log_file = self.fds.get(filename)
+        if log_file is not None and log_file.index is not None:
+            return
+        try:
+            log_index.update_index(os.path.join(log_dir, filename),
+                                   log_index.index_path(log_dir, filename))
+        except:
+            log.error('Unable to update the index of the log file (%s)',
+                      os.path.join(log_dir, filename),
+                      exc_info=True)
+
+    def get_fd(self, filename):
+        """
+        Get the LogFile of a file, opening it if needed (and closing
+        the least recently used one if there are too many open files)
+        """
+        log_file = self.fds.get(filename)
+        if log_file is not None:
+            self.fds.move_to_end(filename)
+            return log_file
+        while 0 < self.max_open <= len(self.fds):
+            oldest = next(iter(self.fds))
+            self.close_fd(oldest)
+            self.evicted.add(oldest)
+            self.evictions += 1
+        try:
+            makedirs(log_dir, exist_ok=True)
+            fd = open(os.path.join(log_dir, filename), 'ab')
+        except OSError:
+            log.error('Unable to open the log file (%s)',
+                      os.path.join(log_dir, filename),
+                      exc_info=True)
+            return None
+        # the messages written while the file was closed (or before the
+        # index existed) are added to the index first
+        path = log_index.index_path(log_dir, filename)
+        try:
+            log_index.update_index(os.path.join(log_dir, filename), path)
+            index = open(path, 'ab')
+        except:
+            log.error('Unable to open the index of the log file (%s)',
+                      os.path.join(log_dir, filename),
+                      exc_info=True)
+            index = None
+        search_end = log_search.indexed_end(
+            log_search.search_path(log_dir, filename))
+        if filename in self.evicted:
+            self.evicted.remove(filename)
+            self.reopens += 1
+        log_file = self.fds[filename] = LogFile(fd, index, search_end)
+        return log_file
+
+    def reopen_files(self):
+        "Close and reopen the open files, keeping their order"
+        filenames = list(self.fds)
+        self.close_files()
+        for filename in filenames:
+            self.get_fd(filename)
+
+    def close_fd(self, filename):
+        "Close an open file, without writing its buffer"
+        try:
+            self.fds.pop(filename).close()
+        except: # Can't close? too bad
+            log.error('Unable to close the log file (%s)',
+                      os.path.join(log_dir, filename),
+                      exc_info=True)
+
+    def close_files(self, filename=None):
+        "Write the buffers and close the files, or only one of them"
+        self.write_buffers(filename)
+        if filename is None:
+            filenames = list(self.fds)
+        else:
+            filenames = [filename] if filename in self.fds else []
+        for filename in filenames:
+            self.close_fd(filename)
+
+    def stats(self):
+        "Return a short description of the work of the writer"
+        return ('%s log records written in %s writes, %s open files '
+                '(%s closed to stay under the limit, %s reopened)' %
+                (self.records, self.flushes, len(self.fds), self.evictions,
+                 self.reopens))
 
 class Logger(object):
     """
     Appends things to files. Error/information/warning logs
     and also log the conversations to logfiles
+
+    The files are written by a LogWriter thread, started with the first
+    record.
     """
     def __init__(self):
         self.logfile = config.get('logfile')
-        self.roster_logfile = None
-        # a dict of 'groupchatname': file-object (opened)
-        self.fds = dict()
-
-    def __del__(self):
-        for opened_file in self.fds.values():
-            if opened_file:
-                try:
-                    opened_file.close()
-                except: # Can't close? too bad
-                    pass
+        self.writer = LogWriter(config.get('log_flush'),
+                                config.get('log_flush_interval'),
+                                config.get('max_open_log_files'))
+
+    def send(self, filename, date, formatter, *args):
+        """
+        Send a record to the writer. The failures are reported later by
+        the callback given to writer.report_failures().
+        """
+        self.start_writer().write(filename, date, formatter, *args)
+
+    def start_writer(self):
+        "Update the options of the writer, and start it if needed"
+        writer = self.writer
+        writer.mode = config.get('log_flush')
+        writer.interval = config.get('log_flush_interval')
+        writer.max_open = config.get('max_open_log_files')
+        if writer.ident is None:
+            writer.start()
+        return writer
+
+    def search(self, text, callback, jids=None, since=None):
+        """
+        Search the messages containing text in the logs of the jids (all
+        the logs by default), logged since the date since (in local time)
+        if given. The results are sent to callback from the asyncio loop,
+        (see LogSearch). Return the LogSearch, to be able to cancel it.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        if jids is not None:
+            jids = [str(jid).replace('/', '\\') for jid in jids]
+        if since is not None:
+            since = calendar.timegm(common.get_utc_time(since).timetuple())
+        search = LogSearch(text, jids, since,
+                           lambda results: loop.call_soon_threadsafe(
+                               callback, results))
+        self.start_writer().call(self.writer.search_step, search)
+        return search
+
+    def flush(self):
+        """Write all the buffered records (on exit or SIGHUP)"""
+        self.writer.flush(wait=True)
+
+    def stop(self):
+        """Write all the buffered records and stop the writer"""
+        self.writer.stop()
+
+    def close(self, jid):
+        """Close the log file of a jid (when its tab is closed)"""
+        self.writer.close(str(jid).replace('/', '\\'))
+        log.debug("Log file for %s closed.", jid)
 
     def reload_all(self):
-        """Close and reload all the file handles (on SIGHUP)"""
-        for opened_file in self.fds.values():
-            if opened_file:
-                opened_file.close()
-        log.debug('All log file handles closed')
-        for room in self.fds:
-            self.fds[room] = self.check_and_create_log_dir(room)
-            log.debug('Log handle for %s re-created', room)
+        """Close and reload all the file handles (on SIGUSR1)"""
+        self.writer.reopen()
+        log.debug('All log file handles reopened')
 
-    def check_and_create_log_dir(self, room, open_fd=True):
+    def check_and_create_log_dir(self, room):
         """
         Check that the directory where we want to log the messages
         exists. if not, create it
@@ -81,30 +639,15 @@ class Logger(object):
         if not config.get_by_tabname('use_log', room):
             return
         try:
-            makedirs(log_dir)
-        except OSError as e:
-            if e.errno != 17: # file exists
-                log.error('Unable to create the log dir', exc_info=True)
+            makedirs(log_dir, exist_ok=True)
         except:
             log.error('Unable to create the log dir', exc_info=True)
-            return
-        if not open_fd:
-            return
-        try:
-            fd = open(os.path.join(log_dir, room), 'a')
-            self.fds[room] = fd
-            return fd
-        except IOError:
-            log.error('Unable to open the log file (%s)',
-                    os.path.join(log_dir, room),
-                    exc_info=True)
 
-    def get_logs(self, jid, nb=10):
+    def get_logs(self, jid, nb=10, before=None):
         """
-        Get the nb last messages from the log history for the given jid.
-        Note that a message may be more than one line in these files, so
-        this function is a little bit more complicated than “read the last
-        nb lines”.
+        Get the nb last messages from the log history for the given jid
+        (the nb last ones before the byte offset before, if given; the
+        offset of each message is in its 'offset' key).
         """
         if config.get_by_tabname('load_log', jid) <= 0:
             return
@@ -115,7 +658,140 @@ class Logger(object):
         if nb <= 0:
             return
 
-        self.check_and_create_log_dir(jid, open_fd=False)
+        return self.read_logs(jid, nb, before)
+
+    def get_logs_async(self, jid, nb=10):
+        """
+        Like get_logs, but read the logs in a thread of the executor of the
+        asyncio loop, and return a future of the messages. Only the
+        messages logged before the call are read, the ones logged in the
+        meantime are not.
+        """
+        if config.get_by_tabname('load_log', jid) <= 0:
+            nb = 0
+        if nb <= 0 or not config.get_by_tabname('use_log', jid):
+            return self.read_async(jid, 0, None)
+        # the writer has to be running, so that the executor only touches
+        # the buffers through it
+        size = self.start_writer().file_size(jid)
+        return self.read_async(
+            jid, nb, lambda: self.read_logs(jid, nb, size.result()))
+
+    def get_older_logs_async(self, jid, nb, before):
+        """
+        Like get_logs_async, but read the nb messages logged before
+        before, which is the offset of a message in the log file, or a
+        date (in local time)
+        """
+        def read():
+            end = before
+            if isinstance(before, datetime):
+                end = self.find_date_offset(jid, before)
+            return self.read_logs(jid, nb, end)
+        self.start_writer()
+        return self.read_async(jid, nb, read)
+
+    def read_async(self, jid, nb, read):
+        """
+        Return an asyncio future of the result of read(), called in a
+        thread of the executor of the loop, or of None if no message (nb)
+        has to be read in the logs of jid
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        if nb <= 0 or not config.get_by_tabname('use_log', jid):
+            future = asyncio.Future(loop=loop)
+            future.set_result(None)
+            return future
+        return loop.run_in_executor(None, read)
+
+    def find_date_offset(self, jid, date):
+        """
+        Return the offset of the first message logged at date (in local
+        time) or later in the log file of jid, or its size if there is none
+        """
+        timestamp = calendar.timegm(common.get_utc_time(date).timetuple())
+        self.check_and_create_log_dir(jid)
+        self.writer.flush(jid, wait=True)
+        self.writer.update_index(jid)
+        with log_index.LogIndex(log_index.index_path(log_dir, jid)) as index:
+            first = index.find_time(timestamp)
+            if first < len(index):
+                return index.offset(first)
+        try:
+            return os.path.getsize(os.path.join(log_dir, jid))
+        except OSError:
+            return 0
+
+    def get_logs_since(self, jid, date, nb=10):
+        """
+        Get the nb first messages logged since date (in local time) for
+        the given jid, found with the index of its log file.
+        """
+        timestamp = calendar.timegm(common.get_utc_time(date).timetuple())
+        return self.read_indexed_logs(jid, nb,
+                                      lambda index: index.find_time(timestamp))
+
+    def get_logs_around(self, jid, offset, nb=10):
+        """
+        Get nb messages logged around the one at offset in the log file
+        of the given jid.
+        """
+        return self.read_indexed_logs(
+            jid, nb, lambda index: max(0, index.count_before(offset) - nb // 2))
+
+    def get_logs_since_async(self, jid, date, nb=10):
+        """
+        Like get_logs_since, but read the logs in a thread of the executor
+        of the asyncio loop, and return a future of the messages
+        """
+        self.start_writer()
+        return self.read_async(jid, nb,
+                               lambda: self.get_logs_since(jid, date, nb))
+
+    def get_logs_around_async(self, jid, offset, nb=10):
+        """
+        Like get_logs_around, but read the logs in a thread of the
+        executor of the asyncio loop, and return a future of the messages
+        """
+        self.start_writer()
+        return self.read_async(jid, nb,
+                               lambda: self.get_logs_around(jid, offset, nb))
+
+    def read_indexed_logs(self, jid, nb, find_first):
+        """
+        Read nb messages from the log file of jid, from the one the number
+        of which is returned by find_first(index), where index is the
+        LogIndex of the file.
+        """
+        if not config.get_by_tabname('use_log', jid) or nb <= 0:
+            return
+
+        self.check_and_create_log_dir(jid)
+        self.writer.flush(jid, wait=True)
+        self.writer.update_index(jid)
+        with log_index.LogIndex(log_index.index_path(log_dir, jid)) as index:
+            first = find_first(index)
+            if first == len(index):
+                return []
+            start = index.offset(first)
+            before = None
+            if first + nb < len(index):
+                before = index.offset(first + nb)
+        messages = self.read_logs(jid, nb, before) or []
+        return [message for message in messages if message['offset'] >= start]
+
+    def read_logs(self, jid, nb, before=None):
+        """
+        Read the nb last messages before the offset before (or the end of
+        the file) in the log file of jid.
+        Note that a message may be more than one line in these files, so
+        this function is a little bit more complicated than “read the last
+        nb lines”.
+        """
+        self.check_and_create_log_dir(jid)
+        # the last records may still be in the buffers of the writer
+        self.writer.flush(jid, wait=True)
 
         try:
             fd = open(os.path.join(log_dir, jid), 'rb')
@@ -127,9 +803,10 @@ class Logger(object):
         if not fd:
             return
 
-        # read the needed data from the file, we just search nb messages by
-        # searching "\nM" nb times from the end of the file.  We use mmap to
-        # do that efficiently, instead of seek()s and read()s which are costly.
+        # find the offsets of the messages in the index of the file, or
+        # by searching "\nM" nb times from the end if it is not up to
+        # date. We use mmap to do that efficiently, instead of seek()s and
+        # read()s which are costly.
         with fd:
             try:
                 m = mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ)
@@ -138,52 +815,36 @@ class Logger(object):
                         os.path.join(log_dir, jid),
                         exc_info=True)
                 return
-            pos = m.rfind(b"\nM") # start of messages begin with MI or MR,
-                                  # after a \n
-            # number of message found so far
-            count = 0
-            while pos != -1 and count < nb-1:
-                count += 1
-                pos = m.rfind(b"\nM", 0, pos)
-            if pos == -1:       # If we don't have enough lines in the file
-                pos = 1         # 1, because we do -1 just on the next line
-                                # to get 0 (start of the file)
-            lines = m[pos-1:].decode(errors='replace').splitlines()
-
-        messages = []
-        color = '\x19%s}' % dump_tuple(get_theme().COLOR_LOG_MSG)
+            with m:
+                end = len(m) if before is None else min(before, len(m))
+                offsets = self.find_messages(jid, m, end, nb)
+                chunks = [(offset, m[offset:next_offset].decode(errors='replace'))
+                          for offset, next_offset
+                          in zip(offsets, offsets[1:] + [end])]
 
-        # now convert that data into actual Message objects
-        idx = 0
-        while idx < len(lines):
-            if lines[idx].startswith(' '): # should not happen ; skip
-                idx += 1
-                log.debug('fail?')
-                continue
-            tup = parse_message_line(lines[idx])
-            idx += 1
-            if not tup or 7 > len(tup) > 10: # skip
-                log.debug('format? %s', tup)
-                continue
-            time = [int(i) for index, i in enumerate(tup) if index < 6]
-            message = {'lines': [],
-                       'history': True,
-                       'time': common.get_local_time(datetime(*time))}
-            size = int(tup[6])
-            if len(tup) == 8: #info line
-                message['lines'].append(color+tup[7])
-            else: # message line
-                message['nickname'] = tup[7]
-                message['lines'].append(color+tup[8])
-            while size != 0 and idx < len(lines):
-                message['lines'].append(lines[idx][1:])
-                size -= 1
-                idx += 1
-            message['txt'] = '\n'.join(message['lines'])
-            del message['lines']
-            messages.append(message)
+        color = '\x19%s}' % dump_tuple(get_theme().COLOR_LOG_MSG)
+        return parse_log_messages(chunks, color)
 
-        return messages
+    def find_messages(self, jid, data, end, nb):
+        """
+        Return the offsets of the nb last messages before end in data, the
+        content of the log file of jid
+        """
+        path = log_index.index_path(log_dir, jid)
+        with log_index.LogIndex(path) as index:
+            if index.covers(data, end):
+                count = index.count_before(end)
+                return [index.offset(i) for i in range(max(0, count-nb), count)]
+        offsets = []
+        # start of messages begin with MI or MR, after a \n
+        pos = data.rfind(b'\nM', 0, end)
+        while pos != -1 and len(offsets) < nb:
+            offsets.append(pos + 1)
+            pos = data.rfind(b'\nM', 0, pos)
+        if len(offsets) < nb and end > 0 and data[:1] == b'M':
+            offsets.append(0)
+        offsets.reverse()
+        return offsets
 
     def log_message(self, jid, nick, msg, date=None, typ=1):
         """
@@ -192,86 +853,29 @@ class Logger(object):
               0 = Don’t log
               1 = Message
               2 = Status/whatever
+
+        The failures are reported by the callback given to
+        writer.report_failures().
         """
         if not typ:
-            return True
+            return
 
         jid = str(jid).replace('/', '\\')
         if not config.get_by_tabname('use_log', jid):
-            return True
-        if jid in self.fds.keys():
-            fd = self.fds[jid]
-        else:
-            fd = self.check_and_create_log_dir(jid)
-        if not fd:
-            return True
-        try:
-            msg = clean_text(msg)
-            if date is None:
-                str_time = common.get_utc_time().strftime('%Y%m%dT%H:%M:%SZ')
-            else:
-                str_time = common.get_utc_time(date).strftime('%Y%m%dT%H:%M:%SZ')
-            if typ == 1:
-                prefix = 'MR'
-            else:
-                prefix = 'MI'
-            lines = msg.split('\n')
-            first_line = lines.pop(0)
-            nb_lines = str(len(lines)).zfill(3)
-
-            if nick:
-                nick = '<' + nick + '>'
-                fd.write(' '.join((prefix, str_time, nb_lines, nick, ' '+first_line, '\n')))
-            else:
-                fd.write(' '.join((prefix, str_time, nb_lines, first_line, '\n')))
-            for line in lines:
-                fd.write(' %s\n' % line)
-        except:
-            log.error('Unable to write in the log file (%s)',
-                    os.path.join(log_dir, jid),
-                    exc_info=True)
-            return False
-        else:
-            try:
-                fd.flush()          # TODO do something better here?
-            except:
-                log.error('Unable to flush the log file (%s)',
-                        os.path.join(log_dir, jid),
-                        exc_info=True)
-                return False
-        return True
+            return
+        if date is None:
+            date = datetime.now()
+        self.send(jid, date, format_message, nick, msg, typ)
 
     def log_roster_change(self, jid, message):
         """
         Log a roster change
         """
         if not config.get_by_tabname('use_log', jid):
-            return True
-        self.check_and_create_log_dir('', open_fd=False)
-        if not self.roster_logfile:
-            try:
-                self.roster_logfile = open(os.path.join(log_dir, 'roster.log'), 'a')
-            except IOError:
-                log.error('Unable to create the log file (%s)',
-                        os.path.join(log_dir, 'roster.log'),
-                        exc_info=True)
-                return False
-        try:
-            str_time = common.get_utc_time().strftime('%Y%m%dT%H:%M:%SZ')
-            message = clean_text(message)
-            lines = message.split('\n')
-            first_line = lines.pop(0)
-            nb_lines = str(len(lines)).zfill(3)
-            self.roster_logfile.write('MI %s %s %s %s\n' % (str_time, nb_lines, jid, first_line))
-            for line in lines:
-                self.roster_logfile.write(' %s\n' % line)
-            self.roster_logfile.flush()
-        except:
-            log.error('Unable to write in the log file (%s)',
-                    os.path.join(log_dir, 'roster.log'),
-                    exc_info=True)
-            return False
-        return True
+            return
+        self.send('roster.log', datetime.now(), format_roster_change,
+                  jid, message)
+
 
 def create_logger():
     "Create the global logger object"
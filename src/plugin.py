@@ -44,6 +44,7 @@ class PluginConfig(config.Config):
         RawConfigParser.read(self, self.file_name)
         if not self.has_section(self.module_name):
             self.add_section(self.module_name)
+        self.invalidate()
 
     def options(self, section=None):
         """
@@ -57,6 +57,8 @@ def main():
     if options.debug:
         cocore.debug = True
     cocore.start()
+    config.on_flush_failure = lambda file_name: cocore.information(
+            'Unable to write in the config file %s' % file_name, 'Error')
 
     # Warning: asyncio must always be imported after the config. Otherwise
     # the asyncio logger will not follow our configuration and won't write
@@ -69,6 +71,8 @@ def main():
     cocore.xmpp.start()
     loop.run_forever()
     # We reach this point only when loop.stop() is called
+    config.flush_all()
+    logger.logger.stop()
     try:
         cocore.reset_curses()
     except:
@@ -29,6 +29,7 @@ import core
 import timed_events
 import windows
 import xhtml
+import common
 from common import safeJID
 from config import config
 from decorators import refresh_wrapper
@@ -462,6 +463,13 @@ class ChatTab(Tab):
                 shortdesc=_('Send custom XHTML.'))
         self.register_command('clear', self.command_clear,
                 shortdesc=_('Clear the current buffer.'))
+        self.register_command('history', self.command_history,
+                usage=_('<date>'),
+                desc=_('Show the messages logged since the date, which is '
+                       'either a date with an optional time (2015-01-02 or '
+                       '2015-01-02 10:30), or a duration before now (3h, '
+                       '2d).'),
+                shortdesc=_('Show the logs since a date.'))
         self.register_command('correct', self.command_correct,
                 desc=_('Fix the last message with whatever you want.'),
                 shortdesc=_('Correct the last message.'),
@@ -470,29 +478,108 @@ class ChatTab(Tab):
         self.update_commands()
         self.update_keys()
 
-        # Get the logs
-        log_nb = config.get('load_log')
-        logs = self.load_logs(log_nb)
+        # Whether messages are being loaded from the logs, and whether
+        # there are no older ones left (see load_scrollback)
+        self.scrollback_loading = False
+        self.scrollback_done = False
 
-        if logs:
-            for message in logs:
-                self._text_buffer.add_message(**message)
+        # Get the logs, without waiting for them to be read
+        self.load_logs(config.get('load_log'))
 
     @property
     def is_muc(self):
         return False
 
+    def log_name(self):
+        """The name of the log file of the tab"""
+        return safeJID(self.name).bare
+
     def load_logs(self, log_nb):
-        logs = logger.get_logs(safeJID(self.name).bare, log_nb)
-        return logs
+        """
+        Read the log_nb last messages of the logs in another thread, and
+        insert them before the messages received in the meantime
+        """
+        # the older messages can only be loaded after them
+        self.scrollback_loading = True
+        future = logger.get_logs_async(self.log_name(), log_nb)
+        future.add_done_callback(self.on_logs_loaded)
+
+    def on_logs_loaded(self, future):
+        self.scrollback_loading = False
+        try:
+            logs = future.result()
+        except Exception:
+            log.error('Unable to load the logs of %s', self.name,
+                      exc_info=True)
+            return
+        if not logs or self._text_buffer.add_history(logs) == 0:
+            return
+        if self.core.current_tab() is self:
+            self.core.refresh_window()
+
+    def load_scrollback(self):
+        """
+        Load the messages logged before the oldest one of the buffer, when
+        it is displayed, as long as there are at most max_scrollback_pages
+        pages of them over max_messages_in_memory
+        """
+        nb = config.get('scrollback_page_size')
+        if nb <= 0 or self.scrollback_loading or self.scrollback_done:
+            return
+        buffer = self._text_buffer
+        limit = (buffer.messages_nb_limit +
+                 nb * config.get('max_scrollback_pages'))
+        if not buffer.messages or len(buffer.messages) >= limit:
+            return
+        oldest = buffer.messages[0]
+        # the messages received since the tab was opened are logged too,
+        # but only those read from the logs know their offset
+        before = oldest.offset if oldest.offset is not None else oldest.time
+        self.scrollback_loading = True
+        future = logger.get_older_logs_async(self.log_name(), nb, before)
+        future.add_done_callback(
+            lambda future: self.on_scrollback_loaded(future, oldest, nb,
+                                                     limit))
+
+    def on_scrollback_loaded(self, future, oldest, nb, limit):
+        self.scrollback_loading = False
+        try:
+            logs = future.result()
+        except Exception:
+            log.error('Unable to load the logs of %s', self.name,
+                      exc_info=True)
+            return
+        buffer = self._text_buffer
+        if not buffer.messages or buffer.messages[0] is not oldest:
+            # the buffer changed in the meantime
+            return
+        if not logs or len(logs) < nb:
+            self.scrollback_done = True
+        if not logs or buffer.add_history(logs, limit) == 0:
+            return
+        if self.core.current_tab() is self:
+            self.core.refresh_window()
+
+    def trim_scrollback(self):
+        """
+        Forget the messages loaded from the logs over max_messages_in_memory
+        when they are far above the displayed part of the buffer
+        """
+        buffer = self._text_buffer
+        extra = len(buffer.messages) - buffer.messages_nb_limit
+        if extra <= 0:
+            return
+        margin = config.get('scrollback_page_size')
+        if self.text_win.messages_above() >= extra + margin:
+            buffer.trim_history()
+            self.scrollback_done = False
 
     def log_message(self, txt, nickname, time=None, typ=1):
         """
         Log the messages in the archives.
         """
         name = safeJID(self.name).bare
-        if not logger.log_message(name, nickname, txt, date=time, typ=typ):
-            self.core.information(_('Unable to write in the log file'), 'Error')
+        logger.log_message(name, nickname, txt, date=time, typ=typ)
 
     def add_message(self, txt, time=None, nickname=None, forced_user=None,
                     nick_color=None, identifier=None, jid=None, history=None,
@@ -581,6 +668,68 @@ class ChatTab(Tab):
         self._text_buffer.messages = []
         self.text_win.rebuild_everything(self._text_buffer)
 
+    @command_args_parser.raw
+    def command_history(self, line):
+        """
+        /history <date>
+        """
+        date = common.parse_date(line) if line else None
+        if date is None:
+            self.core.command_help('history')
+            return
+        future = logger.get_logs_since_async(self.log_name(), date,
+                                             max(self.text_win.height, 10))
+        future.add_done_callback(
+            lambda future: self.on_history_loaded(future, date))
+
+    def on_history_loaded(self, future, date):
+        try:
+            logs = future.result()
+        except Exception:
+            log.error('Unable to load the logs of %s', self.name,
+                      exc_info=True)
+            return
+        str_date = date.strftime('%Y-%m-%d %H:%M')
+        if not logs:
+            self.core.information(_('No message logged since %s.') % str_date,
+                                  'Info')
+            return
+        self.show_logs(_('Messages logged since %s:') % str_date, logs)
+
+    def show_logs_around(self, offset):
+        """
+        Show the messages logged around the one at offset in the log file
+        of the tab (found by /grep), highlighted
+        """
+        future = logger.get_logs_around_async(self.log_name(), offset,
+                                              max(self.text_win.height, 10))
+        future.add_done_callback(
+            lambda future: self.on_logs_around_loaded(future, offset))
+
+    def on_logs_around_loaded(self, future, offset):
+        try:
+            logs = future.result()
+        except Exception:
+            log.error('Unable to load the logs of %s', self.name,
+                      exc_info=True)
+            return
+        for message in logs or ():
+            if message['offset'] == offset:
+                message['highlight'] = True
+                str_date = message['time'].strftime('%Y-%m-%d %H:%M')
+                self.show_logs(_('Messages logged around %s:') % str_date,
+                               logs)
+                return
+        self.core.information(_('The message is not in the logs anymore.'),
+                              'Error')
+
+    def show_logs(self, title, logs):
+        "Add messages read in the logs at the end of the buffer"
+        color = dump_tuple(get_theme().COLOR_INFORMATION_TEXT)
+        self._text_buffer.add_message('\x19%s}%s' % (color, title))
+        self._text_buffer.add_messages(logs)
+        self.core.refresh_window()
+
     def send_chat_state(self, state, always_send=False):
         """
         Send an empty chatstate message
@@ -678,23 +827,42 @@ class ChatTab(Tab):
     def command_say(self, line, correct=False):
         pass
 
+    def scroll_up(self, dist):
+        """
+        Scroll the text up, and load older messages from the logs if the
+        oldest one is displayed
+        """
+        scrolled = self.text_win.scroll_up(dist)
+        if self.text_win.displays_top():
+            self.load_scrollback()
+        return scrolled
+
+    def scroll_down(self, dist):
+        """
+        Scroll the text down, and forget the older messages loaded from
+        the logs if they are far enough
+        """
+        scrolled = self.text_win.scroll_down(dist)
+        self.trim_scrollback()
+        return scrolled
+
     def on_line_up(self):
-        return self.text_win.scroll_up(1)
+        return self.scroll_up(1)
 
     def on_line_down(self):
-        return self.text_win.scroll_down(1)
+        return self.scroll_down(1)
 
     def on_scroll_up(self):
-        return self.text_win.scroll_up(self.text_win.height-1)
+        return self.scroll_up(self.text_win.height-1)
 
     def on_scroll_down(self):
-        return self.text_win.scroll_down(self.text_win.height-1)
+        return self.scroll_down(self.text_win.height-1)
 
     def on_half_scroll_up(self):
-        return self.text_win.scroll_up((self.text_win.height-1) // 2)
+        return self.scroll_up((self.text_win.height-1) // 2)
 
     def on_half_scroll_down(self):
-        return self.text_win.scroll_down((self.text_win.height-1) // 2)
+        return self.scroll_down((self.text_win.height-1) // 2)
 
     @refresh_wrapper.always
     def scroll_separator(self):
@@ -22,6 +22,7 @@ from . basetabs import OneToOneTab, Tab
 
 import common
 import fixes
+import highlight
 import windows
 import xhtml
 from common import safeJID
@@ -299,6 +300,15 @@ class ConversationTab(OneToOneTab):
                 return self.nick
             return jid.user
 
+    def highlight_matcher(self):
+        """
+        The matcher of the highlights for our nick and the highlight_on
+        option
+        """
+        return highlight.get_matcher(self.core.own_nick,
+                                     config.get_by_tabname('highlight_on',
+                                                           self.general_jid))
+
     def on_input(self, key, raw):
         if not raw and key in self.key_func:
             self.key_func[key]()
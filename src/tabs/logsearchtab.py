@@ -0,0 +1,76 @@
+"""
+A LogSearchTab lists the results of a search in the logs (/grep).
+
+The results are added as they are found, file by file, and the user can
+show a result in the tab of its conversation, with the messages logged
+around it.
+"""
+from gettext import gettext as _
+
+import logging
+log = logging.getLogger(__name__)
+
+from . import ListTab
+
+class LogSearchTab(ListTab):
+    plugin_commands = {}
+    plugin_keys = {}
+
+    def __init__(self, text):
+        ListTab.__init__(self, 'grep: %s' % text,
+                         "“Enter”: show the message in its tab.",
+                         _('Search of “%s” in the logs (Searching…)') % text,
+                         (('date', 0), ('jid', 1), ('nick', 2),
+                          ('message', 3)))
+        self.text = text
+        self.nb_results = 0
+        # the LogSearch, to cancel it when the tab is closed
+        self.search = None
+        self.key_func['^M'] = self.show_selected
+
+    def get_columns_sizes(self):
+        return {'date': 17,
+                'jid': int(self.width * 2 / 8),
+                'nick': int(self.width / 8),
+                'message': self.width - 17 - int(self.width * 2 / 8)
+                - int(self.width / 8)}
+
+    def on_results(self, messages):
+        """
+        Callback called with the results of the search found in a log
+        file, and None at the end of the search
+        """
+        if messages is None:
+            self.search = None
+            self.info_header.message = _('Search of “%s” in the logs: '
+                                         '%s results') % (self.text,
+                                                          self.nb_results)
+        else:
+            self.listview.add_lines([
+                (message['time'].strftime('%Y-%m-%d %H:%M'),
+                 message['jid'].replace('\\', '/'),
+                 message.get('nickname') or '',
+                 message['txt'].strip().replace('\n', ' '),
+                 message['jid'], message['offset'])
+                for message in messages])
+            self.nb_results += len(messages)
+            self.info_header.message = _('Search of “%s” in the logs '
+                                         '(Searching…): %s results') % (
+                                             self.text, self.nb_results)
+        if self.core.current_tab() is self:
+            self.core.refresh_window()
+        else:
+            self.state = 'highlight'
+            self.core.frames.refresh(self.core.refresh_tab_win)
+
+    def show_selected(self):
+        row = self.listview.get_selected_row()
+        if not row:
+            return
+        self.core.show_log_position(row[4], row[5])
+
+    def on_close(self):
+        if self.search is not None:
+            self.search.cancel()
+            self.search = None
+        ListTab.on_close(self)
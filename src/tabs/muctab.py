@@ -12,10 +12,11 @@ from gettext import gettext as _
 import logging
 log = logging.getLogger(__name__)
 
+import bisect
 import curses
 import os
 import random
-import re
+from collections import OrderedDict
 from datetime import datetime
 from functools import reduce
 
@@ -23,6 +24,7 @@ from . import ChatTab, Tab
 
 import common
 import fixes
+import highlight
 import multiuserchat as muc
 import timed_events
 import windows
@@ -78,6 +80,13 @@ class MucTab(ChatTab):
         self.info_header = windows.MucInfoWin()
         self.input = windows.MessageInput()
         self.ignores = []       # set of Users
+        # The history messages received while joining the room, which are
+        # added all at once when the join is complete
+        self.receiving_history = False
+        self.pending_history = []
+        # The presences of the occupants received before our own, by nick,
+        # which are all added to the user list once the room is joined
+        self.pending_users = OrderedDict()
         # keys
         self.key_func['^I'] = self.completion
         self.key_func['M-u'] = self.scroll_user_list_down
@@ -438,7 +447,7 @@ class MucTab(ChatTab):
         if args is None:
             return self.core.command_help('version')
         nick = args[0]
-        if nick in [user.nick for user in self.users]:
+        if self.get_user_by_name(nick):
             jid = safeJID(self.name).bare
             jid = safeJID(jid + '/' + nick)
         else:
@@ -527,9 +536,8 @@ class MucTab(ChatTab):
             return  self.core.command_help('query')
         nick = args[0]
         r = None
-        for user in self.users:
-            if user.nick == nick:
-                r = self.core.open_private_window(self.name, user.nick)
+        if self.get_user_by_name(nick):
+            r = self.core.open_private_window(self.name, nick)
         if r and len(args) == 2:
             msg = args[1]
             self.core.current_tab().command_say(
@@ -655,7 +663,7 @@ class MucTab(ChatTab):
             msg = ''
         nick = args[0]
 
-        if nick in [user.nick for user in self.users]:
+        if self.get_user_by_name(nick):
             res = muc.set_user_affiliation(self.core.xmpp, self.name,
                                            'outcast', nick=nick,
                                            callback=callback, reason=msg)
@@ -717,7 +725,7 @@ class MucTab(ChatTab):
             return self.core.information(_('The affiliation must be one of ' + ', '.join(valid_affiliations)),
                                          _('Error'))
 
-        if nick in [user.nick for user in self.users]:
+        if self.get_user_by_name(nick):
             res = muc.set_user_affiliation(self.core.xmpp, self.name,
                                            affiliation, nick=nick,
                                            callback=callback)
@@ -948,7 +956,7 @@ class MucTab(ChatTab):
 
     def on_gain_focus(self):
         self.state = 'current'
-        if (self.text_win.built_lines and self.text_win.built_lines[-1] is None
+        if (self.text_win.last_line_is_separator()
                 and not config.get('show_useless_separator')):
             self.text_win.remove_line_separator()
         curses.curs_set(1)
@@ -978,6 +986,89 @@ class MucTab(ChatTab):
                                     - Tab.tab_win_height(),
                                 0)
 
+    @property
+    def users(self):
+        "The occupants of the room"
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        # the occupants are kept in the order of the user list, with their
+        # sort keys in a parallel list to find their position with bisect
+        self._users = sorted(users, key=User.sort_key)
+        self._user_keys = [user.sort_key() for user in self._users]
+        # the occupants by nick, and by bare JID in non-anonymous rooms
+        self._users_by_nick = {}
+        self._users_by_jid = {}
+        for user in users:
+            self._index_user(user)
+
+    def _insert_user(self, user):
+        key = user.sort_key()
+        index = bisect.bisect_right(self._user_keys, key)
+        self._user_keys.insert(index, key)
+        self._users.insert(index, user)
+
+    def _delete_user(self, user):
+        key = user.sort_key()
+        start = bisect.bisect_left(self._user_keys, key)
+        end = bisect.bisect_right(self._user_keys, key, start)
+        for index in range(start, end):
+            if self._users[index] is user:
+                break
+        else:
+            # the user was modified without telling the tab
+            for index, other in enumerate(self._users):
+                if other is user:
+                    break
+            else:
+                return
+        del self._user_keys[index]
+        del self._users[index]
+
+    def _index_user(self, user):
+        self._users_by_nick[user.nick] = user
+        if user.jid and user.jid.bare:
+            self._users_by_jid.setdefault(user.jid.bare, []).append(user)
+
+    def _unindex_user(self, user):
+        if self._users_by_nick.get(user.nick) is user:
+            del self._users_by_nick[user.nick]
+        if user.jid and user.jid.bare:
+            users = self._users_by_jid.get(user.jid.bare, [])
+            users = [other for other in users if other is not user]
+            if users:
+                self._users_by_jid[user.jid.bare] = users
+            else:
+                self._users_by_jid.pop(user.jid.bare, None)
+
+    def add_user(self, user):
+        "Add an occupant to the room"
+        self._insert_user(user)
+        self._index_user(user)
+
+    def remove_user(self, user):
+        "Remove an occupant from the room"
+        self._delete_user(user)
+        self._unindex_user(user)
+
+    def rename_user(self, user, nick):
+        "Change the nick of an occupant of the room"
+        self._delete_user(user)
+        self._unindex_user(user)
+        user.change_nick(nick)
+        self._insert_user(user)
+        self._index_user(user)
+
+    def update_user(self, user, affiliation, show, status, role):
+        "Change the status of an occupant of the room"
+        if role == user.role:
+            user.update(affiliation, show, status, role)
+        else:
+            self._delete_user(user)
+            user.update(affiliation, show, status, role)
+            self._insert_user(user)
+
     def handle_presence(self, presence):
         from_nick = presence['from'].resource
         from_room = presence['from'].bare
@@ -996,19 +1087,22 @@ class MucTab(ChatTab):
         jid = presence['muc']['jid']
         typ = presence['type']
         if not self.joined:     # user in the room BEFORE us.
+            if typ == 'unavailable':
+                self.pending_users.pop(from_nick, None)
             # ignore redondant presence message, see bug #1509
-            if (from_nick not in [user.nick for user in self.users]
-                    and typ != "unavailable"):
-                new_user = User(from_nick, affiliation, show,
-                                status, role, jid)
-                self.users.append(new_user)
-                self.core.events.trigger('muc_join', presence, self)
+            elif (from_nick not in self._users_by_nick
+                    and from_nick not in self.pending_users):
+                self.pending_users[from_nick] = (presence, (affiliation, show,
+                                                            status, role, jid))
                 if '110' in status_codes or self.own_nick == from_nick:
                     # second part of the condition is a workaround for old
                     # ejabberd or every gateway in the world that just do
                     # not send a 110 status code with the presence
+                    self.add_pending_users()
+                    new_user = self.get_user_by_name(from_nick)
                     self.own_nick = from_nick
                     self.joined = True
+                    self.receiving_history = True
                     if self.name in self.core.initial_joins:
                         self.core.initial_joins.remove(self.name)
                         self._state = 'normal'
@@ -1107,12 +1201,30 @@ class MucTab(ChatTab):
             else:
                 self.on_user_change_status(user, from_nick, from_room,
                                            affiliation, role, show, status)
+        if not self.joined:
+            # the occupants are only displayed once the room is joined
+            return
         if self.core.current_tab() is self:
-            self.text_win.refresh()
-            self.user_win.refresh(self.users)
-            self.info_header.refresh(self, self.text_win)
-            self.input.refresh()
-            self.core.doupdate()
+            frames = self.core.frames
+            frames.refresh(self.text_win.refresh, tab=self)
+            frames.refresh(self.user_win.refresh, self.users, tab=self)
+            frames.refresh(self.info_header.refresh, self, self.text_win,
+                           tab=self)
+            frames.refresh(self.input.refresh, tab=self)
+
+    def add_pending_users(self):
+        """
+        Add the occupants whose presence was received before our own to
+        the user list, all at once, and tell the plugins about them
+        """
+        pending, self.pending_users = self.pending_users, OrderedDict()
+        self.users = self.users + [User(nick, *args) for nick, (presence, args)
+                                                     in pending.items()]
+        presences = [presence for presence, args in pending.values()]
+        if config.get('individual_join_events'):
+            for presence in presences:
+                self.core.events.trigger('muc_join', presence, self)
+        self.core.events.trigger('muc_join_batch', presences, self)
 
     def on_non_member_kicked(self):
         """We have been kicked because the MUC is members-only"""
@@ -1138,7 +1250,7 @@ class MucTab(ChatTab):
         """
         user = User(from_nick, affiliation,
                     show, status, role, jid)
-        self.users.append(user)
+        self.add_user(user)
         hide_exit_join = config.get_by_tabname('hide_exit_join',
                                                self.general_jid)
         if hide_exit_join != 0:
@@ -1178,7 +1290,7 @@ class MucTab(ChatTab):
             self.own_nick = new_nick
             # also change our nick in all private discussions of this room
             self.core.on_muc_own_nickchange(self)
-        user.change_nick(new_nick)
+        self.rename_user(user, new_nick)
 
         if config.get_by_tabname('display_user_color_in_join_part',
                                  self.general_jid):
@@ -1198,7 +1310,7 @@ class MucTab(ChatTab):
         """
         When someone is banned from a muc
         """
-        self.users.remove(user)
+        self.remove_user(user)
         by = presence.find('{%s}x/{%s}item/{%s}actor' %
                             (NS_MUC_USER, NS_MUC_USER, NS_MUC_USER))
         reason = presence.find('{%s}x/{%s}item/{%s}reason' %
@@ -1266,7 +1378,7 @@ class MucTab(ChatTab):
         """
         When someone is kicked from a muc
         """
-        self.users.remove(user)
+        self.remove_user(user)
         actor_elem = presence.find('{%s}x/{%s}item/{%s}actor' %
                                      (NS_MUC_USER, NS_MUC_USER, NS_MUC_USER))
         reason = presence.find('{%s}x/{%s}item/{%s}reason' %
@@ -1334,7 +1446,7 @@ class MucTab(ChatTab):
         """
         When an user leaves a groupchat
         """
-        self.users.remove(user)
+        self.remove_user(user)
         if self.own_nick == user.nick:
             # We are now out of the room.
             # Happens with some buggy (? not sure) servers
@@ -1445,7 +1557,7 @@ class MucTab(ChatTab):
                                                       (from_room, from_nick),
                                                     msg)
         # finally, effectively change the user status
-        user.update(affiliation, show, status, role)
+        self.update_user(user, affiliation, show, status, role)
 
     def disconnect(self):
         """
@@ -1453,9 +1565,11 @@ class MucTab(ChatTab):
         we can know if we can join it, send messages to it, etc
         """
         self.users = []
+        self.pending_users.clear()
         if self is not self.core.current_tab():
             self.state = 'disconnected'
         self.joined = False
+        self.end_of_history()
 
     def get_single_line_topic(self):
         """
@@ -1469,9 +1583,7 @@ class MucTab(ChatTab):
         to be
         """
         if time is None and self.joined:    # don't log the history messages
-            if not logger.log_message(self.name, nickname, txt, typ=typ):
-                self.core.information(_('Unable to write in the log file'),
-                                      _('Error'))
+            logger.log_message(self.name, nickname, txt, typ=typ)
 
     def do_highlight(self, txt, time, nickname):
         """
@@ -1479,21 +1591,10 @@ class MucTab(ChatTab):
         """
         highlighted = False
         if not time and nickname and nickname != self.own_nick and self.joined:
-
-            if re.search(r'\b' + self.own_nick.lower() + r'\b', txt.lower()):
+            if self.highlight_matcher().search(txt):
                 if self.state != 'current':
                     self.state = 'highlight'
                 highlighted = True
-            else:
-                highlight_words = config.get_by_tabname('highlight_on',
-                                                        self.general_jid)
-                highlight_words = highlight_words.split(':')
-                for word in highlight_words:
-                    if word and word.lower() in txt.lower():
-                        if self.state != 'current':
-                            self.state = 'highlight'
-                        highlighted = True
-                        break
         if highlighted:
             beep_on = config.get('beep_on').split()
             if 'highlight' in beep_on and 'message' not in beep_on:
@@ -1501,14 +1602,27 @@ class MucTab(ChatTab):
                     curses.beep()
         return highlighted
 
+    def highlight_matcher(self):
+        """
+        The matcher of the highlights for our current nick and the
+        highlight_on option of the room
+        """
+        return highlight.get_matcher(self.own_nick,
+                                     config.get_by_tabname('highlight_on',
+                                                           self.general_jid))
+
     def get_user_by_name(self, nick):
         """
         Gets the user associated with the given nick, or None if not found
         """
-        for user in self.users:
-            if user.nick == nick:
-                return user
-        return None
+        return self._users_by_nick.get(nick)
+
+    def get_users_by_jid(self, jid):
+        """
+        Gets the users (several nicks can share the same account) with the
+        given bare JID, in a non-anonymous room
+        """
+        return list(self._users_by_jid.get(jid, []))
 
     def add_message(self, txt, time=None, nickname=None, **kwargs):
         """
@@ -1517,6 +1631,44 @@ class MucTab(ChatTab):
         in the room anymore
         Return True if the message highlighted us. False otherwise.
         """
+        self.add_pending_history()
+        args = self._make_message_args(txt, time, nickname, **kwargs)
+        self._text_buffer.add_message(**args)
+        return args.get('highlight', False)
+
+    def add_history_message(self, txt, time, nickname, **kwargs):
+        """
+        Add a message received as part of the room history. While the room
+        is being joined, it is kept until the end of the history is
+        received, to add all the history messages at once.
+        """
+        if not self.receiving_history:
+            return self.add_message(txt, time, nickname, **kwargs)
+        args = self._make_message_args(txt, time, nickname, **kwargs)
+        self.pending_history.append(args)
+        return args.get('highlight', False)
+
+    def end_of_history(self):
+        """
+        Called when the whole history has been received
+        """
+        self.receiving_history = False
+        self.add_pending_history()
+
+    def add_pending_history(self):
+        """
+        Add the history messages received while joining the room
+        """
+        if self.pending_history:
+            messages = self.pending_history
+            self.pending_history = []
+            self._text_buffer.add_messages(messages)
+
+    def _make_message_args(self, txt, time, nickname, **kwargs):
+        """
+        Log the message, update the state of the tab, and return the
+        arguments to give to TextBuffer.add_message
+        """
         self.log_message(txt, nickname, time=time, typ=kwargs.get('typ', 1))
         args = dict()
         for key, value in kwargs.items():
@@ -1548,12 +1700,14 @@ class MucTab(ChatTab):
                     'info_col': dump_tuple(get_theme().COLOR_INFORMATION_TEXT)}
         elif not kwargs.get('highlight'):                   # TODO
             args['highlight'] = self.do_highlight(txt, time, nickname)
-        time = time or datetime.now()
-        self._text_buffer.add_message(txt, time, nickname, **args)
-        return args.get('highlight', False)
+        args['txt'] = txt
+        args['time'] = time or datetime.now()
+        args['nickname'] = nickname
+        return args
 
     def modify_message(self, txt, old_id, new_id,
                        time=None, nickname=None, user=None, jid=None):
+        self.add_pending_history()
         self.log_message(txt, nickname, time=time, typ=1)
         highlight = self.do_highlight(txt, time, nickname)
         message = self._text_buffer.modify_message(txt, old_id, new_id,
@@ -20,6 +20,7 @@ import curses
 from . import OneToOneTab, MucTab, Tab
 
 import fixes
+import highlight
 import windows
 import xhtml
 from common import safeJID
@@ -86,15 +87,14 @@ class PrivateTab(OneToOneTab):
     def remove_information_element(plugin_name):
         del PrivateTab.additional_informations[plugin_name]
 
-    def load_logs(self, log_nb):
-        logs = logger.get_logs(safeJID(self.name).full.replace('/', '\\'), log_nb)
+    def log_name(self):
+        return safeJID(self.name).full.replace('/', '\\')
 
     def log_message(self, txt, nickname, time=None, typ=1):
         """
         Log the messages in the archives.
         """
-        if not logger.log_message(self.name, nickname, txt, date=time, typ=typ):
-            self.core.information(_('Unable to write in the log file'), 'Error')
+        logger.log_message(self.name, nickname, txt, date=time, typ=typ)
 
     def on_close(self):
         self.parent_muc.privates.remove(self)
@@ -262,6 +262,15 @@ class PrivateTab(OneToOneTab):
     def get_nick(self):
         return safeJID(self.name).resource
 
+    def highlight_matcher(self):
+        """
+        The matcher of the highlights for our nick in the room and the
+        highlight_on option
+        """
+        return highlight.get_matcher(self.own_nick,
+                                     config.get_by_tabname('highlight_on',
+                                                           self.general_jid))
+
     def on_input(self, key, raw):
         if not raw and key in self.key_func:
             self.key_func[key]()
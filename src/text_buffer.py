@@ -11,15 +11,100 @@ independantly by their TextWins.
 import logging
 log = logging.getLogger(__name__)
 
-import collections
-
 from datetime import datetime
+from sys import intern
 from config import config
 from theming import get_theme, dump_tuple
 
 message_fields = ('txt nick_color time str_time nickname user identifier'
-                  ' highlight me old_message revisions jid ack')
-Message = collections.namedtuple('Message', message_fields)
+                  ' highlight me old_message revisions jid ack offset')
+
+# The fields that can change when a message is corrected. The previous
+# revisions of a message only keep these fields, all the others are
+# shared with the current revision.
+revision_fields = ('txt', 'time', 'str_time', 'identifier', 'highlight',
+                   'me', 'jid', 'ack')
+
+# JID objects shared between the messages, see intern_jid()
+_jids = {}
+
+def intern_jid(jid):
+    """
+    Return a JID equal to the given one, shared with the other messages
+    from the same sender
+    """
+    if jid is None:
+        return None
+    if isinstance(jid, str):
+        return intern(jid)
+    key = str(jid)
+    shared = _jids.get(key)
+    if shared is None:
+        if len(_jids) >= 4096:
+            _jids.clear()
+        shared = _jids[key] = jid
+    return shared
+
+class Message(object):
+    """
+    A message stored in a TextBuffer.
+
+    It takes the same arguments as the namedtuple it replaces, but uses
+    __slots__, interns the nickname, str_time and jid fields, and keeps
+    the previous revisions in `revision_history`, a tuple (most recent
+    first) of `revision_fields` tuples. `old_message` rebuilds the
+    previous revision on demand. The messages read from the logs keep
+    their position in the log file in `offset`.
+    """
+    __slots__ = ('txt', 'nick_color', 'time', 'str_time', 'nickname',
+                 'user', 'identifier', 'highlight', 'me', 'revisions',
+                 'jid', 'ack', 'revision_history', 'offset', '__weakref__')
+
+    def __init__(self, txt, nick_color, time, str_time, nickname, user,
+                 identifier, highlight, me, old_message, revisions, jid,
+                 ack, offset=None):
+        self.txt = txt
+        self.nick_color = nick_color
+        self.time = time
+        self.str_time = intern(str_time) if str_time else str_time
+        self.nickname = intern(nickname) if nickname else nickname
+        self.user = user
+        self.identifier = identifier
+        self.highlight = highlight
+        self.me = me
+        self.revisions = revisions
+        self.jid = intern_jid(jid)
+        self.ack = ack
+        self.offset = offset
+        if old_message is None:
+            self.revision_history = ()
+        else:
+            self.revision_history = ((old_message.revision(),) +
+                                     old_message.revision_history)
+
+    def revision(self):
+        "The fields of this message that a correction can change"
+        return (self.txt, self.time, self.str_time, self.identifier,
+                self.highlight, self.me, self.jid, self.ack)
+
+    @property
+    def old_message(self):
+        """
+        The previous revision of this message, or None if it has never
+        been corrected
+        """
+        if not self.revision_history:
+            return None
+        old = Message.__new__(Message)
+        (old.txt, old.time, old.str_time, old.identifier, old.highlight,
+         old.me, old.jid, old.ack) = self.revision_history[0]
+        old.nick_color = self.nick_color
+        old.nickname = self.nickname
+        old.user = self.user
+        old.revisions = self.revisions - 1
+        old.revision_history = self.revision_history[1:]
+        old.offset = None
+        return old
 
 class CorrectionError(Exception):
     pass
@@ -56,6 +141,117 @@ def repr_message(self):
 Message.__repr__ = repr_message
 Message.__str__ = repr_message
 
+class MessageRing(object):
+    """
+    A bounded sequence of messages, backed by a circular list.
+
+    Appending to a full ring overwrites the oldest message instead of
+    shifting the whole list, and an {identifier: sequence number} index
+    is kept up to date on every insertion and eviction, so that finding
+    a message by its id does not need to walk the buffer.
+
+    Each message gets a sequence number that never changes while it is
+    in the ring; the oldest message has the number `first_seq`.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(capacity, 0)
+        self._slots = []
+        # position of the oldest message in self._slots
+        self._start = 0
+        self.first_seq = 0
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __bool__(self):
+        return bool(self._slots)
+
+    def __iter__(self):
+        slots, start = self._slots, self._start
+        for i in range(start, len(slots)):
+            yield slots[i]
+        for i in range(start):
+            yield slots[i]
+
+    def __reversed__(self):
+        slots, start = self._slots, self._start
+        for i in range(start - 1, -1, -1):
+            yield slots[i]
+        for i in range(len(slots) - 1, start - 1, -1):
+            yield slots[i]
+
+    def _slot(self, index):
+        "Position in self._slots of the index-th message"
+        size = len(self._slots)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('message index out of range')
+        index += self._start
+        if index >= size:
+            index -= size
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        return self._slots[self._slot(index)]
+
+    def __setitem__(self, index, msg):
+        slot = self._slot(index)
+        self._unindex(self._slots[slot], self.first_seq + index % len(self))
+        self._slots[slot] = msg
+        self._index(msg, self.first_seq + index % len(self))
+
+    def to_list(self):
+        "Return the messages as a list, from the oldest to the newest"
+        return self._slots[self._start:] + self._slots[:self._start]
+
+    def _index(self, msg, seq):
+        if msg.identifier:
+            self._ids[msg.identifier] = seq
+
+    def _unindex(self, msg, seq):
+        if msg.identifier and self._ids.get(msg.identifier) == seq:
+            del self._ids[msg.identifier]
+
+    def append(self, msg):
+        """
+        Add a message at the end of the ring, and return the message
+        that had to be evicted to make room for it, if any
+        """
+        seq = self.first_seq + len(self._slots)
+        if not self.capacity:
+            return msg
+        if len(self._slots) < self.capacity:
+            self._slots.append(msg)
+            self._index(msg, seq)
+            return None
+        evicted = self._slots[self._start]
+        self._unindex(evicted, self.first_seq)
+        self._slots[self._start] = msg
+        self._index(msg, seq)
+        self._start = (self._start + 1) % self.capacity
+        self.first_seq += 1
+        return evicted
+
+    def clear(self):
+        self._slots = []
+        self._start = 0
+        self.first_seq = 0
+        self._ids = {}
+
+    def find(self, identifier):
+        """
+        Return the index of the last message with this identifier,
+        or -1 if it is not in the ring
+        """
+        seq = self._ids.get(identifier)
+        if seq is None:
+            return -1
+        return seq - self.first_seq
+
 class TextBuffer(object):
     """
     This class just keep trace of messages, in a list with various
@@ -67,14 +263,34 @@ class TextBuffer(object):
             messages_nb_limit = config.get('max_messages_in_memory')
         self.messages_nb_limit = messages_nb_limit
         # Message objects
-        self.messages = []
+        self._messages = MessageRing(messages_nb_limit)
         # we keep track of one or more windows
         # so we can pass the new messages to them, as they are added, so
         # they (the windows) can build the lines from the new message
         self.windows = []
 
+    @property
+    def messages(self):
+        return self._messages
+
+    @messages.setter
+    def messages(self, value):
+        value = list(value)
+        # there may be more messages than the limit, after loading older
+        # ones from the logs (see add_history)
+        capacity = max(self.messages_nb_limit, len(value))
+        if capacity != self._messages.capacity:
+            self._messages = MessageRing(capacity)
+        else:
+            self._messages.clear()
+        for msg in value:
+            self._messages.append(msg)
+
     def add_window(self, win):
         self.windows.append(win)
+        win.text_buffer = self
+        if win.virtual:
+            win.rebuild_everything(self)
 
     @property
     def last_message(self):
@@ -84,7 +300,8 @@ class TextBuffer(object):
     @staticmethod
     def make_message(txt, time, nickname, nick_color, history, user,
                      identifier, str_time=None, highlight=False,
-                     old_message=None, revisions=0, jid=None, ack=None):
+                     old_message=None, revisions=0, jid=None, ack=None,
+                     offset=None):
         """
         Create a new Message object with parameters, check for /me messages,
         and delayed messages
@@ -119,10 +336,23 @@ class TextBuffer(object):
                 old_message=old_message,
                 revisions=revisions,
                 jid=jid,
-                ack=ack)
+                ack=ack,
+                offset=offset)
         log.debug('Set message %s with %s.', identifier, msg)
         return msg
 
+    @classmethod
+    def make_message_from_args(cls, args):
+        "Create a Message from a dict of the arguments of add_message"
+        return cls.make_message(args['txt'], args.get('time'),
+                                args.get('nickname'), args.get('nick_color'),
+                                args.get('history'), args.get('user'),
+                                args.get('identifier'),
+                                str_time=args.get('str_time'),
+                                highlight=args.get('highlight', False),
+                                jid=args.get('jid'), ack=args.get('ack'),
+                                offset=args.get('offset'))
+
     def add_message(self, txt, time=None, nickname=None,
                     nick_color=None, history=None, user=None, highlight=False,
                     identifier=None, str_time=None, jid=None, ack=None):
@@ -134,9 +364,6 @@ class TextBuffer(object):
                                 highlight=highlight, jid=jid, ack=ack)
         self.messages.append(msg)
 
-        while len(self.messages) > self.messages_nb_limit:
-            self.messages.pop(0)
-
         ret_val = None
         show_timestamps = config.get('show_timestamps')
         for window in self.windows: # make the associated windows
@@ -151,15 +378,77 @@ class TextBuffer(object):
 
         return ret_val or 1
 
+    def add_messages(self, messages):
+        """
+        Create several messages (from dicts of the arguments of
+        add_message) and add them to the text buffer at once. The windows
+        build all their lines in one pass.
+        """
+        new_messages = []
+        for args in messages:
+            msg = self.make_message_from_args(args)
+            self.messages.append(msg)
+            new_messages.append(msg)
+        # the oldest ones may already have been removed from the buffer
+        kept = min(len(new_messages), len(self.messages))
+        if not kept:
+            return 0
+        new_messages = new_messages[len(new_messages) - kept:]
+
+        ret_val = None
+        show_timestamps = config.get('show_timestamps')
+        for window in self.windows:
+            nb = window.build_new_messages(new_messages,
+                                           timestamp=show_timestamps)
+            if ret_val is None:
+                ret_val = nb
+            if window.pos != 0:
+                window.scroll_up(nb)
+
+        return ret_val or len(new_messages)
+
+    def add_history(self, messages, limit=None):
+        """
+        Create several messages (from dicts of the arguments of
+        add_message) and insert them before the messages of the buffer,
+        as far as there is room for them: they are older ones, loaded
+        from the logs. The buffer can then hold up to limit messages
+        (messages_nb_limit by default), until trim_history is called.
+        Return the number of messages inserted.
+        """
+        if limit is None:
+            limit = self.messages_nb_limit
+        room = limit - len(self.messages)
+        if room <= 0:
+            return 0
+        new_messages = [self.make_message_from_args(args)
+                        for args in messages[-room:]]
+        if not new_messages:
+            return 0
+        self.messages = new_messages + self.messages.to_list()
+        show_timestamps = config.get('show_timestamps')
+        for window in self.windows:
+            window.prepend_messages(new_messages, timestamp=show_timestamps)
+        return len(new_messages)
+
+    def trim_history(self):
+        """
+        Forget the oldest messages over messages_nb_limit (loaded from
+        the logs by add_history), and return their number
+        """
+        nb = len(self.messages) - self.messages_nb_limit
+        if nb <= 0:
+            return 0
+        self.messages = self.messages.to_list()[nb:]
+        for window in self.windows:
+            window.forget_first_messages(nb)
+        return nb
+
     def _find_message(self, old_id):
         """
         Find a message in the text buffer from its message id
         """
-        for i in range(len(self.messages) -1, -1, -1):
-            msg = self.messages[i]
-            if msg.identifier == old_id:
-                return i
-        return -1
+        return self.messages.find(old_id)
 
     def ack_message(self, old_id):
         """
@@ -169,11 +458,8 @@ class TextBuffer(object):
         if i == -1:
             return
         msg = self.messages[i]
-        new_msg = list(msg)
-        new_msg[12] = True
-        new_msg = Message(*new_msg)
-        self.messages[i] = new_msg
-        return new_msg
+        msg.ack = True
+        return msg
 
     def modify_message(self, txt, old_id, new_id, highlight=False,
                        time=None, user=None, jid=None):
@@ -71,6 +71,7 @@ from config import config
 import curses
 import imp
 import os
+from collections import OrderedDict
 from os import path
 from sys import version_info
 
@@ -355,8 +356,24 @@ theme = Theme()
 # a dict "color tuple -> color_pair"
 # Each time we use a color tuple, we check if it has already been used.
 # If not we create a new color_pair and keep it in that dict, to use it
-# the next time.
-curses_colors_dict = {}
+# the next time. It is ordered from the least recently used pair to the
+# most recently used one, so that the oldest pair can be recycled when
+# all of them are used.
+curses_colors_dict = OrderedDict()
+
+# a dict "color_pair -> color tuple", the reverse of curses_colors_dict
+curses_pairs_colors = {}
+
+# a dict "full color tuple -> (curses attr, colors)", to compute the attr
+# of each tuple only once. It is cleared when the theme is reloaded.
+curses_attrs_dict = {}
+
+# The number of color pairs recycled since the start
+recycled_pairs = 0
+
+# Incremented each time the theme is reloaded, so that the curses
+# attributes computed with the previous theme are not used anymore
+attrs_generation = 0
 
 table_256_to_16 = [
          0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11, 12, 13, 14, 15,
@@ -398,11 +415,65 @@ def read_tuple(_str):
     char = attrs[2] if len(attrs) > 2 else None
     return (int(attrs[0]), int(attrs[1])), char
 
+def max_color_pairs():
+    """
+    The number of color pairs that can be used: curses.COLOR_PAIRS minus
+    the pair 0, and no more than what fits in the color bits of an attr
+    """
+    return min(curses.COLOR_PAIRS, 256) - 1
+
+def get_color_pair(colors):
+    """
+    Return the number of the curses color pair for these (fg, bg) colors,
+    creating it if needed. When all the pairs are used, the least
+    recently used one is recycled.
+    """
+    global attrs_generation, recycled_pairs
+    try:
+        pair = curses_colors_dict[colors]
+    except KeyError:
+        pass
+    else:
+        curses_colors_dict.move_to_end(colors)
+        return pair
+    if len(curses_colors_dict) < max_color_pairs():
+        pair = len(curses_colors_dict) + 1
+    else:
+        old_colors, pair = curses_colors_dict.popitem(last=False)
+        log.debug('Recycling the color pair %s of %s', pair, old_colors)
+        recycled_pairs += 1
+        # the attrs computed with that pair are now wrong
+        for key, (attr, attr_colors) in list(curses_attrs_dict.items()):
+            if attr_colors == old_colors:
+                del curses_attrs_dict[key]
+        attrs_generation += 1
+    curses.init_pair(pair, colors[0], colors[1])
+    curses_colors_dict[colors] = pair
+    curses_pairs_colors[pair] = colors
+    return pair
+
+def use_attrs(attrs):
+    """
+    Mark the color pair of curses attributes computed earlier (and
+    displayed again) as recently used, so that it is not recycled
+    """
+    colors = curses_pairs_colors.get(curses.pair_number(attrs))
+    if colors is not None:
+        curses_colors_dict.move_to_end(colors)
+
 def to_curses_attr(color_tuple):
     """
     Takes a color tuple (as defined at the top of this file) and
     returns a valid curses attr that can be passed directly to attron() or attroff()
     """
+    try:
+        curses_pair, colors = curses_attrs_dict[color_tuple]
+    except KeyError:
+        pass
+    else:
+        curses_colors_dict.move_to_end(colors)
+        return curses_pair
+
     # extract the color from that tuple
     if len(color_tuple) == 3:
         colors = (color_tuple[0], color_tuple[1])
@@ -420,14 +491,7 @@ def to_curses_attr(color_tuple):
         if colors[1] >= 8:
             colors = (colors[0], colors[1] - 8)
 
-    # check if we already used these colors
-    try:
-        pair = curses_colors_dict[colors]
-    except KeyError:
-        pair = len(curses_colors_dict) + 1
-        curses.init_pair(pair, colors[0], colors[1])
-        curses_colors_dict[colors] = pair
-    curses_pair = curses.color_pair(pair)
+    curses_pair = curses.color_pair(get_color_pair(colors))
     if len(color_tuple) == 3:
         additional_val = color_tuple[2]
         if 'b' in additional_val or bold is True:
@@ -436,6 +500,7 @@ def to_curses_attr(color_tuple):
             curses_pair = curses_pair | curses.A_UNDERLINE
         if 'a' in additional_val:
             curses_pair = curses_pair | curses.A_BLINK
+    curses_attrs_dict[color_tuple] = (curses_pair, colors)
     return curses_pair
 
 def get_theme():
@@ -486,7 +551,9 @@ def update_themes_dir(option=None, value=None):
 
 def reload_theme():
     theme_name = config.get('theme')
-    global theme
+    global theme, attrs_generation
+    attrs_generation += 1
+    curses_attrs_dict.clear()
     if theme_name == 'default' or not theme_name.strip():
         theme = Theme()
         return
@@ -46,6 +46,13 @@ class User(object):
     def change_nick(self, nick):
         self.nick = nick
 
+    def sort_key(self):
+        """
+        The key giving the order of the users in the user list: by
+        decreasing role, then by nick (the same order as __lt__)
+        """
+        return (-ROLE_DICT[self.role], self.nick.lower())
+
     def set_last_talked(self, time):
         """
         time: datetime object
@@ -10,13 +10,13 @@ A Tab (see the src/tabs module) is composed of multiple Windows
 import logging
 log = logging.getLogger(__name__)
 
-import collections
 import curses
 import string
 from threading import RLock
 
 import core
 import singleton
+import theming
 from theming import to_curses_attr, read_tuple
 
 FORMAT_CHAR = '\x19'
@@ -28,9 +28,104 @@ format_chars = ['\x0E', '\x0F', '\x10', '\x11', '\x12', '\x13',
 # different colors allowed in the input
 allowed_color_digits = ('0', '1', '2', '3', '4', '5', '6', '7')
 
-# msg is a reference to the corresponding Message tuple. text_start and
-# text_end are the position delimiting the text in this line.
-Line = collections.namedtuple('Line', 'msg start_pos end_pos prepend')
+class Line(object):
+    """
+    A line of a message, as displayed in a TextWin.
+
+    msg is a reference to the corresponding Message. start_pos and end_pos
+    are the positions delimiting the text in this line, and prepend the
+    formatting to apply before it.
+    """
+    __slots__ = ('msg', 'start_pos', 'end_pos', 'prepend', '_segments',
+                 '_generation')
+
+    def __init__(self, msg, start_pos, end_pos, prepend):
+        self.msg = msg
+        self.start_pos = start_pos
+        self.end_pos = end_pos
+        self.prepend = prepend
+        self._segments = None
+        self._generation = None
+
+    def segments(self):
+        """
+        Return the (text, curses attributes) runs of the line. They are
+        computed once, and again if the theme is reloaded or one of their
+        color pairs recycled; the pairs of the runs computed earlier are
+        marked as used, since they are displayed again.
+        """
+        if self._generation != theming.attrs_generation:
+            self._segments = compile_colored(
+                    self.prepend + self.msg.txt[self.start_pos:self.end_pos])
+            self._generation = theming.attrs_generation
+        else:
+            for text, attrs in self._segments:
+                if attrs & curses.A_COLOR:
+                    theming.use_attrs(attrs)
+        return self._segments
+
+    def __repr__(self):
+        return 'Line(msg=%r, start_pos=%r, end_pos=%r, prepend=%r)' % (
+                self.msg, self.start_pos, self.end_pos, self.prepend)
+
+def attron(attrs, attr):
+    """
+    Return the attributes resulting from the addition of attr to attrs,
+    like curses' attron(): the color of attr replaces the previous one.
+    """
+    if attr & curses.A_COLOR:
+        return (attrs & ~curses.A_COLOR) | attr
+    return attrs | attr
+
+def compile_colored(text):
+    """
+    Return the (text, curses attributes) runs of a string containing
+    formatting chars, as displayed by Win.addstr_colored in a window
+    without attributes.
+    """
+    segments = []
+    attrs = 0
+    next_attr_char = text.find(FORMAT_CHAR)
+    while next_attr_char != -1 and text:
+        if next_attr_char + 1 < len(text):
+            attr_char = text[next_attr_char+1].lower()
+        else:
+            attr_char = str()
+        if next_attr_char != 0:
+            if segments and segments[-1][1] == attrs:
+                segments[-1] = (segments[-1][0] + text[:next_attr_char], attrs)
+            else:
+                segments.append((text[:next_attr_char], attrs))
+        if attr_char == 'o':
+            attrs = 0
+        elif attr_char == 'u':
+            attrs |= curses.A_UNDERLINE
+        elif attr_char == 'b':
+            attrs |= curses.A_BOLD
+        if (attr_char in string.digits or attr_char == '-') and attr_char != '':
+            color_str = text[next_attr_char+1:text.find('}', next_attr_char)]
+            if ',' in color_str:
+                tup, char = read_tuple(color_str)
+                attrs = attron(attrs, to_curses_attr(tup))
+                if char:
+                    if char == 'o':
+                        attrs = 0
+                    elif char == 'u':
+                        attrs |= curses.A_UNDERLINE
+                    elif char == 'b':
+                        attrs |= curses.A_BOLD
+            elif color_str:
+                attrs = attron(attrs, to_curses_attr((int(color_str), -1)))
+            text = text[next_attr_char+len(color_str)+2:]
+        else:
+            text = text[next_attr_char+2:]
+        next_attr_char = text.find(FORMAT_CHAR)
+    if text:
+        if segments and segments[-1][1] == attrs:
+            segments[-1] = (segments[-1][0] + text, attrs)
+        else:
+            segments.append((text, attrs))
+    return tuple(segments)
 
 LINES_NB_LIMIT = 4096
 
@@ -254,11 +254,7 @@ class MucInfoWin(InfoWin):
         """
         Write our own role and affiliation
         """
-        own_user = None
-        for user in room.users:
-            if user.nick == room.own_nick:
-                own_user = user
-                break
+        own_user = room.get_user_by_name(room.own_nick)
         if not own_user:
             return
         txt = ' ('
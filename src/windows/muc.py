@@ -33,29 +33,32 @@ class UserList(Win):
         self.addstr(y, self.width-2, '++', to_curses_attr(get_theme().COLOR_MORE_INDICATOR))
 
     def refresh(self, users):
+        """
+        Draw the visible part of the users, which are already sorted (see
+        MucTab.users)
+        """
         log.debug('Refresh: %s', self.__class__.__name__)
         if config.get('hide_user_list'):
             return # do not refresh if this win is hidden.
         self._win.erase()
-        if config.get('user_list_sort').lower() == 'asc':
+        asc_sort = config.get('user_list_sort').lower() == 'asc'
+        if asc_sort:
             y, x = self._win.getmaxyx()
             y -= 1
-            users = sorted(users)
         else:
             y = 0
-            users = sorted(users)
 
         if len(users) < self.height:
             self.pos = 0
         elif self.pos >= len(users) - self.height and self.pos != 0:
             self.pos = len(users) - self.height
-        for user in users[self.pos:]:
+        for user in users[self.pos:self.pos + self.height]:
             self.draw_role_affiliation(y, user)
             self.draw_status_chatstate(y, user)
             self.addstr(y, 2,
                     poopt.cut_by_columns(user.nick, self.width - 2),
                     to_curses_attr(user.color))
-            if config.get('user_list_sort').lower() == 'asc':
+            if asc_sort:
                 y -= 1
             else:
                 y += 1
@@ -63,12 +66,12 @@ class UserList(Win):
                 break
         # draw indicators of position in the list
         if self.pos > 0:
-            if config.get('user_list_sort').lower() == 'asc':
+            if asc_sort:
                 self.draw_plus(self.height-1)
             else:
                 self.draw_plus(0)
         if self.pos + self.height < len(users):
-            if config.get('user_list_sort').lower() == 'asc':
+            if asc_sort:
                 self.draw_plus(0)
             else:
                 self.draw_plus(self.height-1)
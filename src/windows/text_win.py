@@ -7,6 +7,10 @@ import logging
 log = logging.getLogger(__name__)
 
 import curses
+import weakref
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import islice
 from math import ceil, log10
 
 from . import Win
@@ -18,21 +22,149 @@ from config import config
 from theming import to_curses_attr, get_theme, dump_tuple
 
 
+class MessageRef(weakref.ref):
+    """
+    A weak reference to a message of the WrapCache, with the widths for
+    which its lines are in the cache
+    """
+    __slots__ = ('key', 'widths')
+
+    def __new__(cls, message, callback):
+        return weakref.ref.__new__(cls, message, callback)
+
+    def __init__(self, message, callback):
+        weakref.ref.__init__(self, message, callback)
+        self.key = id(message)
+        self.widths = []
+
+class WrapCache(object):
+    """
+    LRU cache of the results of poopt.cut_text, keyed by the id of the
+    message and the width available for its text, shared by all the
+    TextWins.
+
+    The messages are only referenced weakly, so that the cache does not
+    keep alive the messages removed from their buffers, or whose tab is
+    closed: their entries are removed when they are deleted.
+
+    Its size is limited by the wrap_cache_size option, which is the number
+    of lines (start and end positions) it can hold. The hits and misses
+    counters (see /stats) can be used to tune it.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()
+        # the MessageRefs of the messages in the cache, by id
+        self.refs = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cut_text(self, message, width):
+        """
+        Return the (start, end) positions of the lines of the message
+        text, cut at the given width
+        """
+        key = (id(message), width)
+        lines = self.entries.get(key)
+        if lines is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return lines
+        self.misses += 1
+        lines = poopt.cut_text(message.txt, width)
+        budget = config.get('wrap_cache_size')
+        if len(lines) <= budget:
+            ref = self.refs.get(key[0])
+            if ref is None:
+                ref = self.refs[key[0]] = MessageRef(message, self._forget)
+            ref.widths.append(width)
+            self.entries[key] = lines
+            self.size += len(lines)
+            while self.size > budget:
+                (message_id, width), old = self.entries.popitem(last=False)
+                self.size -= len(old)
+                ref = self.refs[message_id]
+                ref.widths.remove(width)
+                if not ref.widths:
+                    del self.refs[message_id]
+                self.evictions += 1
+        return lines
+
+    def _forget(self, ref):
+        "Remove the entries of a message which has been deleted"
+        if self.refs.get(ref.key) is not ref:
+            return
+        del self.refs[ref.key]
+        for width in ref.widths:
+            self.size -= len(self.entries.pop((ref.key, width)))
+
+    def clear(self):
+        self.entries.clear()
+        self.refs.clear()
+        self.size = 0
+
+    def stats(self):
+        "Return a short description of the state of the cache"
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return ('%s entries, %s lines, %s hits (%.1f%%), %s misses, '
+                '%s evictions') % (len(self.entries), self.size, self.hits,
+                                   ratio, self.misses, self.evictions)
+
+wrap_cache = WrapCache()
+
+
 class TextWin(Win):
-    def __init__(self, lines_nb_limit=None):
+    def __init__(self, lines_nb_limit=None, virtual=None):
         if lines_nb_limit is None:
             lines_nb_limit = config.get('max_lines_in_memory')
+        if virtual is None:
+            virtual = config.get('lazy_text_build')
         Win.__init__(self)
         self.lines_nb_limit = lines_nb_limit
         self.pos = 0
         self.built_lines = []   # Each new message is built and kept here.
         # on resize, we rebuild all the messages
 
+        # The TextBuffer this window displays (set by TextBuffer.add_window)
+        self.text_buffer = None
+
+        # In virtual mode, the lines are only built for the messages
+        # around the part of the buffer that is displayed. built_lines
+        # then contains the lines of a contiguous range of messages, which
+        # are followed in the buffer by self._below messages that are
+        # only counted, and take self._below_lines lines (or None if that
+        # number has to be computed again). self.pos still counts the
+        # lines from the bottom of the whole buffer. The self._locked
+        # messages received while the window is locked are not displayed.
+        self.virtual = virtual
+        self._below = 0
+        self._locked = 0
+        self._below_lines = 0
+        self._built_messages = 0
+        # number of lines of each message, for the key (width, timestamp)
+        self._line_counts = {}
+        self._line_counts_key = None
+
         self.lock = False
         self.lock_buffer = []
 
-        # the Lines of the highlights in that buffer
+        # The positions of the lines are absolute: the line at position p
+        # is self.built_lines[p - self._offset]. The offset is increased
+        # when the oldest lines are removed, so the positions kept below
+        # do not have to be updated.
+        self._offset = 0
+        # the positions of the first lines of the highlights in that
+        # buffer, in increasing order
         self.highlights = []
+        # the positions of the first lines of the messages, in increasing
+        # order. The message with the number n is the one starting at
+        # self._starts[n - self._starts_offset].
+        self._starts = []
+        self._starts_offset = 0
+        # the number of each message, by identifier
+        self._spans = {}
         # the current HL position in that list NaN means that we’re not on
         # an hl. -1 is a valid position (it's before the first hl of the
         # list. i.e the separator, in the case where there’s no hl before
@@ -44,6 +176,8 @@ class TextWin(Win):
         self.nb_of_highlights_after_separator = 0
 
         self.separator_after = None
+        # the position of the separator in built_lines, if it is there
+        self._separator_pos = None
 
     def toggle_lock(self):
         if self.lock:
@@ -56,8 +190,15 @@ class TextWin(Win):
         self.lock = True
 
     def release_lock(self):
-        for line in self.lock_buffer:
-            self.built_lines.append(line)
+        if self.virtual:
+            # the messages received in the meantime are built
+            # when they are displayed
+            self._below += self._locked
+            self._below_lines = None
+            self._locked = 0
+        else:
+            self._append_lines(self.lock_buffer)
+        self.lock_buffer = []
         self.lock = False
 
     def next_highlight(self):
@@ -68,6 +209,8 @@ class TextWin(Win):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the next highlight…')
+        if self.virtual:
+            self.materialize_all()
         if (not self.highlights or self.hl_pos != self.hl_pos or
                 self.hl_pos >= len(self.highlights) - 1):
             self.hl_pos = float('nan')
@@ -79,19 +222,7 @@ class TextWin(Win):
         else:
             self.hl_pos = hl_size
         log.debug("self.hl_pos = %s", self.hl_pos)
-        hl = self.highlights[self.hl_pos]
-        pos = None
-        while not pos:
-            try:
-                pos = self.built_lines.index(hl)
-            except ValueError:
-                self.highlights = self.highlights[self.hl_pos+1:]
-                if not self.highlights:
-                    self.hl_pos = float('nan')
-                    self.pos = 0
-                    return
-                self.hl_pos = 0
-                hl = self.highlights[0]
+        pos = self.highlights[self.hl_pos] - self._offset
         self.pos = len(self.built_lines) - pos - self.height
         if self.pos < 0 or self.pos >= len(self.built_lines):
             self.pos = 0
@@ -104,6 +235,8 @@ class TextWin(Win):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the previous highlight…')
+        if self.virtual:
+            self.materialize_all()
         if not self.highlights or self.hl_pos <= 0:
             self.hl_pos = float('nan')
             self.pos = 0
@@ -113,19 +246,7 @@ class TextWin(Win):
         else:
             self.hl_pos -= 1
         log.debug("self.hl_pos = %s", self.hl_pos)
-        hl = self.highlights[self.hl_pos]
-        pos = None
-        while not pos:
-            try:
-                pos = self.built_lines.index(hl)
-            except ValueError:
-                self.highlights = self.highlights[self.hl_pos+1:]
-                if not self.highlights:
-                    self.hl_pos = float('nan')
-                    self.pos = 0
-                    return
-                self.hl_pos = 0
-                hl = self.highlights[0]
+        pos = self.highlights[self.hl_pos] - self._offset
         self.pos = len(self.built_lines) - pos - self.height
         if self.pos < 0 or self.pos >= len(self.built_lines):
             self.pos = 0
@@ -133,8 +254,15 @@ class TextWin(Win):
     def scroll_up(self, dist=14):
         pos = self.pos
         self.pos += dist
-        if self.pos + self.height > len(self.built_lines):
-            self.pos = len(self.built_lines) - self.height
+        if self.virtual:
+            self.materialize()
+            if not self.materialized_to_top():
+                return self.pos != pos
+            nb_lines = self._below_lines + len(self.built_lines)
+        else:
+            nb_lines = len(self.built_lines)
+        if self.pos + self.height > nb_lines:
+            self.pos = nb_lines - self.height
             if self.pos < 0:
                 self.pos = 0
         return self.pos != pos
@@ -151,8 +279,11 @@ class TextWin(Win):
         Scroll until separator is centered. If no separator is
         present, scroll at the top of the window
         """
-        if None in self.built_lines:
-            self.pos = len(self.built_lines) - self.built_lines.index(None) - self.height + 1
+        if self.virtual:
+            self.materialize_all()
+        index = self._separator_index()
+        if index != -1:
+            self.pos = len(self.built_lines) - index - self.height + 1
             if self.pos < 0:
                 self.pos = 0
         else:
@@ -162,7 +293,8 @@ class TextWin(Win):
         # Make “next highlight” work afterwards. This makes it easy to
         # review all the highlights since the separator was placed, in
         # the correct order.
-        self.hl_pos = len(self.highlights) - self.nb_of_highlights_after_separator - 1
+        self.hl_pos = max(len(self.highlights) -
+                          self.nb_of_highlights_after_separator - 1, -1)
         log.debug("self.hl_pos = %s", self.hl_pos)
 
     def remove_line_separator(self):
@@ -170,8 +302,14 @@ class TextWin(Win):
         Remove the line separator
         """
         log.debug('remove_line_separator')
-        if None in self.built_lines:
-            self.built_lines.remove(None)
+        index = self._separator_index()
+        if index != -1:
+            self._replace_lines(index, 1, [])
+            self._separator_pos = None
+            self.separator_after = None
+        elif self.virtual and self.separator_after is not None:
+            # the separator is in the part of the buffer that is not built
+            self._below_lines = None
             self.separator_after = None
 
     def add_line_separator(self, room=None):
@@ -180,36 +318,210 @@ class TextWin(Win):
         room is a textbuffer that is needed to get the previous message
         (in case of resize)
         """
-        if None not in self.built_lines:
+        if self.virtual and self._below:
+            # the separator goes after a message which is not built
+            if self.separator_after is None:
+                self.separator_after = self._last_seen_message(room)
+                if self.separator_after is not None:
+                    self._below_lines = None
+                    self.nb_of_highlights_after_separator = 0
+        elif self._separator_index() == -1:
+            self._separator_pos = self._offset + len(self.built_lines)
             self.built_lines.append(None)
             self.nb_of_highlights_after_separator = 0
             log.debug("Reseting number of highlights after separator")
             if room and room.messages:
-                self.separator_after = room.messages[-1]
+                self.separator_after = self._last_seen_message(room)
+
+    def _last_seen_message(self, room):
+        """
+        Return the last message of room which is not hidden by the lock,
+        after which the separator is added
+        """
+        if room is None:
+            return None
+        if self.virtual:
+            nb = len(room.messages) - self._locked
+        else:
+            nb = len(room.messages) - len([line for line in self.lock_buffer
+                                           if line and line.start_pos == 0])
+        return room.messages[nb - 1] if nb > 0 else None
+
+    def last_line_is_separator(self):
+        """
+        Return True if nothing has been added after the separator
+        """
+        if self.virtual and self._below:
+            return (self.separator_after is not None and
+                    self.separator_after is
+                    self._last_seen_message(self.text_buffer))
+        return bool(self.built_lines) and self.built_lines[-1] is None
 
     def build_new_message(self, message, history=None, clean=True, highlight=False, timestamp=False):
         """
         Take one message, build it and add it to the list
         Return the number of lines that are built for the given
         message.
+
+        In virtual mode, the message is only counted, and it will be
+        built if it needs to be displayed.
         """
+        if self.virtual and message is not None:
+            nb = self.count_lines(message, timestamp)
+            if self.lock:
+                self._locked += 1
+            else:
+                self._below += 1
+                if self._below_lines is not None:
+                    self._below_lines += nb
+            if highlight:
+                self.nb_of_highlights_after_separator += 1
+            return nb
         lines = self.build_message(message, timestamp=timestamp)
         if self.lock:
             self.lock_buffer.extend(lines)
         else:
-            self.built_lines.extend(lines)
+            self._append_lines(lines)
         if not lines or not lines[0]:
             return 0
         if highlight:
-            self.highlights.append(lines[0])
             self.nb_of_highlights_after_separator += 1
             log.debug("Number of highlights after separator is now %s",
                           self.nb_of_highlights_after_separator)
-        if clean:
-            while len(self.built_lines) > self.lines_nb_limit:
-                self.built_lines.pop(0)
+        if clean and len(self.built_lines) > self.lines_nb_limit:
+            self._remove_first_lines(len(self.built_lines) -
+                                     self.lines_nb_limit)
         return len(lines)
 
+    def build_new_messages(self, messages, timestamp=False):
+        """
+        Build several messages at once and add their lines to the list,
+        trimming it only once.
+        Return the number of lines that are built.
+        """
+        if self.virtual:
+            nb = 0
+            for message in messages:
+                nb += self.count_lines(message, timestamp)
+                if message.highlight:
+                    self.nb_of_highlights_after_separator += 1
+            if self.lock:
+                self._locked += len(messages)
+            else:
+                self._below += len(messages)
+                if self._below_lines is not None:
+                    self._below_lines += nb
+            return nb
+        lines = []
+        highlights = 0
+        for message in messages:
+            message_lines = self.build_message(message, timestamp=timestamp)
+            if message_lines and message.highlight:
+                highlights += 1
+            lines.extend(message_lines)
+        if self.lock:
+            self.lock_buffer.extend(lines)
+        else:
+            self._append_lines(lines)
+        if highlights:
+            self.nb_of_highlights_after_separator += highlights
+            log.debug("Number of highlights after separator is now %s",
+                          self.nb_of_highlights_after_separator)
+        if len(self.built_lines) > self.lines_nb_limit:
+            self._remove_first_lines(len(self.built_lines) -
+                                     self.lines_nb_limit)
+        return len(lines)
+
+    def prepend_messages(self, messages, timestamp=False):
+        """
+        Build messages older than all the others of the buffer, and add
+        their lines before the built ones, as far as there is room for
+        them. The displayed lines, which are counted from the bottom, and
+        the separator do not move.
+        """
+        if self.virtual:
+            # they are built when they are displayed, the bottom of the
+            # buffer does not change
+            return
+        room = self.lines_nb_limit - len(self.built_lines)
+        if room <= 0 or not self._built_to_top(len(messages)):
+            return
+        lines = []
+        for message in messages:
+            lines.extend(self.build_message(message, timestamp=timestamp))
+        if lines:
+            self._prepend_lines(lines[-room:])
+
+    def _built_messages_nb(self):
+        "The number of messages built (not in virtual mode)"
+        return len(self._starts) + len([line for line in self.lock_buffer
+                                        if line and line.start_pos == 0])
+
+    def _built_to_top(self, nb_new=0):
+        """
+        Return True if the lines of all the messages of the buffer, but
+        the nb_new oldest ones, are built (not in virtual mode)
+        """
+        if self.built_lines and self.built_lines[0] is not None and \
+                self.built_lines[0].start_pos != 0:
+            return False
+        return (self._built_messages_nb() ==
+                len(self.text_buffer.messages) - nb_new)
+
+    def displays_top(self):
+        "Return True if the oldest message of the buffer is displayed"
+        if self.text_buffer is None:
+            return False
+        if self.virtual:
+            self.materialize()
+            if not self.materialized_to_top():
+                return False
+            nb_lines = self._below_lines + len(self.built_lines)
+        else:
+            if not self._built_to_top():
+                return False
+            nb_lines = len(self.built_lines)
+        return self.pos + self.height >= nb_lines
+
+    def messages_above(self):
+        "Return the number of messages of the buffer above the displayed lines"
+        if self.text_buffer is None:
+            return 0
+        pos = self.pos
+        if self.virtual:
+            self.materialize()
+            pos -= self._below_lines
+            not_built = (len(self.text_buffer.messages) - self._locked -
+                         self._below - self._built_messages)
+        else:
+            not_built = (len(self.text_buffer.messages) -
+                         self._built_messages_nb())
+        top = max(len(self.built_lines) - pos - self.height, 0)
+        return (max(not_built, 0) +
+                bisect_left(self._starts, self._offset + top))
+
+    def forget_first_messages(self, nb):
+        """
+        Forget the lines of the nb oldest messages, which have just been
+        removed from the buffer
+        """
+        if self.virtual:
+            if len(self._messages()) < self._below + self._built_messages:
+                # some of them are built
+                self.rebuild_everything(self.text_buffer)
+            return
+        # the number of the first message built, in the old buffer
+        first = (len(self.text_buffer.messages) + nb -
+                 self._built_messages_nb())
+        removed = nb - first
+        if removed < 0:
+            return
+        if removed < len(self._starts):
+            end = self._starts[removed] - self._offset
+        else:
+            end = len(self.built_lines)
+        self._remove_first_lines(end)
+
     def build_message(self, message, timestamp=False):
         """
         Build a list of lines from a message, without adding it
@@ -221,11 +533,31 @@ class TextWin(Win):
         if not txt:
             return []
         if len(message.str_time) > 8:
-            default_color = (FORMAT_CHAR + dump_tuple(get_theme().COLOR_LOG_MSG)
-                    + '}')
+            default_attrs = [dump_tuple(get_theme().COLOR_LOG_MSG) + '}']
         else:
-            default_color = None
+            default_attrs = []
         ret = []
+        lines = wrap_cache.cut_text(message,
+                self.width-self.message_offset(message, timestamp)-1)
+        # The prepend of each line contains all the attributes that are
+        # active at its start, since the lines are displayed separately
+        attrs = list(default_attrs)
+        for line in lines:
+            if attrs:
+                prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
+            else:
+                prepend = ''
+            ret.append(Line(msg=message, start_pos=line[0], end_pos=line[1],
+                            prepend=prepend))
+            attrs = (parse_attrs(message.txt[line[0]:line[1]], attrs) or
+                     list(default_attrs))
+        return ret
+
+    def message_offset(self, message, timestamp=False):
+        """
+        Return the width taken by the things displayed before the text
+        of the message (time, nick, etc)
+        """
         nick = truncate_nick(message.nickname)
         offset = 0
         if message.ack:
@@ -243,30 +575,347 @@ class TextWin(Win):
                 offset += 1
             if get_theme().CHAR_TIME_RIGHT and message.str_time:
                 offset += 1
-        lines = poopt.cut_text(txt, self.width-offset-1)
-        prepend = default_color if default_color else ''
-        attrs = []
-        for line in lines:
-            saved = Line(msg=message, start_pos=line[0], end_pos=line[1], prepend=prepend)
-            attrs = parse_attrs(message.txt[line[0]:line[1]], attrs)
-            if attrs:
-                prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
+        return offset
+
+    def count_lines(self, message, timestamp=False):
+        """
+        Return the number of lines the message takes, without building
+        them. The result is cached until the width changes.
+        """
+        key = (self.width, timestamp)
+        if key != self._line_counts_key:
+            self._line_counts = {}
+            self._line_counts_key = key
+        nb = self._line_counts.get(message)
+        if nb is None:
+            if not message.txt:
+                nb = 0
             else:
-                if default_color:
-                    prepend = default_color
-                else:
-                    prepend = ''
-            ret.append(saved)
-        return ret
+                nb = len(wrap_cache.cut_text(message,
+                        self.width-self.message_offset(message, timestamp)-1))
+            if len(self._line_counts) > 2 * self.lines_nb_limit:
+                self._line_counts = {}
+            self._line_counts[message] = nb
+        return nb
+
+    def materialized_to_top(self):
+        """
+        Return True if the lines of the oldest message of the buffer
+        are built (virtual mode)
+        """
+        if self.text_buffer is None:
+            return True
+        return (self._below + self._built_messages >=
+                len(self.text_buffer.messages) - self._locked)
+
+    def _messages(self):
+        "The messages of the buffer, except those received while locked"
+        messages = self.text_buffer.messages
+        if self._locked:
+            return messages[:max(len(messages) - self._locked, 0)]
+        return messages
+
+    def _message_lines(self, message, timestamp):
+        "The lines of a message, followed by the separator if needed"
+        lines = self.build_message(message, timestamp=timestamp)
+        if message is self.separator_after:
+            lines.append(None)
+        return lines
+
+    def _lines_below(self, timestamp):
+        "Return (and compute if needed) the number of lines not built"
+        if self._below_lines is None:
+            messages = self._messages()
+            nb = 0
+            for i in range(1, self._below + 1):
+                message = messages[-i]
+                nb += self.count_lines(message, timestamp)
+                if message is self.separator_after:
+                    nb += 1
+            self._below_lines = nb
+        return self._below_lines
+
+    def materialize_all(self):
+        "Build the lines of all the messages (virtual mode)"
+        self.materialize(whole=True)
+
+    def materialize(self, whole=False):
+        """
+        Make sure that the lines around the displayed part of the buffer
+        are built, with a margin of one screen above and below, and
+        forget the others (virtual mode).
+        """
+        room = self.text_buffer
+        if not self.virtual or room is None:
+            return
+        timestamp = config.get('show_timestamps')
+        if (self._line_counts_key is not None and
+                self._line_counts_key != (self.width, timestamp)):
+            self.rebuild_everything(room)
+        messages = self._messages()
+        if self._below > len(messages):
+            self._below = len(messages)
+            self._below_lines = None
+        margin = max(self.height, 1)
+        if whole:
+            bottom = 0
+            top = float('inf')
+        else:
+            bottom = max(0, self.pos - margin)
+            top = self.pos + self.height + margin
+        below_lines = self._lines_below(timestamp)
+        if (self._built_messages and below_lines <= bottom and
+                (below_lines + len(self.built_lines) >= top or
+                    self.materialized_to_top())):
+            return
+
+        if bottom == 0 and below_lines <= top:
+            # Only a few messages are not built at the bottom: add them
+            new_lines = []
+            for i in range(self._below, 0, -1):
+                new_lines.extend(self._message_lines(messages[-i],
+                                                     timestamp))
+            self._append_lines(new_lines)
+            self._built_messages += self._below
+            self._below = 0
+            self._below_lines = 0
+            # then add older messages until the screen is filled
+            index = self._built_messages + 1
+            new_lines = []
+            while (len(self.built_lines) + len(new_lines) < top and
+                    index <= len(messages)):
+                new_lines[0:0] = self._message_lines(messages[-index],
+                                                     timestamp)
+                self._built_messages += 1
+                index += 1
+            if new_lines:
+                self._prepend_lines(new_lines)
+            self._trim_built_messages(top)
+            return
+
+        # Build everything again around the displayed lines, reusing
+        # the lines we already have
+        known = {}
+        for line in self.built_lines:
+            if line:
+                known.setdefault(line.msg, []).append(line)
+        below = 0
+        below_lines = 0
+        chunks = []
+        nb_lines = 0
+        index = 1
+        while index <= len(messages) and below_lines + nb_lines < top:
+            message = messages[-index]
+            index += 1
+            count = self.count_lines(message, timestamp)
+            if message is self.separator_after:
+                count += 1
+            if not chunks and below_lines + count <= bottom:
+                below += 1
+                below_lines += count
+                continue
+            lines = known.get(message)
+            if lines is None:
+                lines = self._message_lines(message, timestamp)
+            elif message is self.separator_after:
+                lines = lines + [None]
+            chunks.append(lines)
+            nb_lines += len(lines)
+        # the current highlight, counted from the first built message,
+        # is counted from the new first one
+        hl_pos = self.hl_pos
+        if hl_pos == hl_pos:
+            old_top = len(messages) - self._below - self._built_messages
+            new_top = len(messages) - below - len(chunks)
+            if new_top < old_top:
+                hl_pos += self._count_highlights(messages, new_top, old_top)
+            else:
+                hl_pos -= self._count_highlights(messages, old_top, new_top)
+        self._clear_lines()
+        lines = []
+        for chunk in reversed(chunks):
+            lines.extend(chunk)
+        self._append_lines(lines)
+        self.hl_pos = hl_pos
+        self._below = below
+        self._below_lines = below_lines
+        self._built_messages = len(chunks)
+
+    @staticmethod
+    def _count_highlights(messages, start, end):
+        "The number of highlights between two positions of messages"
+        return len([message for message in
+                    islice(messages, max(start, 0), max(end, 0))
+                    if message.highlight and message.txt])
+
+    def _separator_index(self):
+        "Return the index of the separator in built_lines, or -1"
+        if self._separator_pos is None:
+            return -1
+        return self._separator_pos - self._offset
+
+    def _index_lines(self, lines, start):
+        """
+        Register the separator found in the given lines, the first one
+        being at the position start, and return the positions and the
+        identifiers of the messages, and the positions of the highlights
+        """
+        starts = []
+        identifiers = []
+        highlights = []
+        for i, line in enumerate(lines, start):
+            if line is None:
+                self._separator_pos = i
+            elif line.start_pos == 0:
+                starts.append(i)
+                identifiers.append(line.msg.identifier)
+                if line.msg.highlight:
+                    highlights.append(i)
+        return starts, identifiers, highlights
+
+    def _message_identifier(self, number):
+        "Return the identifier of the built message with that number"
+        pos = self._starts[number - self._starts_offset]
+        return self.built_lines[pos - self._offset].msg.identifier
+
+    def _clear_lines(self):
+        "Forget all the built lines"
+        self.built_lines = []
+        self.highlights = []
+        self.hl_pos = float('nan')
+        self._starts = []
+        self._starts_offset = 0
+        self._spans = {}
+        self._offset = 0
+        self._separator_pos = None
+
+    def _append_lines(self, lines):
+        "Add lines at the end of built_lines"
+        start = self._offset + len(self.built_lines)
+        starts, identifiers, highlights = self._index_lines(lines, start)
+        self.built_lines.extend(lines)
+        self.highlights.extend(highlights)
+        number = self._starts_offset + len(self._starts)
+        for number, identifier in enumerate(identifiers, number):
+            if identifier:
+                self._spans[identifier] = number
+        self._starts.extend(starts)
+
+    def _prepend_lines(self, lines):
+        "Add lines at the start of built_lines"
+        self._offset -= len(lines)
+        starts, identifiers, highlights = self._index_lines(lines,
+                                                            self._offset)
+        self.built_lines[0:0] = lines
+        self.highlights[0:0] = highlights
+        self.hl_pos += len(highlights)
+        self._starts_offset -= len(starts)
+        self._starts[0:0] = starts
+        for number, identifier in enumerate(identifiers, self._starts_offset):
+            if identifier:
+                self._spans.setdefault(identifier, number)
+
+    def _unindex_messages(self, first, end):
+        "Remove the built messages between first and end from the index"
+        for number in range(first, end):
+            number += self._starts_offset
+            identifier = self._message_identifier(number)
+            if self._spans.get(identifier) == number:
+                del self._spans[identifier]
+
+    def _remove_first_lines(self, nb):
+        "Forget the nb oldest lines of built_lines"
+        removed = bisect_left(self._starts, self._offset + nb)
+        self._unindex_messages(0, removed)
+        del self._starts[:removed]
+        self._starts_offset += removed
+        del self.built_lines[:nb]
+        self._offset += nb
+        if (self._separator_pos is not None and
+                self._separator_pos < self._offset):
+            self._separator_pos = None
+        removed = bisect_left(self.highlights, self._offset)
+        if removed:
+            del self.highlights[:removed]
+            if self.virtual:
+                # the lines can be built again, with their highlights
+                self.hl_pos -= removed
+            else:
+                self.hl_pos = max(self.hl_pos - removed, -1)
+
+    def _replace_lines(self, index, nb, lines):
+        """
+        Replace the nb lines at the given index of built_lines with
+        other lines, and move the positions of the following ones
+        """
+        pos = self._offset + index
+        delta = len(lines) - nb
+        first = bisect_left(self._starts, pos)
+        end = bisect_left(self._starts, pos + nb)
+        self._unindex_messages(first, end)
+        starts, identifiers, highlights = self._index_lines(lines, pos)
+        self.built_lines[index:index+nb] = lines
+
+        if delta:
+            self._starts[first:] = starts + [start + delta for start in
+                                             self._starts[end:]]
+        else:
+            self._starts[first:end] = starts
+        number = self._starts_offset + first
+        for number, identifier in enumerate(identifiers, number):
+            if identifier:
+                self._spans[identifier] = number
+        shift = len(starts) - (end - first)
+        if shift:
+            # the following messages have another number now
+            for number in range(first + len(starts), len(self._starts)):
+                number += self._starts_offset
+                identifier = self._message_identifier(number)
+                if self._spans.get(identifier) == number - shift:
+                    self._spans[identifier] = number
+
+        first = bisect_left(self.highlights, pos)
+        end = bisect_left(self.highlights, pos + nb)
+        if delta:
+            self.highlights[first:] = highlights + [hl + delta for hl in
+                                                    self.highlights[end:]]
+        else:
+            self.highlights[first:end] = highlights
+        if self.hl_pos >= end:
+            self.hl_pos += len(highlights) - (end - first)
+        if (self._separator_pos is not None and
+                self._separator_pos >= pos + nb):
+            self._separator_pos += delta
+
+    def _trim_built_messages(self, top):
+        """
+        Forget the oldest built messages when there are more than
+        needed (virtual mode)
+        """
+        limit = max(self.lines_nb_limit, top)
+        if len(self.built_lines) <= limit:
+            return
+        cut = len(self.built_lines) - limit
+        while (cut < len(self.built_lines) and
+                (self.built_lines[cut] is None or
+                    self.built_lines[cut].start_pos != 0)):
+            cut += 1
+        self._built_messages -= len([line for line in self.built_lines[:cut]
+                                     if line and line.start_pos == 0])
+        self._remove_first_lines(cut)
 
     def refresh(self):
         log.debug('Refresh: %s', self.__class__.__name__)
         if self.height <= 0:
             return
-        if self.pos == 0:
+        pos = self.pos
+        if self.virtual:
+            self.materialize()
+            pos -= self._below_lines
+        if pos == 0:
             lines = self.built_lines[-self.height:]
         else:
-            lines = self.built_lines[-self.height-self.pos:-self.pos]
+            lines = self.built_lines[-self.height-pos:-pos]
         with_timestamps = config.get("show_timestamps")
         self._win.move(0, 0)
         self._win.erase()
@@ -329,8 +978,7 @@ class TextWin(Win):
                         offset += 1 + poopt.wcswidth(
                                     get_theme().CHAR_ACK_RECEIVED)
 
-                self.write_text(y, offset,
-                        line.prepend+line.msg.txt[line.start_pos:line.end_pos])
+                self.write_text(y, offset, line)
             if y != self.height-1:
                 self.addstr('\n')
         self._win.attrset(0)
@@ -343,11 +991,13 @@ class TextWin(Win):
                 self.width,
                 to_curses_attr(get_theme().COLOR_NEW_TEXT_SEPARATOR))
 
-    def write_text(self, y, x, txt):
+    def write_text(self, y, x, line):
         """
         write the text of a line.
         """
-        self.addstr_colored(txt, y, x)
+        self.move(y, x)
+        for text, attrs in line.segments():
+            self.addstr(text, attrs)
 
     def write_ack(self):
         color = get_theme().COLOR_CHAR_ACK
@@ -396,6 +1046,10 @@ class TextWin(Win):
 
         # reposition the scrolling after resize
         # (see #2450)
+        if self.virtual:
+            if self.pos:
+                self.scroll_up(0)
+            return
         buf_size = len(self.built_lines)
         if buf_size - self.pos < self.height:
             self.pos = buf_size - self.height
@@ -403,14 +1057,29 @@ class TextWin(Win):
                 self.pos = 0
 
     def rebuild_everything(self, room):
-        self.built_lines = []
+        if self.virtual:
+            # Nothing is built until it has to be displayed
+            self.text_buffer = room
+            self._clear_lines()
+            self._built_messages = 0
+            self._below = len(room.messages)
+            self._locked = 0
+            self._below_lines = None
+            self._line_counts = {}
+            self._line_counts_key = None
+            return
+        self._clear_lines()
+        self.lock_buffer = []
         with_timestamps = config.get('show_timestamps')
+        lines = []
         for message in room.messages:
-            self.build_new_message(message, clean=False, timestamp=with_timestamps)
+            lines.extend(self.build_message(message, timestamp=with_timestamps))
             if self.separator_after is message:
-                self.build_new_message(None)
-        while len(self.built_lines) > self.lines_nb_limit:
-            self.built_lines.pop(0)
+                lines.append(None)
+        self._append_lines(lines)
+        if len(self.built_lines) > self.lines_nb_limit:
+            self._remove_first_lines(len(self.built_lines) -
+                                     self.lines_nb_limit)
 
     def modify_message(self, old_id, message):
         """
@@ -418,18 +1087,71 @@ class TextWin(Win):
         (instead of rebuilding everything in order to correct a message)
         """
         with_timestamps = config.get('show_timestamps')
-        for i in range(len(self.built_lines)-1, -1, -1):
-            if self.built_lines[i] and self.built_lines[i].msg.identifier == old_id:
-                index = i
-                while index >= 0 and self.built_lines[index] and self.built_lines[index].msg.identifier == old_id:
-                    self.built_lines.pop(index)
-                    index -= 1
-                index += 1
-                lines = self.build_message(message, timestamp=with_timestamps)
-                for line in lines:
-                    self.built_lines.insert(index, line)
-                    index += 1
-                break
+        if (self.separator_after is not None and
+                self.separator_after.identifier == old_id):
+            self.separator_after = message
+        if self.virtual:
+            # the message may be in the part that is not built
+            self._line_counts.pop(message, None)
+            self._below_lines = None
+        number = self._spans.get(old_id)
+        if number is None:
+            return
+        lines = self.build_message(message, timestamp=with_timestamps)
+        if lines:
+            self._replace_message(number, lines)
+            return
+        index = self._starts[number - self._starts_offset] - self._offset
+        old_message = self.built_lines[index].msg
+        end = index + 1
+        while (end < len(self.built_lines) and self.built_lines[end] and
+                self.built_lines[end].msg is old_message):
+            end += 1
+        self._replace_lines(index, end - index, lines)
+
+    def _replace_message(self, number, lines):
+        """
+        Replace the lines of the built message with that number with the
+        lines of another message (a correction), which keeps its number.
+        Like _replace_lines, but without looking for the messages and
+        highlights in the lines.
+        """
+        starts = self._starts
+        built_lines = self.built_lines
+        i = number - self._starts_offset
+        pos = starts[i]
+        index = pos - self._offset
+        old_message = built_lines[index].msg
+        end = index + 1
+        while (end < len(built_lines) and built_lines[end] and
+                built_lines[end].msg is old_message):
+            end += 1
+        delta = len(lines) - (end - index)
+        built_lines[index:end] = lines
+
+        message = lines[0].msg
+        if self._spans.get(old_message.identifier) == number:
+            del self._spans[old_message.identifier]
+        if message.identifier:
+            self._spans[message.identifier] = number
+        if delta:
+            starts[i+1:] = [start + delta for start in starts[i+1:]]
+            if (self._separator_pos is not None and
+                    self._separator_pos > pos):
+                self._separator_pos += delta
+
+        if delta or old_message.highlight or message.highlight:
+            highlights = self.highlights
+            first = bisect_left(highlights, pos)
+            end = first + 1 if old_message.highlight else first
+            new = [pos] if message.highlight else []
+            if delta:
+                highlights[first:] = new + [hl + delta for hl in
+                                            highlights[end:]]
+            else:
+                highlights[first:end] = new
+            if self.hl_pos >= end:
+                self.hl_pos += len(new) - (end - first)
 
     def __del__(self):
         log.debug('** TextWin: deleting %s built lines', (len(self.built_lines)))
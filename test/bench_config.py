@@ -0,0 +1,74 @@
+"""
+Measure the time spent reading the configuration for each received
+message, with and without the cache of Config.get and
+Config.get_by_tabname.
+
+Run it from the root of the repository:
+
+    python3 test/bench_config.py [nb_messages] [nb_rooms]
+
+The messages are received in nb_rooms rooms, each having its own section
+in the configuration file.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append('src')
+
+import config
+
+# The options read for a message received in a room, with the methods
+# used to read them
+GLOBAL_OPTIONS = ['show_timestamps', 'beep_on', 'max_nick_length',
+                  'user_list_sort', 'filter_info_messages', 'create_gaps',
+                  'enable_xhtml_im', 'tmp_image_dir',
+                  'extract_inline_images']
+TAB_OPTIONS = ['highlight_on', 'group_corrections', 'disable_beep',
+               'hide_exit_join', 'display_user_color_in_join_part']
+
+def uncached(conf, nb_messages, rooms):
+    for i in range(nb_messages):
+        room = rooms[i % len(rooms)]
+        for option in GLOBAL_OPTIONS:
+            conf.read_value(option)
+        for option in TAB_OPTIONS:
+            conf.read_by_tabname(option, room)
+
+def cached(conf, nb_messages, rooms):
+    for i in range(nb_messages):
+        room = rooms[i % len(rooms)]
+        for option in GLOBAL_OPTIONS:
+            conf.get(option)
+        for option in TAB_OPTIONS:
+            conf.get_by_tabname(option, room)
+
+def main():
+    nb_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nb_rooms = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    rooms = ['room%s@muc%s.example.com' % (i, i % 10) for i in range(nb_rooms)]
+    config.post_logging_setup()
+    file_ = tempfile.NamedTemporaryFile(mode='w', delete=False)
+    file_.write('[Poezio]\nshow_timestamps = false\nbeep_on = highlight\n'
+                '[@muc1.example.com]\nhide_exit_join = 60\n')
+    for room in rooms:
+        file_.write('[%s]\nhighlight_on = poezio:slixmpp\n' % room)
+    file_.close()
+    try:
+        conf = config.Config(file_.name, config.DEFAULT_CONFIG)
+        print('%s messages in %s rooms, %s options read per message' %
+              (nb_messages, nb_rooms,
+               len(GLOBAL_OPTIONS) + len(TAB_OPTIONS)))
+        for name, func in (('uncached', uncached), ('cached', cached)):
+            start = time.perf_counter()
+            func(conf, nb_messages, rooms)
+            elapsed = time.perf_counter() - start
+            print('%-10s %.3fs (%.1fµs per message)' %
+                  (name, elapsed, elapsed / nb_messages * 1e6))
+    finally:
+        os.unlink(file_.name)
+
+if __name__ == '__main__':
+    main()
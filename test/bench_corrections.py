@@ -0,0 +1,89 @@
+"""
+Measure the time taken by TextWin.modify_message to correct messages in
+a full buffer, compared with the previous implementation which searched
+the lines of the message from the end of the buffer.
+
+Run it from the root of the repository:
+
+    python3 test/bench_corrections.py [nb_corrections] [distance]
+
+where distance is the number of messages between the corrected message
+and the end of the buffer.
+"""
+
+import sys
+import time
+from datetime import datetime
+
+sys.path.append('src')
+
+import config
+
+class ConfigShim(object):
+    def get(self, option, default='', section='Poezio'):
+        return config.DEFAULT_CONFIG.get(section, {}).get(option, default)
+
+config.config = ConfigShim()
+import core
+
+from text_buffer import TextBuffer
+from windows import TextWin
+
+def old_modify_message(win, old_id, message):
+    "The previous implementation of TextWin.modify_message"
+    for i in range(len(win.built_lines)-1, -1, -1):
+        if win.built_lines[i] and win.built_lines[i].msg.identifier == old_id:
+            index = i
+            while (index >= 0 and win.built_lines[index] and
+                    win.built_lines[index].msg.identifier == old_id):
+                win.built_lines.pop(index)
+                index -= 1
+            index += 1
+            lines = win.build_message(message, timestamp=True)
+            for line in lines:
+                win.built_lines.insert(index, line)
+                index += 1
+            break
+
+def fill(nb_messages):
+    buffer = TextBuffer(messages_nb_limit=nb_messages)
+    win = TextWin(lines_nb_limit=2048, virtual=False)
+    win.width, win.height = 80, 40
+    buffer.add_window(win)
+    for i in range(nb_messages):
+        buffer.add_message('message number %s ' % i * (i % 5 + 1),
+                           time=datetime(2015, 1, 1), nickname='nick%s' % (i % 7),
+                           identifier='id%s-0' % i, jid='room@example.com/nick')
+    return buffer, win
+
+def run(modify, nb_corrections, distance):
+    buffer, win = fill(1000)
+    elapsed = 0
+    for i in range(nb_corrections):
+        target = 999 - distance
+        old_id = '%s-%s' % ('id%s' % target, i)
+        new_id = '%s-%s' % ('id%s' % target, i + 1)
+        message = buffer.modify_message('correction %s ' % i * (i % 4 + 1),
+                                        old_id, new_id,
+                                        jid='room@example.com/nick')
+        start = time.perf_counter()
+        modify(win, old_id, message)
+        elapsed += time.perf_counter() - start
+    return elapsed, [(line.msg.txt, line.start_pos) if line else None
+                     for line in win.built_lines]
+
+def main():
+    nb_corrections = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    distance = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    old_time, old_lines = run(old_modify_message, nb_corrections, distance)
+    new_time, new_lines = run(TextWin.modify_message, nb_corrections, distance)
+    assert old_lines == new_lines
+    print('%s corrections, %s messages from the end of a full buffer'
+          % (nb_corrections, distance))
+    print('previous: %.3fs (%.1fµs per correction)'
+          % (old_time, old_time / nb_corrections * 1e6))
+    print('current:  %.3fs (%.1fµs per correction)'
+          % (new_time, new_time / nb_corrections * 1e6))
+
+if __name__ == '__main__':
+    main()
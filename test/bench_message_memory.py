@@ -0,0 +1,82 @@
+"""
+Compare the memory used by the TextBuffer messages with the old
+namedtuple layout and with the current Message class.
+
+Run it from the root of the repository:
+
+    python3 test/bench_message_memory.py [nb_tabs] [nb_messages]
+"""
+
+import collections
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.append('src')
+
+from text_buffer import Message, message_fields
+
+OldMessage = collections.namedtuple('OldMessage', message_fields)
+
+NICKS = ['user%s' % i for i in range(60)]
+
+def fresh(string):
+    "Return a new string object equal to string, like a parsed stanza would"
+    return ''.join(list(string))
+
+def make_old(txt, time, nick, identifier, old_message=None, revisions=0):
+    return OldMessage(txt=txt, nick_color=None, time=time,
+                      str_time=fresh(time.strftime('%H:%M:%S')),
+                      nickname=nick, user=None, identifier=identifier,
+                      highlight=False, me=False, old_message=old_message,
+                      revisions=revisions,
+                      jid=fresh('room@muc.example.com/%s' % nick), ack=None,
+                      offset=None)
+
+def make_new(txt, time, nick, identifier, old_message=None, revisions=0):
+    return Message(txt=txt, nick_color=None, time=time,
+                   str_time=fresh(time.strftime('%H:%M:%S')),
+                   nickname=nick, user=None, identifier=identifier,
+                   highlight=False, me=False, old_message=old_message,
+                   revisions=revisions,
+                   jid=fresh('room@muc.example.com/%s' % nick), ack=None)
+
+def fill(make, nb_messages, rand):
+    messages = []
+    time = datetime(2014, 1, 1)
+    for i in range(nb_messages):
+        time += timedelta(seconds=rand.randint(0, 3))
+        nick = fresh(rand.choice(NICKS))
+        txt = 'message number %s, with some text\x19o' % i
+        msg = make(txt, time, nick, 'id%s' % i)
+        # about one message out of ten gets corrected once or twice
+        for rev in range(rand.choice((0,) * 18 + (1, 2))):
+            msg = make(txt + ' (fixed)', time, nick, 'id%s-%s' % (i, rev),
+                       old_message=msg, revisions=msg.revisions + 1)
+        messages.append(msg)
+    return messages
+
+def measure(make, nb_tabs, nb_messages):
+    rand = random.Random(42)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tabs = [fill(make, nb_messages, rand) for i in range(nb_tabs)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tabs
+    return after - before
+
+def main():
+    nb_tabs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    nb_messages = int(sys.argv[2]) if len(sys.argv) > 2 else 2048
+    total = nb_tabs * nb_messages
+    old = measure(make_old, nb_tabs, nb_messages)
+    new = measure(make_new, nb_tabs, nb_messages)
+    print('%s tabs of %s messages' % (nb_tabs, nb_messages))
+    print('namedtuple: %10d bytes (%d bytes/message)' % (old, old // total))
+    print('Message:    %10d bytes (%d bytes/message)' % (new, new // total))
+    print('saved:      %9.1f%%' % (100 * (old - new) / old))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Measure the time taken by a MucTab to handle the presences of a large
+room, compared with the previous lookups of the occupants, which scanned
+the list of users for each presence.
+
+Run it from the root of the repository:
+
+    python3 test/bench_muc_join.py [nb_occupants]
+
+The presences of nb_occupants occupants are replayed (our own presence
+comes last, as sent by the server), followed by as many messages, status
+changes and departures.
+"""
+
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.append('src')
+
+import config
+
+class ConfigShim(object):
+    def get(self, option, default='', section='Poezio'):
+        return config.DEFAULT_CONFIG.get(section, {}).get(option, default)
+    def get_by_tabname(self, option, tabname, *args, **kwargs):
+        return self.get(option)
+
+config.config = ConfigShim()
+import core
+
+from slixmpp import JID, Presence
+from slixmpp.plugins.xep_0045 import MUCPresence
+from slixmpp.xmlstream import register_stanza_plugin
+
+from tabs import MucTab, Tab
+from tabs.muctab import NS_MUC_USER
+
+register_stanza_plugin(Presence, MUCPresence)
+
+class Events(object):
+    def trigger(self, *args, **kwargs):
+        pass
+
+class Frames(object):
+    def refresh(self, *args, **kwargs):
+        pass
+
+class XMPP(object):
+    boundjid = JID('me@example.com/poezio')
+
+class FakeCore(object):
+    "The parts of the Core used by a MucTab receiving presences"
+    information_win_size = 0
+    def __init__(self):
+        self.tabs = []
+        self.commands = {}
+        self.initial_joins = []
+        self.events = Events()
+        self.frames = Frames()
+        self.xmpp = XMPP()
+    def current_tab(self):
+        # another tab, whose input is the core itself
+        return self
+    @property
+    def input(self):
+        return self
+    def __getattr__(self, name):
+        # the other methods of the core (refresh, private tabs, …)
+        return lambda *args, **kwargs: None
+
+class BenchMucTab(MucTab):
+    "A MucTab without logs nor curses windows"
+    def resize(self):
+        self.text_win.width, self.text_win.height = 80, 40
+
+    def refresh_tab_win(self):
+        pass
+
+    def load_logs(self, log_nb):
+        return []
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+class LinearMucTab(BenchMucTab):
+    "The previous lookups of the occupants"
+    def handle_presence(self, presence):
+        # the joined check used to build the list of the nicks
+        if not self.joined:
+            [user.nick for user in self.users]
+        return BenchMucTab.handle_presence(self, presence)
+
+    def get_user_by_name(self, nick):
+        for user in self.users:
+            if user.nick == nick:
+                return user
+        return None
+
+def presence(nick, typ=None, show=None, own=False):
+    "Build the presence of an occupant of the room"
+    xml = ET.Element('{jabber:client}presence',
+                     {'from': 'room@muc.example.com/%s' % nick})
+    if typ:
+        xml.set('type', typ)
+    if show:
+        ET.SubElement(xml, '{jabber:client}show').text = show
+    x = ET.SubElement(xml, '{%s}x' % NS_MUC_USER)
+    ET.SubElement(x, '{%s}item' % NS_MUC_USER,
+                  {'affiliation': 'member', 'role': 'participant',
+                   'jid': '%s@example.com/resource' % nick})
+    if own:
+        ET.SubElement(x, '{%s}status' % NS_MUC_USER, {'code': '110'})
+    return Presence(xml=xml)
+
+def run(tab_class, nb_occupants):
+    nicks = ['nick%s' % i for i in range(nb_occupants)]
+    tab = tab_class('room@muc.example.com', 'me')
+    join = [presence(nick) for nick in nicks] + [presence('me', own=True)]
+    changes = [presence(nick, show='away') for nick in nicks]
+    leaves = [presence(nick, typ='unavailable') for nick in nicks]
+    times = []
+    start = time.perf_counter()
+    for stanza in join:
+        tab.handle_presence(stanza)
+    times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for nick in nicks:
+        tab.add_message('hello', nickname=nick)
+    times.append(time.perf_counter() - start)
+    for stanzas in (changes, leaves):
+        start = time.perf_counter()
+        for stanza in stanzas:
+            tab.handle_presence(stanza)
+        times.append(time.perf_counter() - start)
+    assert len(tab.users) == 1
+    return times
+
+def main():
+    nb_occupants = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    Tab.tab_core = FakeCore()
+    print('%s occupants' % nb_occupants)
+    print('%10s %10s %10s %10s %10s' % ('', 'join', 'messages', 'status',
+                                        'leave'))
+    for name, tab_class in (('previous', LinearMucTab), ('current', BenchMucTab)):
+        times = run(tab_class, nb_occupants)
+        print('%10s %s' % (name, ' '.join('%9.3fs' % t for t in times)))
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ from slixmpp import JID
 from datetime import timedelta
 from common import (datetime_tuple, get_utc_time, get_local_time, shell_split,
                     find_argument_quoted, find_argument_unquoted,
-                    parse_str_to_secs, parse_secs_to_str, safeJID)
+                    parse_str_to_secs, parse_date, parse_secs_to_str, safeJID)
 
 def test_datetime_tuple():
     time.timezone = 0
@@ -67,6 +67,14 @@ def test_parse_str_to_secs():
     assert parse_str_to_secs("1d3m1h") == 90180
     assert parse_str_to_secs("1d3mfaiiiiil") == 0
 
+def test_parse_date():
+    assert parse_date('2015-01-02') == datetime.datetime(2015, 1, 2)
+    assert parse_date('2015-01-02 10:30') == datetime.datetime(2015, 1, 2, 10, 30)
+    date = parse_date('2h')
+    delta = datetime.datetime.now() - date
+    assert timedelta(hours=2) <= delta < timedelta(hours=2, minutes=1)
+    assert parse_date('yesterday') is None
+
 def test_parse_secs_to_str():
     assert parse_secs_to_str(3601) == '1h1s'
     assert parse_secs_to_str(0) == '0s'
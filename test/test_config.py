@@ -112,3 +112,118 @@ class TestTabNames(object):
         assert config_obj.get_by_tabname('test_int', 'toto@toto.com', fallback=False) == ''
 
 
+
+class TestCache(object):
+    def test_invalidate(self, config_obj):
+        assert config_obj.get('cached', default=0) == 0
+        config_obj.set('cached', '12')
+        assert config_obj.get('cached', default=0) == 12
+        assert config_obj.get('cached', default='') == '12'
+        config_obj.set_and_save('cached', '13')
+        assert config_obj.get('cached', default=0) == 13
+        config_obj.remove_and_save('cached')
+        assert config_obj.get('cached', default=0) == 0
+
+    def test_tabname(self, config_obj):
+        assert config_obj.get_by_tabname('cached2', 'a@b.c') == ''
+        config_obj.set_and_save('cached2', 'server', section='@b.c')
+        assert config_obj.get_by_tabname('cached2', 'a@b.c') == 'server'
+        config_obj.set_and_save('cached2', 'room', section='a@b.c')
+        assert config_obj.get_by_tabname('cached2', 'a@b.c') == 'room'
+        config_obj.remove_and_save('cached2', section='a@b.c')
+        config_obj.remove_and_save('cached2', section='@b.c')
+        assert config_obj.get_by_tabname('cached2', 'a@b.c') == ''
+
+    def test_read_file(self, config_obj):
+        config_obj.set_and_save('cached3', 'old')
+        assert config_obj.get('cached3') == 'old'
+        config_obj.write_in_file('Poezio', 'cached3', 'new')
+        config_obj.read_file()
+        assert config_obj.get('cached3') == 'new'
+
+def test_delayed_writes(monkeypatch):
+    import asyncio
+    file_ = tempfile.NamedTemporaryFile(mode='w', delete=False)
+    file_.write('[Poezio]\nconfig_save_delay = 0.05\n')
+    file_.close()
+    conf = config.Config(file_.name, config.DEFAULT_CONFIG)
+    writes = []
+    write_file = conf._write_file
+    monkeypatch.setattr(conf, '_write_file',
+                        lambda lines: writes.append(lines) or write_file(lines))
+
+    def fold_groups():
+        for i in range(10):
+            conf.silent_set('folded_roster_groups', 'group%s' % i, 'var')
+        conf.remove_and_save('config_save_delay')
+        assert writes == []
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.call_soon(fold_groups)
+        loop.run_until_complete(asyncio.sleep(0.1))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    with open(file_.name) as fd:
+        assert fd.read() == '[Poezio]\n[var]\nfolded_roster_groups = group9\n'
+    assert len(writes) == 1
+    config.flush_all()
+    os.unlink(file_.name)
+
+def test_immediate_write(monkeypatch):
+    import asyncio
+    file_ = tempfile.NamedTemporaryFile(mode='w', delete=False)
+    file_.write('[Poezio]\nconfig_save_delay = 10\n')
+    file_.close()
+    conf = config.Config(file_.name, config.DEFAULT_CONFIG)
+    results = []
+
+    def set_options():
+        conf.silent_set('folded_roster_groups', 'group', 'var')
+        results.append(conf.set_and_save('nick', 'toto', now=True))
+        with open(file_.name) as fd:
+            results.append(fd.read())
+        monkeypatch.setattr(conf, '_write_file', lambda lines: False)
+        results.append(conf.set_and_save('nick', 'tata', now=True))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.call_soon(set_options)
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    assert results == [
+        ('nick=toto', 'Info'),
+        '[Poezio]\nconfig_save_delay = 10\nnick = toto\n'
+        '[var]\nfolded_roster_groups = group\n',
+        ('Unable to write in the config file', 'Error')]
+    assert conf.flush_handle is None
+    config.flush_all()
+    os.unlink(file_.name)
+
+def test_delayed_write_failure(monkeypatch):
+    import asyncio
+    file_ = tempfile.NamedTemporaryFile(mode='w', delete=False)
+    file_.write('[Poezio]\nconfig_save_delay = 0.01\n')
+    file_.close()
+    conf = config.Config(file_.name, config.DEFAULT_CONFIG)
+    failures = []
+    monkeypatch.setattr(config, 'on_flush_failure', failures.append)
+    monkeypatch.setattr(conf, '_write_file', lambda lines: False)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.call_soon(conf.silent_set, 'folded_roster_groups', 'group',
+                       'var')
+        loop.run_until_complete(asyncio.sleep(0.05))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    assert failures == [file_.name]
+    config.flush_all()
+    os.unlink(file_.name)
@@ -0,0 +1,90 @@
+"""
+Test the frame scheduler
+"""
+
+import asyncio
+import sys
+import pytest
+sys.path.append('src')
+
+class ConfigShim(object):
+    def __init__(self, max_fps):
+        self.max_fps = max_fps
+    def get(self, *args, **kwargs):
+        return self.max_fps
+
+import frame_scheduler
+from frame_scheduler import FrameScheduler
+
+class FakeCore(object):
+    def __init__(self):
+        self.calls = []
+        self.tab = object()
+    def current_tab(self):
+        return self.tab
+    def refresh_window_now(self):
+        self.calls.append('window')
+    def doupdate(self):
+        self.calls.append('update')
+
+@pytest.fixture
+def core():
+    return FakeCore()
+
+def test_coalesce(core, monkeypatch):
+    monkeypatch.setattr(frame_scheduler, 'config', ConfigShim(30))
+    frames = FrameScheduler(core)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        for i in range(10):
+            frames.refresh(core.calls.append, i)
+        frames.refresh(core.calls.append, 'other tab', tab=object())
+        assert core.calls == []
+        loop.run_until_complete(asyncio.sleep(0.05))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    assert core.calls == [9, 'update']
+    assert frames.frames == 1
+
+def test_full_refresh(core, monkeypatch):
+    monkeypatch.setattr(frame_scheduler, 'config', ConfigShim(30))
+    frames = FrameScheduler(core)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        frames.refresh(core.calls.append, 1)
+        frames.refresh_all()
+        frames.update()
+        loop.run_until_complete(asyncio.sleep(0.05))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    assert core.calls == ['window']
+
+def test_no_limit(core, monkeypatch):
+    monkeypatch.setattr(frame_scheduler, 'config', ConfigShim(0))
+    frames = FrameScheduler(core)
+    frames.refresh(core.calls.append, 1)
+    frames.refresh(core.calls.append, 2)
+    assert core.calls == [1, 'update', 2, 'update']
+
+def test_order(core, monkeypatch):
+    monkeypatch.setattr(frame_scheduler, 'config', ConfigShim(30))
+    frames = FrameScheduler(core)
+    calls = core.calls
+    text, header, input, users = [lambda name=name: calls.append(name)
+                                  for name in ('text', 'header', 'input',
+                                               'users')]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        # a message, then a presence, in the same frame
+        for func in (text, header, input, text, users, header, input):
+            frames.refresh(func)
+        loop.run_until_complete(asyncio.sleep(0.05))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    assert calls == ['text', 'users', 'header', 'input', 'update']
@@ -0,0 +1,46 @@
+"""
+Test the highlight module
+"""
+
+import re
+import sys
+sys.path.append('src')
+
+from highlight import Matcher, get_matcher, trie_pattern
+
+def test_nick():
+    matcher = Matcher('Toto', '')
+    assert matcher.search('hello toto')
+    assert matcher.search('TOTO: hi')
+    assert not matcher.search('totoro')
+    assert not matcher.search('hello')
+
+def test_nick_metacharacters():
+    matcher = Matcher('[bot]*', '')
+    assert matcher.search('hi [bot]*!')
+    assert matcher.search('[BOT]*')
+    assert not matcher.search('bot')
+    assert not matcher.search('x[bot]*y')
+
+def test_words():
+    matcher = Matcher('nick', 'foo:b.r:')
+    assert matcher.search('FOOBAR')
+    assert matcher.search('some b.r')
+    assert not matcher.search('bar')
+    assert not Matcher('', '').search('anything')
+
+def test_trie():
+    words = ['poezio', 'poe', 'xmpp', 'x', 'slix', 'a.b', 'ab']
+    regex = re.compile(trie_pattern(words))
+    for word in words:
+        assert regex.fullmatch(word)
+    assert not regex.fullmatch('po')
+    assert not regex.fullmatch('axb')
+    many = ['word%s' % i for i in range(50)]
+    matcher = Matcher('nick', ':'.join(many))
+    assert matcher.search('a WORD42 b')
+    assert not matcher.search('a wor b')
+
+def test_get_matcher():
+    assert get_matcher('nick', 'a:b') is get_matcher('nick', 'a:b')
+    assert get_matcher('nick', 'a:b') is not get_matcher('other', 'a:b')
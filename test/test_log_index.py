@@ -0,0 +1,81 @@
+"""
+Test the log_index module
+"""
+
+import sys
+sys.path.append('src')
+
+import log_index
+from log_index import LogIndex, LogLine, update_index, header_time, \
+                      parse_message_line
+
+MESSAGES = [b'MR 20150102T03:04:05Z 000 <toto>  coucou\n',
+            b'MI 20150102T03:04:06Z 001 toto joined\n second line\n',
+            b'MR 20150103T00:00:00Z 000 <titi>  MR inside\n']
+LOG = b''.join(MESSAGES)
+# the offsets of the messages
+FIRST, SECOND, THIRD = 0, len(MESSAGES[0]), len(MESSAGES[0] + MESSAGES[1])
+
+def offsets(data):
+    return list(log_index.scan(data))
+
+def test_header_time():
+    assert header_time(LOG) == 1420167845
+    assert header_time(b'MR garbage') is None
+
+def test_parse_message_line():
+    line = 'MR 20150102T03:04:05Z 002 <to to> \u00a0coucou'
+    assert parse_message_line(line) == LogLine(1420167845, 2, 'to to',
+                                               'coucou')
+    line = 'MI 20150102T03:04:05Z 000 <toto> \u00a0joined'
+    assert parse_message_line(line) == LogLine(1420167845, 0, None,
+                                               '<toto> \u00a0joined')
+    line = 'MR 20150102T03:04:05Z 000 <toto> '
+    assert parse_message_line(line + '\u00a0') == LogLine(1420167845, 0,
+                                                         'toto', '')
+    assert parse_message_line(line + 'coucou') is None
+    assert parse_message_line('MR 2015-01-02T03:04:05Z 000 x') is None
+    assert parse_message_line('') is None
+
+def test_scan():
+    assert offsets(LOG) == [FIRST, SECOND, THIRD]
+    assert offsets(b'') == []
+    assert offsets(b' continuation\nMR') == [14]
+
+def test_update(tmpdir):
+    log = tmpdir.join('room@example.com')
+    path = str(tmpdir.join('.index', 'room@example.com'))
+    log.write_binary(LOG[:THIRD])
+    assert update_index(str(log), path) == 2
+    log.write_binary(LOG)
+    assert update_index(str(log), path) == 1
+    assert update_index(str(log), path) == 0
+    with LogIndex(path) as index:
+        assert len(index) == 3
+        assert [index.offset(i) for i in range(3)] == [FIRST, SECOND, THIRD]
+        assert index.entry(1) == (SECOND, 1420167846)
+        assert index.count_before(THIRD) == 2
+        assert index.count_before(THIRD + 1) == 3
+        assert index.find_time(1420167846) == 1
+        assert index.find_time(1420243200) == 2
+        assert index.find_time(1420243201) == 3
+        assert index.covers(LOG, len(LOG))
+        assert not index.covers(LOG + LOG, 2 * len(LOG))
+
+def test_mismatch(tmpdir):
+    log = tmpdir.join('room@example.com')
+    path = str(tmpdir.join('.index', 'room@example.com'))
+    log.write_binary(LOG)
+    update_index(str(log), path)
+    # the log was replaced by a shorter one
+    log.write_binary(LOG[SECOND:])
+    assert update_index(str(log), path) == 2
+    with LogIndex(path) as index:
+        assert [index.offset(i) for i in range(len(index))] == [0, THIRD - SECOND]
+    assert update_index(str(log), path, rebuild=True) == 2
+
+def test_missing(tmpdir):
+    with LogIndex(str(tmpdir.join('nothing'))) as index:
+        assert len(index) == 0
+        assert index.covers(b'', 0)
+        assert not index.covers(LOG, len(LOG))
@@ -0,0 +1,60 @@
+"""
+Test the log_search module
+"""
+
+import sys
+sys.path.append('src')
+
+import log_search
+from log_search import (append_run, build, indexed_end, read_runs, record,
+                        search, word_hash)
+
+MESSAGES = [b'MR 20150102T03:04:05Z 000 <toto>  Hello world\n',
+            b'MI 20150102T03:04:06Z 001 titi joined\n the world\n',
+            b'MR 20150103T00:00:00Z 000 <titi>  hello Toto\n']
+LOG = b''.join(MESSAGES)
+FIRST, SECOND, THIRD = 0, len(MESSAGES[0]), len(MESSAGES[0] + MESSAGES[1])
+
+def find(path, *words):
+    return search(path, [word_hash(word) for word in words])
+
+def test_words():
+    assert log_search.words('Hello, world! hello') == {'hello', 'world'}
+
+def test_build(tmpdir):
+    log = tmpdir.join('room@example.com')
+    path = str(tmpdir.join('.search', 'room@example.com'))
+    log.write_binary(LOG)
+    assert not build(str(log), path, nb=2)
+    assert indexed_end(path) == THIRD
+    assert build(str(log), path, nb=2)
+    assert indexed_end(path) == len(LOG)
+    assert find(path, 'hello') == [FIRST, THIRD]
+    assert find(path, 'world') == [FIRST, SECOND]
+    assert find(path, 'hello', 'world') == [FIRST]
+    assert find(path, 'toto') == [FIRST, THIRD]
+    assert find(path, 'nothing') == []
+    assert search(path, [word_hash('hello')], since=FIRST + 1) == [THIRD]
+    # the log was replaced
+    log.write_binary(MESSAGES[0])
+    assert build(str(log), path)
+    assert find(path, 'hello') == [FIRST]
+
+def test_merge(tmpdir):
+    path = str(tmpdir.join('.search', 'room@example.com'))
+    for i in range(100):
+        append_run(path, [record(word_hash('word%s' % (i % 3)), i)], i + 1)
+    with open(path, 'rb') as fd:
+        runs = read_runs(fd)
+    assert len(runs) < 10
+    assert sum(run.count for run in runs) == 100
+    assert runs[-1].end == 100
+    assert find(path, 'word1') == list(range(1, 100, 3))
+
+def test_partial_run(tmpdir):
+    path = tmpdir.join('.search', 'room@example.com')
+    append_run(str(path), [record(1, 0)] * 10, 10)
+    append_run(str(path), [record(1, 10)], 20)
+    assert indexed_end(str(path)) == 20
+    path.write_binary(path.read_binary()[:-1])
+    assert indexed_end(str(path)) == 10
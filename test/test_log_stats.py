@@ -0,0 +1,46 @@
+"""
+Test the log_stats module
+"""
+
+import os
+import sys
+sys.path.append('src')
+
+import log_index
+import log_search
+from log_stats import log_stats, process_all
+
+LOG = ('MR 20150102T03:04:05Z 000 <toto> \u00a0coucou\n'
+       'MI 20150102T03:04:06Z 001 toto joined\n second line\n'
+       'MR 20150103T21:00:00Z 000 <titi> \u00a0salut toto\n'
+       'MR 20150103T21:00:01Z 000 <toto> \u00a0salut\n').encode('utf-8')
+
+def test_log_stats():
+    stats = log_stats(LOG)
+    assert stats['messages'] == 3
+    assert stats['infos'] == 1
+    assert stats['nicks'] == {'toto': 2, 'titi': 1}
+    assert stats['hours'][3] == 1 and stats['hours'][21] == 2
+    assert sum(stats['hours']) == 3
+    assert stats['first'] == log_index.header_time(LOG)
+    assert stats['last'] == 1420318801
+
+def test_process_all(tmpdir):
+    tmpdir.join('room@example.com').write_binary(LOG)
+    tmpdir.join('empty@example.com').write_binary(b'')
+    tmpdir.join('roster.log').write_binary(LOG)
+    log_dir = str(tmpdir)
+    done = []
+    results = process_all(log_dir, jobs=2, progress=done.append)
+    assert sorted(results) == sorted(done) == ['empty@example.com',
+                                               'room@example.com']
+    assert results['room@example.com']['messages'] == 3
+    assert results['empty@example.com']['messages'] == 0
+    path = log_index.index_path(log_dir, 'room@example.com')
+    with log_index.LogIndex(path) as index:
+        assert len(index) == 4
+    path = log_search.search_path(log_dir, 'room@example.com')
+    assert log_search.indexed_end(path) == len(LOG)
+    hashes = [log_search.word_hash('salut')]
+    assert len(log_search.search(path, hashes)) == 2
+    assert not os.path.exists(log_search.search_path(log_dir, 'roster.log'))
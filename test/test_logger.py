@@ -0,0 +1,254 @@
+"""
+Test the logger module
+"""
+
+import asyncio
+import sys
+from datetime import datetime
+import pytest
+sys.path.append('src')
+
+import config
+config.LOG_DIR = ''
+
+import logger
+from logger import Logger, format_message
+
+class ConfigShim(object):
+    def __init__(self, **options):
+        self.options = options
+    def get(self, option, *args, **kwargs):
+        return self.options.get(option, config.DEFAULT_CONFIG['Poezio'].get(option))
+    def get_by_tabname(self, option, *args, **kwargs):
+        return self.get(option)
+
+@pytest.fixture
+def log_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(logger, 'log_dir', str(tmpdir))
+    return tmpdir
+
+def use(monkeypatch, mode):
+    monkeypatch.setattr(logger, 'config',
+                        ConfigShim(use_log=True, log_flush=mode,
+                                   log_flush_interval=60.0))
+    return Logger()
+
+def test_format():
+    date = datetime(2015, 1, 2, 3, 4, 5)
+    assert format_message(date, 'toto', 'a\nb', 1) == \
+            'MR 20150102T03:04:05Z 001 <toto> \u00a0a \n b\n'
+    assert format_message(date, '', 'toto joined', 2) == \
+            'MI 20150102T03:04:05Z 000 toto joined \n'
+
+def test_always(log_dir, monkeypatch):
+    log = use(monkeypatch, 'always')
+    log.log_message('room@example.com', 'toto', 'coucou')
+    log.writer.flush(wait=True)
+    assert 'coucou' in log_dir.join('room@example.com').read()
+    log.stop()
+
+def test_interval(log_dir, monkeypatch):
+    log = use(monkeypatch, 'interval')
+    for i in range(10):
+        log.log_message('room@example.com', 'toto', 'message %s' % i)
+    log.log_roster_change('toto@example.com', 'got online')
+    log.writer.call(lambda: None, wait=True)
+    assert not log_dir.join('room@example.com').check()
+    log.flush()
+    assert log_dir.join('room@example.com').read().count('\nMR ') == 9
+    assert 'got online' in log_dir.join('roster.log').read()
+    log.stop()
+
+def test_exit(log_dir, monkeypatch):
+    log = use(monkeypatch, 'exit')
+    log.log_message('room@example.com', 'toto', 'x' * logger.MAX_BUFFER_SIZE)
+    log.log_message('other@example.com', 'toto', 'coucou')
+    log.writer.call(lambda: None, wait=True)
+    assert log_dir.join('room@example.com').check()
+    assert not log_dir.join('other@example.com').check()
+    log.stop()
+    assert not log.writer.is_alive()
+    assert 'coucou' in log_dir.join('other@example.com').read()
+    assert log.writer.fds == {}
+
+def test_get_logs(log_dir, monkeypatch):
+    log = use(monkeypatch, 'exit')
+    for i in range(5):
+        log.log_message('room@example.com', 'toto', 'message %s' % i)
+    logs = log.get_logs('room@example.com', 3)
+    assert [message['nickname'] for message in logs] == ['toto'] * 3
+    assert logs[-1]['txt'].endswith('message 4 ')
+    log.stop()
+
+def test_failure(log_dir, monkeypatch):
+    log = use(monkeypatch, 'always')
+    failures = []
+    log_dir.join('room@example.com').mkdir()
+    log.log_message('room@example.com', 'toto', 'coucou')
+    log.writer.call(lambda: None, wait=True)
+    # reported once there is a callback
+    log.writer.report_failures(failures.append)
+    log.writer.call(lambda: None, wait=True)
+    assert failures == ['room@example.com']
+    # only reported again once the file has been written
+    log.log_message('room@example.com', 'toto', 'coucou')
+    log.writer.call(lambda: None, wait=True)
+    assert failures == ['room@example.com']
+    log_dir.join('room@example.com').remove()
+    log.log_message('room@example.com', 'toto', 'coucou')
+    log.close('room@example.com')
+    log.writer.call(lambda: None, wait=True)
+    log_dir.join('room@example.com').remove()
+    log_dir.join('room@example.com').mkdir()
+    log.log_message('room@example.com', 'toto', 'coucou')
+    log.writer.call(lambda: None, wait=True)
+    assert failures == ['room@example.com'] * 2
+    log.stop()
+
+def test_open_files_limit(log_dir, monkeypatch):
+    monkeypatch.setattr(logger, 'config',
+                        ConfigShim(use_log=True, log_flush='always',
+                                   max_open_log_files=2))
+    log = Logger()
+    for jid in ('a@example.com', 'b@example.com', 'a@example.com',
+                'c@example.com', 'a@example.com', 'b@example.com'):
+        log.log_message(jid, 'toto', 'message to %s' % jid)
+    log.writer.call(lambda: None, wait=True)
+    assert list(log.writer.fds) == ['a@example.com', 'b@example.com']
+    assert log.writer.evictions == 2
+    assert log.writer.reopens == 1
+    assert log_dir.join('a@example.com').read().count('MR ') == 3
+    assert log_dir.join('b@example.com').read().count('MR ') == 2
+    log_dir.join('a@example.com').remove()
+    log.reload_all()
+    assert list(log.writer.fds) == ['a@example.com', 'b@example.com']
+    assert log_dir.join('a@example.com').check()
+    log.stop()
+
+def test_paging(log_dir, monkeypatch):
+    log = use(monkeypatch, 'interval')
+    for i in range(10):
+        log.log_message('room@example.com', 'toto', 'message %s' % i,
+                        date=datetime(2015, 1, 1, 12, i))
+    logs = log.get_logs('room@example.com', 4)
+    assert [m['txt'][-2] for m in logs] == ['6', '7', '8', '9']
+    older = log.get_logs('room@example.com', 4, before=logs[0]['offset'])
+    assert [m['txt'][-2] for m in older] == ['2', '3', '4', '5']
+    # the same without the index
+    log.stop()
+    log_dir.join('.index', 'room@example.com').remove()
+    assert log.get_logs('room@example.com', 4, before=logs[0]['offset']) == older
+    since = log.get_logs_since('room@example.com', datetime(2015, 1, 1, 12, 8), 5)
+    assert [m['txt'][-2] for m in since] == ['8', '9']
+    since = log.get_logs_since('room@example.com', datetime(2015, 1, 1), 2)
+    assert [m['txt'][-2] for m in since] == ['0', '1']
+    assert log.get_logs_since('room@example.com', datetime(2016, 1, 1)) == []
+
+def test_get_logs_async(log_dir, monkeypatch):
+    log = use(monkeypatch, 'interval')
+    for i in range(5):
+        log.log_message('room@example.com', 'toto', 'message %s' % i)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        future = log.get_logs_async('room@example.com', 3)
+        # logged after the tab was opened, and already shown by it
+        log.log_message('room@example.com', 'toto', 'live')
+        logs = loop.run_until_complete(asyncio.wait_for(future, 5))
+        assert [m['txt'][-2] for m in logs] == ['2', '3', '4']
+        future = log.get_logs_async('room@example.com', 0)
+        assert loop.run_until_complete(future) is None
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+        log.stop()
+
+def test_get_logs_async_disabled(log_dir, monkeypatch):
+    monkeypatch.setattr(logger, 'config', ConfigShim(use_log=False))
+    log = Logger()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        future = log.get_logs_async('room@example.com', 3)
+        assert loop.run_until_complete(future) is None
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    # the writer is not started for nothing
+    assert log.writer.ident is None
+
+def test_get_older_logs_async(log_dir, monkeypatch):
+    log = use(monkeypatch, 'interval')
+    for i in range(5):
+        log.log_message('room@example.com', 'toto', 'message %s' % i,
+                        date=datetime(2015, 1, 1, 12, i))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        logs = loop.run_until_complete(asyncio.wait_for(
+            log.get_logs_async('room@example.com', 2), 5))
+        assert [m['txt'][-2] for m in logs] == ['3', '4']
+        older = loop.run_until_complete(asyncio.wait_for(
+            log.get_older_logs_async('room@example.com', 2,
+                                     logs[0]['offset']), 5))
+        assert [m['txt'][-2] for m in older] == ['1', '2']
+        older = loop.run_until_complete(asyncio.wait_for(
+            log.get_older_logs_async('room@example.com', 5,
+                                     datetime(2015, 1, 1, 12, 2)), 5))
+        assert [m['txt'][-2] for m in older] == ['0', '1']
+        future = log.get_older_logs_async('room@example.com', 0, 0)
+        assert loop.run_until_complete(future) is None
+        since = loop.run_until_complete(asyncio.wait_for(
+            log.get_logs_since_async('room@example.com',
+                                     datetime(2015, 1, 1, 12, 3), 5), 5))
+        assert [m['txt'][-2] for m in since] == ['3', '4']
+        around = loop.run_until_complete(asyncio.wait_for(
+            log.get_logs_around_async('room@example.com',
+                                      logs[0]['offset'], 2), 5))
+        assert [m['txt'][-2] for m in around] == ['2', '3']
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+        log.stop()
+
+def test_search(log_dir, monkeypatch):
+    log = use(monkeypatch, 'interval')
+    # a log written before the search indexes existed
+    log_dir.join('old@example.com').write_binary(
+        format_message(datetime(2014, 1, 1), 'toto', 'Hello world', 1).encode())
+    for i in range(5):
+        log.log_message('room@example.com', 'toto', 'hello %s' % i,
+                        date=datetime(2015, 1, 1, 12, i))
+    log.log_message('room@example.com', 'titi', 'hello world',
+                    date=datetime(2015, 1, 2))
+    results = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    def search(*args, **kwargs):
+        done = asyncio.Event()
+        def callback(messages):
+            if messages is None:
+                done.set()
+            else:
+                results.append(messages)
+        log.search(*args, callback=callback, **kwargs)
+        loop.run_until_complete(asyncio.wait_for(done.wait(), 5))
+        found = [(m['jid'], m['txt'].strip()) for messages in results for m in messages]
+        del results[:]
+        return found
+    try:
+        assert search('hello world') == [('old@example.com', 'Hello world'),
+                                         ('room@example.com', 'hello world')]
+        assert search('hello 3') == [('room@example.com', 'hello 3')]
+        assert search('hello', jids=['room@example.com'],
+                      since=datetime(2015, 1, 1, 12, 3)) == \
+                [('room@example.com', 'hello world'),
+                 ('room@example.com', 'hello 4'),
+                 ('room@example.com', 'hello 3')]
+        # the new messages are added to the search index
+        log.log_message('old@example.com', 'toto', 'hello again')
+        assert search('again') == [('old@example.com', 'hello again')]
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+        log.stop()
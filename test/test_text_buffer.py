@@ -0,0 +1,223 @@
+"""
+Test the text_buffer module
+"""
+
+import sys
+import pytest
+sys.path.append('src')
+
+import config
+
+class ConfigShim(object):
+    def get(self, *args, **kwargs):
+        return ''
+
+config.config = ConfigShim()
+
+from text_buffer import TextBuffer, MessageRing, CorrectionError
+
+@pytest.fixture
+def buffer():
+    return TextBuffer(messages_nb_limit=3)
+
+def add(buff, txt, identifier=None, **kwargs):
+    return buff.add_message(txt, nickname='toto', identifier=identifier,
+                            jid='toto@example.com', **kwargs)
+
+class TestMessageRing(object):
+    def test_eviction(self, buffer):
+        for i in range(5):
+            add(buffer, str(i), identifier='id%s' % i)
+        assert len(buffer.messages) == 3
+        assert [msg.txt for msg in buffer.messages] == ['2\x19o', '3\x19o',
+                                                        '4\x19o']
+        assert buffer.messages[0].identifier == 'id2'
+        assert buffer.messages[-1].identifier == 'id4'
+        assert buffer.last_message.identifier == 'id4'
+        assert [msg.identifier for msg in buffer.messages[::-1]] == [
+                'id4', 'id3', 'id2']
+        assert [msg.identifier for msg in reversed(buffer.messages)] == [
+                'id4', 'id3', 'id2']
+
+    def test_index(self, buffer):
+        for i in range(5):
+            add(buffer, str(i), identifier='id%s' % i)
+        assert buffer.messages.find('id0') == -1
+        assert buffer.messages.find('id1') == -1
+        assert buffer.messages.find('id2') == 0
+        assert buffer.messages.find('id4') == 2
+        assert buffer.messages._ids.keys() == {'id2', 'id3', 'id4'}
+
+    def test_duplicate_ids(self):
+        ring = MessageRing(3)
+        first = TextBuffer.make_message('a', None, 'n', None, None, None,
+                                        'same')
+        second = TextBuffer.make_message('b', None, 'n', None, None, None,
+                                         'same')
+        ring.append(first)
+        ring.append(second)
+        assert ring[ring.find('same')] is second
+        for i in range(2):
+            ring.append(TextBuffer.make_message('c', None, 'n', None, None,
+                                                None, None))
+        # the first one got evicted, the second one is still indexed
+        assert ring[ring.find('same')] is second
+
+    def test_clear(self, buffer):
+        for i in range(5):
+            add(buffer, str(i), identifier='id%s' % i)
+        buffer.messages = []
+        assert not buffer.messages
+        assert buffer.last_message is None
+        assert buffer.messages.find('id4') == -1
+        add(buffer, 'new', identifier='id5')
+        assert buffer.messages.find('id5') == 0
+
+class TestAddMessages(object):
+    def test_add_messages(self, buffer):
+        built = []
+        class FakeWin(object):
+            pos = 0
+            virtual = False
+            def build_new_messages(self, messages, timestamp=False):
+                built.extend(messages)
+                return len(messages)
+        buffer.add_window(FakeWin())
+        nb = buffer.add_messages({'txt': str(i), 'nickname': 'toto',
+                                  'identifier': 'id%s' % i}
+                                 for i in range(5))
+        assert nb == 3
+        assert [msg.identifier for msg in buffer.messages] == [
+                'id2', 'id3', 'id4']
+        assert built == list(buffer.messages)
+        assert buffer.add_messages([]) == 0
+
+    def test_add_messages_capacity(self, buffer):
+        built = []
+        class FakeWin(object):
+            pos = 0
+            virtual = False
+            def build_new_message(self, message, **kwargs):
+                return 1
+            def build_new_messages(self, messages, timestamp=False):
+                built.extend(messages)
+                return len(messages)
+            def prepend_messages(self, messages, timestamp=False):
+                pass
+        buffer.add_window(FakeWin())
+        # the ring can hold 6 messages until it is trimmed
+        buffer.add_history([{'txt': str(i)} for i in range(6)], limit=6)
+        buffer.add_messages({'txt': str(i)} for i in range(4))
+        assert len(built) == 4
+        assert built == list(buffer.messages)[2:]
+        # nothing is kept, nothing is built
+        empty = TextBuffer(messages_nb_limit=0)
+        empty.add_window(FakeWin())
+        del built[:]
+        assert empty.add_messages({'txt': str(i)} for i in range(4)) == 0
+        assert built == []
+
+    def test_add_history(self, buffer):
+        prepended = []
+        class FakeWin(object):
+            pos = 0
+            virtual = False
+            def build_new_message(self, message, **kwargs):
+                return 1
+            def prepend_messages(self, messages, timestamp=False):
+                prepended.extend(messages)
+        buffer.add_window(FakeWin())
+        add(buffer, 'live', identifier='live')
+        nb = buffer.add_history([{'txt': str(i), 'nickname': 'toto',
+                                  'history': True} for i in range(5)])
+        assert nb == 2
+        assert [msg.txt for msg in buffer.messages] == [
+                '3\x19o', '4\x19o', 'live\x19o']
+        assert prepended == list(buffer.messages)[:2]
+        assert buffer.messages.find('live') == 2
+        assert buffer.add_history([{'txt': 'more'}]) == 0
+
+    def test_trim_history(self, buffer):
+        forgotten = []
+        class FakeWin(object):
+            pos = 0
+            virtual = False
+            def build_new_message(self, message, **kwargs):
+                return 1
+            def prepend_messages(self, messages, timestamp=False):
+                pass
+            def forget_first_messages(self, nb):
+                forgotten.append(nb)
+        buffer.add_window(FakeWin())
+        add(buffer, 'live', identifier='live')
+        nb = buffer.add_history([{'txt': str(i), 'offset': i * 10}
+                                 for i in range(5)], limit=6)
+        assert nb == 5
+        assert buffer.messages[0].offset == 0
+        assert buffer.messages[-1].offset is None
+        # the buffer keeps that size until it is trimmed
+        add(buffer, 'new', identifier='new')
+        assert len(buffer.messages) == 6
+        assert buffer.trim_history() == 3
+        assert forgotten == [3]
+        assert [msg.txt for msg in buffer.messages] == [
+                '4\x19o', 'live\x19o', 'new\x19o']
+        assert buffer.messages.find('new') == 2
+        assert buffer.trim_history() == 0
+
+class TestCorrections(object):
+    def test_ack(self, buffer):
+        add(buffer, 'coucou', identifier='id1')
+        add(buffer, 'other', identifier='id2')
+        msg = buffer.ack_message('id1')
+        assert msg.ack
+        assert buffer.messages[0].ack
+        assert not buffer.messages[1].ack
+        assert buffer.ack_message('nope') is None
+
+    def test_modify(self, buffer):
+        for i in range(4):
+            add(buffer, str(i), identifier='id%s' % i)
+        msg = buffer.modify_message('fixed', 'id2', 'id2b',
+                                    jid='toto@example.com')
+        assert msg.revisions == 1
+        assert msg.old_message.identifier == 'id2'
+        assert buffer.messages[1] is msg
+        assert buffer.messages.find('id2') == -1
+        assert buffer.messages.find('id2b') == 1
+
+    def test_modify_errors(self, buffer):
+        for i in range(4):
+            add(buffer, str(i), identifier='id%s' % i)
+        with pytest.raises(CorrectionError):
+            buffer.modify_message('fixed', 'id0', 'id0b',
+                                  jid='toto@example.com')
+        with pytest.raises(CorrectionError):
+            buffer.modify_message('fixed', 'id3', 'id3b',
+                                  jid='tata@example.com')
+
+    def test_ack_in_place(self, buffer):
+        add(buffer, 'coucou', identifier='id1')
+        msg = buffer.messages[0]
+        assert buffer.ack_message('id1') is msg
+        assert buffer.messages[0] is msg
+
+    def test_revisions(self, buffer):
+        add(buffer, 'first', identifier='id1')
+        buffer.modify_message('second', 'id1', 'id2', jid='toto@example.com')
+        msg = buffer.modify_message('/me third', 'id2', 'id3',
+                                    jid='toto@example.com')
+        assert msg.revisions == 2
+        assert msg.me
+        assert len(msg.revision_history) == 2
+        old = msg.old_message
+        assert old.txt == 'second\x19o'
+        assert old.identifier == 'id2'
+        assert old.revisions == 1
+        assert not old.me
+        assert old.nickname == 'toto'
+        older = old.old_message
+        assert older.txt == 'first\x19o'
+        assert older.revisions == 0
+        assert older.old_message is None
+        assert 'first' in repr(msg)
@@ -4,9 +4,11 @@ Test the functions in the `theming` module
 
 import sys
 import pytest
+from collections import OrderedDict
 sys.path.append('src')
 
-from theming import dump_tuple, read_tuple
+import theming
+from theming import dump_tuple, read_tuple, to_curses_attr
 
 def test_read_tuple():
     assert read_tuple('1,-1,u') == ((1, -1), 'u')
@@ -24,3 +26,64 @@ def test_dump_tuple():
     assert dump_tuple((1, 2, 'u')) == '1,2,u'
 
 
+
+class FakeCurses(object):
+    "Enough of the curses module to allocate color pairs"
+    COLORS = 256
+    COLOR_PAIRS = 4
+    A_BOLD = 1 << 21
+    A_UNDERLINE = 1 << 17
+    A_BLINK = 1 << 19
+
+    def __init__(self):
+        self.pairs = {}
+
+    def init_pair(self, pair, fg, bg):
+        assert 0 < pair < self.COLOR_PAIRS
+        self.pairs[pair] = (fg, bg)
+
+    def color_pair(self, pair):
+        return pair << 8
+
+    def pair_number(self, attr):
+        return (attr >> 8) & 0xff
+
+@pytest.fixture
+def fake_curses(monkeypatch):
+    fake = FakeCurses()
+    monkeypatch.setattr(theming, 'curses', fake)
+    monkeypatch.setattr(theming, 'curses_colors_dict', OrderedDict())
+    monkeypatch.setattr(theming, 'curses_attrs_dict', {})
+    monkeypatch.setattr(theming, 'curses_pairs_colors', {})
+    return fake
+
+def test_to_curses_attr_cache(fake_curses):
+    attr = to_curses_attr((1, -1, 'bu'))
+    assert attr == 1 << 8 | FakeCurses.A_BOLD | FakeCurses.A_UNDERLINE
+    assert to_curses_attr((1, -1)) == 1 << 8
+    fake_curses.init_pair = None
+    assert to_curses_attr((1, -1, 'bu')) == attr
+
+def test_to_curses_attr_recycle(fake_curses):
+    generation = theming.attrs_generation
+    assert to_curses_attr((1, -1)) == 1 << 8
+    assert to_curses_attr((2, -1)) == 2 << 8
+    assert to_curses_attr((3, -1)) == 3 << 8
+    assert theming.attrs_generation == generation
+    to_curses_attr((1, -1))
+    # (2, -1) is now the least recently used pair
+    assert to_curses_attr((4, -1)) == 2 << 8
+    assert fake_curses.pairs[2] == (4, -1)
+    assert theming.attrs_generation == generation + 1
+    assert to_curses_attr((2, -1)) == 3 << 8
+    assert fake_curses.pairs == {1: (1, -1), 2: (4, -1), 3: (2, -1)}
+
+def test_use_attrs(fake_curses):
+    attr = to_curses_attr((1, -1, 'b'))
+    to_curses_attr((2, -1))
+    to_curses_attr((3, -1))
+    # (1, -1) is displayed again, (2, -1) is recycled instead
+    theming.use_attrs(attr)
+    theming.use_attrs(FakeCurses.A_BOLD)
+    assert to_curses_attr((4, -1)) == 2 << 8
+    assert to_curses_attr((1, -1, 'b')) == attr
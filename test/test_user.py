@@ -0,0 +1,19 @@
+"""
+Test the User class
+"""
+
+import sys
+sys.path.append('src')
+
+from user import User
+
+def user(nick, role):
+    return User(nick, 'none', '', '', role, None)
+
+def test_sort_key():
+    users = [user('b', 'participant'), user('A', 'participant'),
+             user('z', 'moderator'), user('c', 'visitor'),
+             user('C', 'bogus'), user('a', 'moderator')]
+    by_key = sorted(users, key=User.sort_key)
+    assert [u.nick for u in by_key] == ['a', 'z', 'A', 'b', 'c', 'C']
+    assert by_key == sorted(users)
@@ -1,5 +1,7 @@
+import curses
 import pytest
 import sys
+from collections import OrderedDict
 sys.path.append('src')
 
 class ConfigShim(object):
@@ -11,6 +13,9 @@ config.config = ConfigShim()
 import core
 
 from windows import Input, HistoryInput, MessageInput, CommandInput
+from windows import text_win, funcs, base_wins, Win
+import theming
+from text_buffer import Message, TextBuffer
 
 @pytest.fixture
 def input():
@@ -74,3 +79,535 @@ class TestInput(object):
 
         assert input.text == 'this is a line of textz'
 
+
+
+def message(txt):
+    return Message(txt=txt, nick_color=None, time=None, str_time='',
+                   nickname='nick', user=None, identifier='', highlight=False,
+                   me=False, old_message=None, revisions=0, jid=None,
+                   ack=False)
+
+class TestWrapCache(object):
+
+    @pytest.fixture
+    def cache(self, monkeypatch):
+        class BudgetShim(object):
+            def get(self, *args, **kwargs):
+                return 4
+        monkeypatch.setattr(text_win, 'config', BudgetShim())
+        return text_win.WrapCache()
+
+    def test_hit(self, cache):
+        msg = message('coucou')
+        lines = cache.cut_text(msg, 10)
+        assert cache.cut_text(msg, 10) is lines
+        assert (cache.hits, cache.misses) == (1, 1)
+        cache.cut_text(msg, 20)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_budget(self, cache):
+        messages = [message('a b') for i in range(5)]
+        for msg in messages:
+            cache.cut_text(msg, 10)
+        assert cache.size == 4
+        assert cache.evictions == 1
+        assert id(messages[0]) not in cache.refs
+        cache.cut_text(messages[0], 10)
+        assert cache.misses == 6
+
+    def test_deleted_message(self, cache):
+        msg = message('coucou')
+        other = message('other')
+        cache.cut_text(msg, 10)
+        cache.cut_text(msg, 20)
+        cache.cut_text(other, 10)
+        assert cache.size == 3
+        # the cache does not keep the message alive
+        del msg
+        assert list(cache.entries) == [(id(other), 10)]
+        assert list(cache.refs) == [id(other)]
+        assert cache.size == 1
+
+@pytest.fixture
+def text_options(monkeypatch):
+    "The options used to build the lines of the TextWins"
+    class OptionsShim(object):
+        def get(self, option, *args, **kwargs):
+            return {'wrap_cache_size': 10000,
+                    'max_nick_length': 25}.get(option, '')
+    monkeypatch.setattr(text_win, 'config', OptionsShim())
+    monkeypatch.setattr(funcs, 'config', OptionsShim())
+
+def check_index(win):
+    """
+    Check that the positions of the messages, of the highlights and of
+    the separator kept by a TextWin match its lines
+    """
+    starts = [pos for pos, line in enumerate(win.built_lines, win._offset)
+              if line and line.start_pos == 0]
+    assert win._starts == starts
+    assert win.highlights == [
+            pos for pos in starts
+            if win.built_lines[pos - win._offset].msg.highlight]
+    separators = [pos for pos, line in enumerate(win.built_lines, win._offset)
+                  if line is None]
+    assert separators == ([] if win._separator_pos is None
+                          else [win._separator_pos])
+    for identifier, number in win._spans.items():
+        assert win._message_identifier(number) == identifier
+    for pos in starts:
+        identifier = win.built_lines[pos - win._offset].msg.identifier
+        assert identifier in win._spans
+
+@pytest.mark.usefixtures('text_options')
+class TestLazyBuild(object):
+    """
+    A TextWin in lazy mode (lazy_text_build) only builds the lines around
+    the displayed ones, and must display the same thing as a TextWin
+    building all of them
+    """
+
+    def windows(self, lazy_lines_nb_limit=20):
+        """
+        A buffer, displayed by an eager and a lazy TextWin, which builds
+        few more lines than the displayed ones
+        """
+        buffer = TextBuffer(messages_nb_limit=1000)
+        windows = []
+        for virtual in (False, True):
+            win = text_win.TextWin(lazy_lines_nb_limit if virtual else 10000,
+                                   virtual=virtual)
+            win.height, win.width = 5, 30
+            buffer.add_window(win)
+            windows.append(win)
+        return buffer, windows
+
+    def add(self, buffer, i, highlight=False):
+        buffer.add_message(' '.join('w%s' % i for _ in range(i % 7 + 1)),
+                           nickname='nick', identifier='id%s' % i,
+                           highlight=highlight)
+
+    def displayed(self, win):
+        "The text and the start of the lines in the window, like refresh"
+        pos = win.pos
+        if win.virtual:
+            win.materialize()
+            pos -= win._below_lines
+        lines = win.built_lines[len(win.built_lines) - win.height - pos:
+                                len(win.built_lines) - pos]
+        return [(line.msg.identifier, line.start_pos) if line else None
+                for line in lines]
+
+    def check(self, windows):
+        eager, lazy = windows
+        assert eager.pos == lazy.pos
+        assert self.displayed(eager) == self.displayed(lazy)
+
+    def test_highlights_after_new_message(self):
+        buffer, windows = self.windows()
+        for i in range(200):
+            self.add(buffer, i, highlight=i % 10 == 3)
+        for win in windows:
+            win.previous_highlight()
+            win.previous_highlight()
+        self.check(windows)
+        # received while the buffer is scrolled up
+        for i in range(200, 220):
+            self.add(buffer, i)
+        self.check(windows)
+        # the lazy window only keeps the lines around the bottom
+        for win in windows:
+            win.scroll_down(1000)
+        self.check(windows)
+        for win in windows:
+            win.scroll_up(150)
+        self.check(windows)
+        for win in windows:
+            win.next_highlight()
+        self.check(windows)
+        assert windows[0].hl_pos == windows[1].hl_pos == 19
+        for win in windows:
+            win.previous_highlight()
+            win.previous_highlight()
+        self.check(windows)
+
+    def test_separator_while_locked(self):
+        buffer, windows = self.windows()
+        for i in range(30):
+            self.add(buffer, i)
+        for win in windows:
+            win.toggle_lock()
+        for i in range(30, 33):
+            self.add(buffer, i)
+        for win in windows:
+            win.remove_line_separator()
+            win.add_line_separator(buffer)
+            assert win.separator_after is buffer.messages[29]
+            assert win.last_line_is_separator()
+        self.check(windows)
+        for win in windows:
+            win.toggle_lock()
+            assert not win.last_line_is_separator()
+        self.check(windows)
+        for pos in range(10):
+            for win in windows:
+                win.scroll_up(1)
+            self.check(windows)
+
+    def test_separator_while_scrolled(self):
+        buffer, windows = self.windows()
+        for i in range(30):
+            self.add(buffer, i)
+        for win in windows:
+            win.scroll_up(20)
+        # not built by the lazy window
+        for i in range(30, 40):
+            self.add(buffer, i)
+        for win in windows:
+            win.toggle_lock()
+        self.add(buffer, 40)
+        for win in windows:
+            win.remove_line_separator()
+            win.add_line_separator(buffer)
+            assert win.separator_after is buffer.messages[39]
+            assert win.last_line_is_separator()
+            win.toggle_lock()
+        for pos in range(40):
+            for win in windows:
+                win.scroll_down(1)
+            self.check(windows)
+        for win in windows:
+            win.scroll_to_separator()
+        self.check(windows)
+
+    def test_scroll_to_top(self):
+        buffer, windows = self.windows()
+        for i in range(100):
+            self.add(buffer, i)
+        scrolled = True
+        while scrolled:
+            scrolled = [win.scroll_up(3) for win in windows]
+            assert scrolled[0] == scrolled[1]
+            scrolled = scrolled[0]
+            self.check(windows)
+        # the top of the buffer is displayed
+        assert self.displayed(windows[1])[0] == ('id0', 0)
+        assert windows[1]._below_lines + len(windows[1].built_lines) == \
+                len(windows[0].built_lines)
+        while windows[0].pos:
+            for win in windows:
+                win.scroll_down(4)
+            self.check(windows)
+
+    def test_messages_while_scrolled(self):
+        buffer, windows = self.windows()
+        for i in range(50):
+            self.add(buffer, i)
+        for win in windows:
+            win.scroll_up(30)
+        displayed = self.displayed(windows[0])
+        for i in range(50, 80):
+            self.add(buffer, i)
+            self.check(windows)
+        # the same lines are still displayed
+        assert self.displayed(windows[0]) == displayed
+        # which are only counted by the lazy window
+        assert windows[1]._below >= 30
+        assert windows[1]._built_messages < 50
+        for win in windows:
+            win.scroll_down(1000)
+        self.check(windows)
+        assert self.displayed(windows[1])[-1][0] == 'id79'
+
+    def test_lock(self):
+        buffer, windows = self.windows()
+        for i in range(50):
+            self.add(buffer, i)
+        for win in windows:
+            win.scroll_up(10)
+            win.toggle_lock()
+        for i in range(50, 60):
+            self.add(buffer, i)
+            self.check(windows)
+        assert windows[1]._locked == 10
+        for win in windows:
+            win.scroll_down(1000)
+        self.check(windows)
+        # the messages received while locked are not displayed
+        assert self.displayed(windows[1])[-1][0] == 'id49'
+        for win in windows:
+            win.toggle_lock()
+        self.check(windows)
+        assert self.displayed(windows[1])[-1][0] == 'id59'
+        for win in windows:
+            win.scroll_up(10000)
+        self.check(windows)
+
+    def test_highlights(self):
+        buffer, windows = self.windows()
+        for i in range(100):
+            self.add(buffer, i, highlight=i % 7 == 0)
+        for win in windows:
+            win.scroll_up(100)
+        self.check(windows)
+        windows[1].materialize_all()
+        eager, lazy = windows
+        assert ([eager.built_lines[pos - eager._offset].msg.identifier
+                 for pos in eager.highlights] ==
+                [lazy.built_lines[pos - lazy._offset].msg.identifier
+                 for pos in lazy.highlights])
+        for i in range(16):
+            for win in windows:
+                win.previous_highlight()
+            self.check(windows)
+        for i in range(16):
+            for win in windows:
+                win.next_highlight()
+            self.check(windows)
+
+@pytest.mark.usefixtures('text_options')
+class TestLineIndex(object):
+    """
+    The positions of the messages, highlights and separator of a TextWin
+    are absolute, and must follow its lines when the oldest ones are
+    removed, or when some of them are replaced
+    """
+
+    def window(self, lines_nb_limit=10):
+        buffer = TextBuffer(messages_nb_limit=1000)
+        win = text_win.TextWin(lines_nb_limit, virtual=False)
+        win.height, win.width = 5, 30
+        buffer.add_window(win)
+        return buffer, win
+
+    def add(self, buffer, i, nb_lines=1, highlight=False):
+        # 5 words take a line of the window
+        buffer.add_message(' '.join(['w%02d' % i] * (5 * nb_lines)),
+                           nickname='nick', identifier='id%s' % i,
+                           highlight=highlight, jid='nick@example.com')
+
+    def correct(self, buffer, win, txt, old_id, new_id, highlight=False):
+        msg = buffer.modify_message(txt, old_id, new_id, highlight=highlight,
+                                    jid='nick@example.com')
+        win.modify_message(old_id, msg)
+        return len(win.build_message(msg))
+
+    def highlighted(self, win):
+        return [win.built_lines[pos - win._offset].msg.identifier
+                for pos in win.highlights]
+
+    def test_trim_past_highlight(self):
+        buffer, win = self.window()
+        for i in range(10):
+            self.add(buffer, i, highlight=i in (2, 8))
+        win.previous_highlight()
+        assert win.hl_pos == 1
+        check_index(win)
+        # the lines of the first highlight are removed
+        for i in range(10, 13):
+            self.add(buffer, i)
+        assert win._offset == 3
+        assert self.highlighted(win) == ['id8']
+        assert win.hl_pos == 0
+        assert win.built_lines[win.highlights[0] - win._offset].msg is \
+                buffer.messages[8]
+        for i in range(13, 20):
+            self.add(buffer, i)
+        assert win._offset == 10
+        assert self.highlighted(win) == []
+        assert win.hl_pos == -1
+        check_index(win)
+
+    def test_trim_separator(self):
+        buffer, win = self.window()
+        for i in range(4):
+            self.add(buffer, i)
+        win.add_line_separator(buffer)
+        assert win._separator_index() == 4
+        for i in range(4, 9):
+            self.add(buffer, i, highlight=True)
+        assert win.nb_of_highlights_after_separator == 5
+        check_index(win)
+        # the separator is the last line removed
+        self.add(buffer, 9, nb_lines=6)
+        assert win._offset == 6
+        assert win._separator_index() == -1
+        assert win._separator_pos is None
+        check_index(win)
+        win.add_line_separator(buffer)
+        assert win._separator_index() == 10
+        check_index(win)
+
+    def test_replace_lines(self):
+        buffer, win = self.window(lines_nb_limit=100)
+        for i in range(10):
+            self.add(buffer, i, nb_lines=2 if i == 5 else 1,
+                     highlight=i in (3, 7))
+        win.add_line_separator(buffer)
+        self.add(buffer, 10, highlight=True)
+        # trimmed, so that the positions do not start at 0
+        win._remove_first_lines(2)
+        check_index(win)
+        separator = win._separator_pos
+        highlights = list(win.highlights)
+        # a message before the highlights takes more lines
+        delta = self.correct(buffer, win, ' '.join(['x'] * 40),
+                             'id2', 'id2b') - 1
+        assert delta > 0
+        check_index(win)
+        assert win._separator_pos == separator + delta
+        assert win.highlights == [pos + delta for pos in highlights]
+        assert win._spans['id2b'] == win._spans['id3'] - 1
+        # and one line less between the highlights
+        self.correct(buffer, win, 'y', 'id5', 'id5b')
+        check_index(win)
+        assert win._separator_pos == separator + delta - 1
+        assert win.highlights == [highlights[0] + delta] + [
+                pos + delta - 1 for pos in highlights[1:]]
+        assert self.highlighted(win) == ['id3', 'id7', 'id10']
+
+    def test_corrections(self):
+        buffer, win = self.window(lines_nb_limit=1000)
+        for i in range(20):
+            self.add(buffer, i, nb_lines=i % 3 + 1, highlight=i % 4 == 0)
+        win.add_line_separator(buffer)
+        for i in range(20, 25):
+            self.add(buffer, i, highlight=True)
+        for i in range(3):
+            win.previous_highlight()
+        assert self.highlighted(win)[win.hl_pos] == 'id22'
+        ids = {i: 'id%s' % i for i in range(25)}
+        corrections = [(3, 1, False), (0, 3, True), (24, 2, False),
+                       (12, 1, False), (12, 4, True), (7, 2, True),
+                       (19, 1, False), (20, 3, False), (4, 1, True)]
+        for n, (i, nb_lines, highlight) in enumerate(corrections):
+            new_id = '%s-%s' % (ids[i], n)
+            self.correct(buffer, win, ' '.join(['c%02d' % n] * 5 * nb_lines),
+                         ids[i], new_id, highlight)
+            ids[i] = new_id
+            check_index(win)
+            assert self.highlighted(win)[win.hl_pos] == 'id22'
+            # the same as if all the lines were built again
+            rebuilt = text_win.TextWin(1000, virtual=False)
+            rebuilt.width = win.width
+            rebuilt.separator_after = win.separator_after
+            rebuilt.rebuild_everything(buffer)
+            assert [(line.msg, line.start_pos) if line else None
+                    for line in win.built_lines] == \
+                   [(line.msg, line.start_pos) if line else None
+                    for line in rebuilt.built_lines]
+            assert win._starts == rebuilt._starts
+            assert win._spans == rebuilt._spans
+            assert win.highlights == rebuilt.highlights
+            assert win._separator_pos == rebuilt._separator_pos
+
+class FakeCurses(object):
+    "Enough of the curses module to allocate color pairs"
+    A_BOLD = curses.A_BOLD
+    A_UNDERLINE = curses.A_UNDERLINE
+    A_BLINK = curses.A_BLINK
+
+    def __init__(self, colors, color_pairs):
+        self.COLORS = colors
+        self.COLOR_PAIRS = color_pairs
+
+    def init_pair(self, pair, fg, bg):
+        pass
+
+    def color_pair(self, pair):
+        return pair << 8
+
+    def pair_number(self, attr):
+        return (attr & curses.A_COLOR) >> 8
+
+class AttrsWin(object):
+    "A curses window recording the attributes of the text written on it"
+    def __init__(self):
+        self.attrs = 0
+        self.runs = []
+
+    def attron(self, attr):
+        # the color of attr replaces the current one
+        if attr & curses.A_COLOR:
+            self.attrs &= ~curses.A_COLOR
+        self.attrs |= attr
+
+    def attrset(self, attr):
+        self.attrs = attr
+
+    def addstr(self, text):
+        if not text:
+            return
+        if self.runs and self.runs[-1][1] == self.attrs:
+            self.runs[-1] = (self.runs[-1][0] + text, self.attrs)
+        else:
+            self.runs.append((text, self.attrs))
+
+class TestCompileColored(object):
+    """
+    compile_colored must give the same attributes as the ones set by
+    Win.addstr_colored
+    """
+
+    texts = ['plain text',
+             '\x19bbold\x19o plain',
+             '\x19uunderlined, \x19bbold too\x19o reset',
+             '\x191}red \x192}green\x19o default',
+             '\x19196}256 colors \x19bwith bold\x19o end',
+             '\x1912,-1,u}underlined color \x19byellow\x1911,4}other',
+             '\x193,-1,b}bold color \x19o\x19ureset then underlined',
+             '\x19-1,-1}default colors \x19o',
+             '\x19b\x191}\x19u\x193}nested',
+             'ends with a format char\x19',
+             '\x19obb\x19\x19o\x19bx']
+
+    @pytest.fixture(params=[256, 8])
+    def colors(self, request, monkeypatch):
+        monkeypatch.setattr(theming, 'curses', FakeCurses(request.param, 64))
+        monkeypatch.setattr(theming, 'curses_colors_dict', OrderedDict())
+        monkeypatch.setattr(theming, 'curses_attrs_dict', {})
+        monkeypatch.setattr(theming, 'curses_pairs_colors', {})
+        monkeypatch.setattr(theming, 'attrs_generation',
+                            theming.attrs_generation)
+
+    @pytest.mark.usefixtures('colors')
+    @pytest.mark.parametrize('text', texts)
+    def test_addstr_colored(self, text):
+        win = Win()
+        win._win = AttrsWin()
+        win.addstr_colored(text)
+        assert base_wins.compile_colored(text) == tuple(win._win.runs)
+
+    def test_segments_generation(self, monkeypatch):
+        fake = FakeCurses(256, 3)
+        monkeypatch.setattr(theming, 'curses', fake)
+        monkeypatch.setattr(theming, 'curses_colors_dict', OrderedDict())
+        monkeypatch.setattr(theming, 'curses_attrs_dict', {})
+        monkeypatch.setattr(theming, 'curses_pairs_colors', {})
+        monkeypatch.setattr(theming, 'attrs_generation', 0)
+        line = base_wins.Line(message('\x191}red'), 0, 6, '')
+        segments = line.segments()
+        assert segments == (('red', theming.to_curses_attr((1, -1))),)
+        assert line.segments() is segments
+        # the pair of (1, -1) is recycled for another color
+        theming.to_curses_attr((2, -1))
+        theming.to_curses_attr((3, -1))
+        assert theming.attrs_generation == 1
+        assert line.segments() is not segments
+        assert line.segments()[0] == ('red', theming.to_curses_attr((1, -1)))
+        assert line.segments()[0] != segments[0]
+
+    def test_segments_keep_pairs(self, monkeypatch):
+        monkeypatch.setattr(theming, 'curses', FakeCurses(256, 3))
+        monkeypatch.setattr(theming, 'curses_colors_dict', OrderedDict())
+        monkeypatch.setattr(theming, 'curses_attrs_dict', {})
+        monkeypatch.setattr(theming, 'curses_pairs_colors', {})
+        monkeypatch.setattr(theming, 'attrs_generation', 0)
+        line = base_wins.Line(message('\x191}red'), 0, 6, '')
+        segments = line.segments()
+        theming.to_curses_attr((2, -1))
+        # the line is displayed again, the pair of (2, -1) is recycled
+        assert line.segments() is segments
+        theming.to_curses_attr((3, -1))
+        assert theming.curses_colors_dict == OrderedDict([((1, -1), 1),
+                                                          ((3, -1), 2)])